@@ -0,0 +1,197 @@
+"""Multi-process load test for concurrent writes to the data files.
+
+Seeds a temporary data directory with one course of students, then starts
+``--workers`` processes that hammer it at the same time through the public
+services with a mix of propose / respond / add_slot / search-overlap calls.
+Afterwards the final files are checked against what every worker was told
+succeeded, and the report lists throughput, latency percentiles per
+operation, lost updates (an acknowledged write that is not in the final
+data) and session ids handed out more than once. Run from the repository
+root:
+
+    python benchmarks/load_test.py --workers 8 --ops 300
+
+Storage settings are read from the environment as usual, so the same run
+can be repeated with e.g. STUDYBUDDY_SHARDS=4 or STUDYBUDDY_SNAPSHOTS=1.
+Exits non-zero if any lost update or duplicate id was found.
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+COURSE = "CPSC 3720"
+DAYS = ["TUE", "WED", "THU", "FRI", "SAT", "SUN"]  # add_slot targets; Monday is seeded
+OPS = ("propose", "respond", "add_slot", "search_overlap")
+
+
+def _email(i: int) -> str:
+    return f"student{i}@clemson.edu"
+
+
+def seed(users: int) -> None:
+    from studybuddy import storage
+    from studybuddy.models import AvailabilitySlot, UserProfile
+    storage.save_all([
+        UserProfile(name=f"Student {i}", email=_email(i), courses=[COURSE],
+                    availability=[AvailabilitySlot("MON", "08:00", "20:00")])
+        for i in range(users)
+    ])
+
+
+def _hhmm(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def worker(wid: int, args: argparse.Namespace, mix: Dict[str, int], start, results) -> None:
+    """Run ``args.ops`` random operations and send back timings and acknowledged writes."""
+    from studybuddy.errors import ValidationError
+    from studybuddy.availability_service import AvailabilityService
+    from studybuddy.search_service import SearchService
+    from studybuddy.session_service import SessionService
+
+    rng = random.Random(args.seed * 1000 + wid)
+    sessions, search, availability = SessionService(), SearchService(), AvailabilityService()
+    ops, weights = zip(*mix.items())
+    timings: List[Tuple[str, float, str]] = []  # (op, seconds, outcome)
+    proposed: List[Tuple[int, str, str, str]] = []  # (id, requester, invitee, start)
+    responded: List[Tuple[int, str]] = []  # (id, status)
+    slots: List[Tuple[str, str, str, str]] = []  # (email, day, start, end)
+    start.wait()
+    for _ in range(args.ops):
+        op = rng.choices(ops, weights)[0]
+        me = _email(rng.randrange(args.users))
+        t0 = time.perf_counter()
+        try:
+            if op == "propose":
+                other = _email(rng.randrange(args.users))
+                begin = rng.randrange(8 * 60, 19 * 60, 30)
+                s = sessions.propose(me, other, COURSE, "Mon", _hhmm(begin), _hhmm(begin + 60))
+                proposed.append((s.id, s.requester, s.invitee, s.start))
+            elif op == "respond":
+                pending = next(iter(sessions.iter_incoming_requests(me)), None)
+                if pending is None:
+                    raise ValidationError("no pending request")
+                s = sessions.respond(pending.id, me, rng.choice(["accept", "decline"]))
+                responded.append((s.id, s.status))
+            elif op == "add_slot":
+                day, begin = rng.choice(DAYS), rng.randrange(8 * 60, 20 * 60, 15)
+                window = (_hhmm(begin), _hhmm(begin + rng.choice([30, 60, 90])))
+                availability.add_slot(me, day, *window)
+                slots.append((me, day, *window))
+            else:
+                search.overlap_with_classmates(me, COURSE)
+            outcome = "ok"
+        except ValidationError:
+            outcome = "rejected"  # expected: self-invites, nothing pending, already answered
+        except Exception as e:  # noqa: BLE001 - anything else is a concurrency bug to report
+            outcome = type(e).__name__
+        timings.append((op, time.perf_counter() - t0, outcome))
+    results.put((timings, proposed, responded, slots))
+
+
+def verify(proposed, responded, slots) -> Dict[str, int]:
+    """Compare acknowledged writes with the final data files."""
+    from studybuddy import session_storage, storage
+    from studybuddy.availability_service import _parse_time
+
+    final = {s.id: s for s in session_storage.load_all()}
+    stored_ids = Counter(s.id for s in session_storage.load_all())
+    claims = Counter(p[0] for p in proposed)
+    lost_proposals = sum(
+        1 for sid, req, inv, start in proposed
+        if sid not in final or (final[sid].requester, final[sid].invitee, final[sid].start) != (req, inv, start)
+    )
+    lost_responses = sum(1 for sid, status in responded if sid not in final or final[sid].status != status)
+    users = {u.email: u for u in storage.load_all()}
+    lost_slots = 0
+    for email, day, start, end in slots:
+        s, e = _parse_time(start), _parse_time(end)
+        have = users[email].availability if email in users else []
+        if not any(x.day == day and _parse_time(x.start) <= s and _parse_time(x.end) >= e for x in have):
+            lost_slots += 1
+    return {
+        "lost proposals": lost_proposals,
+        "lost responses": lost_responses,
+        "lost slots": lost_slots,
+        "ids issued twice": sum(n - 1 for n in claims.values() if n > 1),
+        "ids stored twice": sum(n - 1 for n in stored_ids.values() if n > 1),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--workers", type=int, default=4, help="Concurrent worker processes")
+    p.add_argument("--ops", type=int, default=200, help="Operations per worker")
+    p.add_argument("--users", type=int, default=200, help="Seeded students (all in one course)")
+    p.add_argument("--mix", default="propose=3,respond=2,add_slot=3,search_overlap=2",
+                   help="Relative weights per operation")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args(argv)
+    mix = {k: int(v) for k, v in (part.split("=") for part in args.mix.split(","))}
+    unknown = set(mix) - set(OPS)
+    if unknown:
+        p.error(f"unknown operation(s) in --mix: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as d:
+        # Set before the workers start so every process uses the temp dir
+        os.environ["STUDYBUDDY_DATA_PATH"] = os.path.join(d, "users.json")
+        os.environ["STUDYBUDDY_SESSIONS_PATH"] = os.path.join(d, "sessions.json")
+        seed(args.users)
+        ctx = mp.get_context("spawn")  # no inherited in-process caches
+        start, results = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(w, args, mix, start, results)) for w in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        t0 = time.perf_counter()
+        start.set()
+        outputs = [results.get() for _ in procs]
+        wall = time.perf_counter() - t0
+        for proc in procs:
+            proc.join()
+        timings = [t for out in outputs for t in out[0]]
+        checks = verify(*([x for out in outputs for x in out[i]] for i in (1, 2, 3)))
+
+    print(f"{args.workers} workers x {args.ops} ops, {args.users} users: "
+          f"{len(timings) / wall:.0f} ops/s over {wall:.2f} s")
+    print(f"{'operation':<16}{'count':>7}{'ok':>7}{'rejected':>9}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    by_op: Dict[str, List[Tuple[float, str]]] = defaultdict(list)
+    for op, seconds, outcome in timings:
+        by_op[op].append((seconds, outcome))
+    errors: Counter = Counter()
+    for op in OPS:
+        rows = by_op.get(op)
+        if not rows:
+            continue
+        outcomes = Counter(o for _, o in rows)
+        errors.update({o: n for o, n in outcomes.items() if o not in ("ok", "rejected")})
+        ms = [s * 1000 for s, _ in rows]
+        print(f"{op:<16}{len(rows):>7}{outcomes['ok']:>7}{outcomes['rejected']:>9}"
+              f"{len(rows) - outcomes['ok'] - outcomes['rejected']:>7}"
+              f"{statistics.median(ms):>9.1f}{percentile(ms, 95):>9.1f}{percentile(ms, 99):>9.1f}")
+    for name, n in errors.most_common():
+        print(f"  error {name}: {n}")
+    for name, n in checks.items():
+        print(f"{name:<18}{n:>6}")
+    return 1 if any(checks.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,90 @@
+"""Pairwise overlap search with and without the overlap cache.
+
+Seeds a temporary store with one course of ``--users`` students, then times
+``overlap_with_classmates`` with the cache disabled, on a cold cache (every
+pair computed and appended) and on a warm one (every pair a hit), plus the
+availability digests that key the cache. Run from the repository root:
+
+    python benchmarks/overlap_bench.py --users 2000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+COURSE = "CPSC 3720"
+DAYS = ["MON", "TUE", "WED", "THU", "FRI"]
+
+
+def seed(users: int, seed: int = 0) -> None:
+    from studybuddy import storage
+    from studybuddy.models import AvailabilitySlot, UserProfile
+    rng = random.Random(seed)
+    profiles = []
+    for i in range(users):
+        slots = []
+        for day in DAYS:
+            for hour in sorted(rng.sample(range(8, 19, 2), 2)):
+                slots.append(AvailabilitySlot(day, f"{hour:02d}:00", f"{hour + 1:02d}:30"))
+        profiles.append(UserProfile(name=f"Student {i}", email=f"student{i}@clemson.edu", courses=[COURSE],
+                                    availability=slots))
+    storage.save_all(profiles)
+
+
+def median_ms(func: Callable[[], object], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--runs", type=int, default=5)
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as d:
+        os.environ["STUDYBUDDY_DATA_PATH"] = os.path.join(d, "users.json")
+        os.environ["STUDYBUDDY_SESSIONS_PATH"] = os.path.join(d, "sessions.json")
+        seed(args.users)
+        from studybuddy import availability_service, storage
+        from studybuddy.search_service import SearchService
+        svc = SearchService()
+        me = "student0@clemson.edu"
+        search = lambda: svc.overlap_with_classmates(me, COURSE)  # noqa: E731
+        os.environ["STUDYBUDDY_OVERLAP_CACHE_SIZE"] = "0"
+        results: List[tuple] = [("cache off", median_ms(search, args.runs))]
+        os.environ["STUDYBUDDY_OVERLAP_CACHE_SIZE"] = str(args.users * 2)
+        results.append(("cold cache (first call)", median_ms(search, 1)))
+        results.append(("warm cache", median_ms(search, args.runs)))
+        users = storage.load_all()
+
+        def digests() -> None:
+            for u in users:
+                availability_service.availability_digest(u.availability)
+
+        availability_service._DIGESTS.clear()
+        results.append(("digests, first", median_ms(digests, 1)))
+        results.append(("digests, memoized", median_ms(digests, args.runs)))
+
+    print(f"{args.users} students in one course, median of {args.runs} run(s)")
+    for name, ms in results:
+        print(f"  {name:<26}{ms:9.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+"""Data-file size and parse/write time: original layout vs the current format.
+
+Builds a synthetic users document, then times encoding and decoding it in
+the original pretty-printed schema-1 layout and in the compact current
+format (with and without orjson). Run from the repository root:
+
+    python benchmarks/serialization_bench.py --users 20000
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from studybuddy import serialization  # noqa: E402
+
+DAYS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+
+def make_users(n: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    users = []
+    for i in range(n):
+        slots = []
+        for _ in range(rng.randint(2, 8)):
+            start = rng.randrange(8 * 60, 20 * 60, 30)
+            end = start + rng.choice([30, 60, 90, 120])
+            slots.append({"day": rng.choice(DAYS), "start": f"{start // 60:02d}:{start % 60:02d}",
+                          "end": f"{end // 60:02d}:{end % 60:02d}"})
+        users.append({
+            "name": f"Student {i}",
+            "email": f"student{i}@clemson.edu",
+            "courses": [f"CPSC {rng.randrange(1000, 5000)}" for _ in range(rng.randint(1, 5))],
+            "availability": slots,
+        })
+    return users
+
+
+def median_ms(func: Callable[[], object], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        t0 = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--users", type=int, default=20000)
+    p.add_argument("--runs", type=int, default=5)
+    args = p.parse_args(argv)
+
+    users = make_users(args.users)
+    legacy = json.dumps({"users": users}, indent=2).encode("utf-8")
+    current = {"users": [serialization.pack_user(dict(u)) for u in users]}
+
+    rows = [("schema 1, indent=2, json", len(legacy),
+             median_ms(lambda: json.dumps({"users": users}, indent=2).encode("utf-8"), args.runs),
+             median_ms(lambda: json.loads(legacy), args.runs))]
+    accel = serialization._accel()
+    pause = serialization.GC_PAUSE_MIN_BYTES
+    for label, module in (("current, stdlib json", None), ("current, orjson", accel)):
+        if label.endswith("orjson") and accel is None:
+            continue
+        serialization._orjson = module
+        try:
+            blob = serialization.dumps(current)
+            rows.append((label, len(blob),
+                         median_ms(lambda: serialization.dumps(current), args.runs),
+                         median_ms(lambda: serialization.loads(blob), args.runs)))
+            # Same decode without pausing the cyclic GC
+            serialization.GC_PAUSE_MIN_BYTES = len(blob) + 1
+            rows.append((label + ", gc on", len(blob), rows[-1][2],
+                         median_ms(lambda: serialization.loads(blob), args.runs)))
+        finally:
+            serialization._orjson = accel
+            serialization.GC_PAUSE_MIN_BYTES = pause
+
+    print(f"{args.users} users, median of {args.runs} runs")
+    print(f"{'format':<28}{'size KiB':>10}{'write ms':>10}{'parse ms':>10}")
+    for label, size, write_ms, parse_ms in rows:
+        print(f"{label:<28}{size / 1024:>10.0f}{write_ms:>10.1f}{parse_ms:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+"""Cold-start benchmark for the CLI using ``python -X importtime``.
+
+Runs a command (default: ``show-profile``) several times in fresh
+interpreters, reports the median total import time and wall time, lists the
+slowest studybuddy modules, and exits non-zero if the median import time is
+above ``--target-ms``. Run from the repository root:
+
+    python benchmarks/startup_bench.py --runs 10 --target-ms 40
+
+``--users N`` seeds the temporary store with N users first, so data-bound
+commands can be measured cold; the first run is reported separately since
+it also builds any persisted index (e.g. find-user's users.search):
+
+    python benchmarks/startup_bench.py --users 100000 find-user jonhson
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> Tuple[int, Dict[str, int]]:
+    """Return (total cumulative us of top-level imports, self us per module)."""
+    total = 0
+    per_module: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        self_us, cumulative_us, indent, name = int(m.group(1)), int(m.group(2)), m.group(3), m.group(4)
+        per_module[name] = self_us
+        if len(indent) <= 1:  # top-level import
+            total += cumulative_us
+    return total, per_module
+
+
+def run_once(argv: List[str], env: Dict[str, str]) -> Tuple[float, int, Dict[str, int]]:
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "studybuddy.cli", *argv],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - t0
+    total, per_module = parse_importtime(proc.stderr)
+    return wall, total, per_module
+
+
+def seed(users: int, seed: int = 0) -> None:
+    """Write ``users`` profiles with random names to the configured store."""
+    sys.path.insert(0, str(ROOT))
+    from studybuddy import storage
+    from studybuddy.models import UserProfile
+    rng = random.Random(seed)
+
+    def word(lo: int, hi: int) -> str:
+        return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(lo, hi))).title()
+
+    first = [word(3, 8) for _ in range(3000)]
+    last = [word(4, 10) for _ in range(20000)]
+    storage.save_all([
+        UserProfile(name=f"{rng.choice(first)} {rng.choice(last)}", email=f"user{i}@clemson.edu", courses=[])
+        for i in range(users)
+    ])
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--runs", type=int, default=7)
+    p.add_argument("--target-ms", type=float, default=None, help="Fail if median import time exceeds this")
+    p.add_argument("--users", type=int, default=0, help="Seed this many users before timing")
+    p.add_argument("command", nargs="*", default=["show-profile", "--email", "alice@clemson.edu"])
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as d:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = str(ROOT)
+        env["STUDYBUDDY_DATA_PATH"] = os.path.join(d, "users.json")
+        env["STUDYBUDDY_SESSIONS_PATH"] = os.path.join(d, "sessions.json")
+        if args.users:
+            os.environ.update(STUDYBUDDY_DATA_PATH=env["STUDYBUDDY_DATA_PATH"],
+                              STUDYBUDDY_SESSIONS_PATH=env["STUDYBUDDY_SESSIONS_PATH"])
+            seed(args.users)
+        walls: List[float] = []
+        imports: List[int] = []
+        modules: Dict[str, int] = {}
+        for _ in range(args.runs):
+            wall, total, per_module = run_once(args.command, env)
+            walls.append(wall)
+            imports.append(total)
+            modules = per_module
+
+    import_ms = statistics.median(imports) / 1000
+    print(f"command: {' '.join(args.command)}")
+    print(f"first run wall time:{walls[0] * 1000:8.1f} ms")
+    print(f"median wall time:   {statistics.median(walls) * 1000:8.1f} ms")
+    print(f"median import time: {import_ms:8.1f} ms")
+    print("slowest studybuddy modules (self time, last run):")
+    ours = sorted(((us, name) for name, us in modules.items() if name.startswith("studybuddy")), reverse=True)
+    for us, name in ours[:10]:
+        print(f"  {us / 1000:7.2f} ms  {name}")
+    if args.target_ms is not None and import_ms > args.target_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms exceeds target {args.target_ms:.1f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,35 @@
 """StudyBuddy package.
 
 Sprint 1 scope: User profile creation and course management.
+
+Exports are resolved lazily on first attribute access so that importing a
+submodule (e.g. ``studybuddy.cli``) does not pull in every service.
 """
 
-from .models import UserProfile, AvailabilitySlot  # noqa: F401
-from .profile_service import ProfileService, ProfileError, ValidationError  # noqa: F401
-from .availability_service import AvailabilityService  # noqa: F401
-from .search_service import SearchService  # noqa: F401
-from .session_service import SessionService  # noqa: F401
+from importlib import import_module
+
+_EXPORTS = {
+    "UserProfile": ".models",
+    "AvailabilitySlot": ".models",
+    "ProfileService": ".profile_service",
+    "ProfileError": ".errors",
+    "ValidationError": ".errors",
+    "AvailabilityService": ".availability_service",
+    "SearchService": ".search_service",
+    "SessionService": ".session_service",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value  # cache so later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import marshal
+import os
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .models import UserProfile
+from .availability_service import DAY_ORDER, _parse_time
+from . import storage
+
+# Interval = (start_min, end_min, label); end is exclusive.
+Interval = Tuple[int, int, object]
+
+_FORMAT = 1  # bump when the persisted layout changes
+_SEP = "\x00"
+
+
+class IntervalTree:
+    """Static centered interval tree over half-open [start, end) intervals.
+
+    Stabbing and range queries run in O(log n + k) where k is the number of
+    intervals reported. Nodes and intervals live in flat arrays (intervals
+    are referred to by position), so the tree packs to a few byte strings.
+    """
+
+    def __init__(self, intervals: Iterable[Interval] = ()) -> None:
+        items = list(intervals)
+        self._starts = array("i", (iv[0] for iv in items))
+        self._ends = array("i", (iv[1] for iv in items))
+        self._labels: List[object] = [iv[2] for iv in items]
+        # Per node: center, children (-1: none) and the [lo, hi) slice of
+        # _by_start/_by_end holding the intervals that contain the center
+        self._center = array("i")
+        self._left = array("i")
+        self._right = array("i")
+        self._lo = array("i")
+        self._hi = array("i")
+        self._by_start = array("i")
+        self._by_end = array("i")
+        self._root = self._build(list(range(len(items))))
+
+    def _build(self, ids: List[int]) -> int:
+        if not ids:
+            return -1
+        starts, ends = self._starts, self._ends
+        points = sorted(p for i in ids for p in (starts[i], ends[i]))
+        # Lower median guarantees at least one interval stays at this node or
+        # both sides shrink, so recursion always terminates.
+        center = points[(len(points) - 1) // 2]
+        here: List[int] = []
+        left: List[int] = []
+        right: List[int] = []
+        for i in ids:
+            if ends[i] <= center:
+                left.append(i)
+            elif starts[i] > center:
+                right.append(i)
+            else:
+                here.append(i)
+        node = len(self._center)
+        self._center.append(center)
+        self._lo.append(len(self._by_start))
+        self._by_start.extend(sorted(here, key=starts.__getitem__))
+        self._by_end.extend(sorted(here, key=ends.__getitem__, reverse=True))
+        self._hi.append(len(self._by_start))
+        self._left.append(-1)
+        self._right.append(-1)
+        self._left[node] = self._build(left)
+        self._right[node] = self._build(right)
+        return node
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _interval(self, i: int) -> Interval:
+        return self._starts[i], self._ends[i], self._labels[i]
+
+    def stab(self, point: int) -> Iterator[Interval]:
+        """Yield intervals with start <= point < end."""
+        node = self._root
+        while node != -1:
+            if point < self._center[node]:
+                for k in range(self._lo[node], self._hi[node]):
+                    i = self._by_start[k]
+                    if self._starts[i] > point:
+                        break
+                    yield self._interval(i)
+                node = self._left[node]
+            else:
+                for k in range(self._lo[node], self._hi[node]):
+                    i = self._by_end[k]
+                    if self._ends[i] <= point:
+                        break
+                    yield self._interval(i)
+                node = self._right[node]
+
+    def overlapping(self, start: int, end: int) -> Iterator[Interval]:
+        """Yield intervals that share at least one minute with [start, end)."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node == -1:
+                continue
+            center = self._center[node]
+            if end <= center:
+                for k in range(self._lo[node], self._hi[node]):
+                    i = self._by_start[k]
+                    if self._starts[i] >= end:
+                        break
+                    yield self._interval(i)
+                stack.append(self._left[node])
+            elif start > center:
+                for k in range(self._lo[node], self._hi[node]):
+                    i = self._by_end[k]
+                    if self._ends[i] <= start:
+                        break
+                    yield self._interval(i)
+                stack.append(self._right[node])
+            else:
+                # Every interval stored here contains the center, which lies
+                # inside the query window.
+                for k in range(self._lo[node], self._hi[node]):
+                    yield self._interval(self._by_start[k])
+                stack.append(self._left[node])
+                stack.append(self._right[node])
+
+    def _pack(self) -> tuple:
+        # Labels must be ints here (AvailabilityIndex uses user ids)
+        arrays = (self._starts, self._ends, array("i", self._labels), self._center,
+                  self._left, self._right, self._lo, self._hi, self._by_start, self._by_end)
+        return (self._root,) + tuple(a.tobytes() for a in arrays)
+
+    @classmethod
+    def _unpack(cls, packed: tuple) -> "IntervalTree":
+        tree = cls()
+        tree._root = packed[0]
+        names = ("_starts", "_ends", "_labels", "_center", "_left", "_right", "_lo", "_hi", "_by_start", "_by_end")
+        for name, raw in zip(names, packed[1:]):
+            a = array("i")
+            a.frombytes(raw)
+            setattr(tree, name, a)
+        return tree
+
+
+class AvailabilityIndex:
+    """Reverse index from (day, time) to the users who are free then.
+
+    Course filtering is left to course_catalog.CourseIndex; this only maps
+    time to (lower-cased) emails.
+    """
+
+    def __init__(self, users: Iterable[UserProfile] = ()) -> None:
+        per_day: Dict[str, List[Interval]] = {d: [] for d in DAY_ORDER}
+        self.emails: List[str] = []  # uid -> lower-cased email
+        self.names: Dict[str, str] = {}
+        for u in users:
+            email = u.email.lower()
+            uid = len(self.emails)
+            self.emails.append(email)
+            self.names[email] = u.name
+            for slot in u.availability:
+                per_day.setdefault(slot.day, []).append((_parse_time(slot.start), _parse_time(slot.end), uid))
+        self.trees: Dict[str, IntervalTree] = {day: IntervalTree(ivs) for day, ivs in per_day.items()}
+
+    def _emails(self, hits: Iterator[Interval]) -> Iterator[Interval]:
+        emails = self.emails
+        return ((s, e, emails[uid]) for s, e, uid in hits)
+
+    def free_for(self, day: str, start: int, end: int) -> Iterator[Interval]:
+        """Slots that cover the whole window [start, end), as (start, end, email)."""
+        tree = self.trees.get(day)
+        if tree is None:
+            return iter(())
+        return self._emails(iv for iv in tree.stab(start) if iv[1] >= end)
+
+    def free_during(self, day: str, start: int, end: int) -> Iterator[Interval]:
+        """Slots that overlap any part of the window [start, end), as (start, end, email)."""
+        tree = self.trees.get(day)
+        if tree is None:
+            return iter(())
+        return self._emails(tree.overlapping(start, end))
+
+    def _pack(self) -> Optional[tuple]:
+        names = [self.names[e] for e in self.emails]
+        if any(_SEP in t for t in names) or any(_SEP in e for e in self.emails):
+            return None
+        return (_SEP.join(names), _SEP.join(self.emails),
+                {day: tree._pack() for day, tree in self.trees.items()})
+
+    @classmethod
+    def _unpack(cls, packed: tuple) -> "AvailabilityIndex":
+        names, emails, trees = packed
+        index = cls()
+        if emails:
+            index.emails = emails.split(_SEP)
+            index.names = dict(zip(index.emails, names.split(_SEP)))
+        index.trees = {day: IntervalTree._unpack(t) for day, t in trees.items()}
+        return index
+
+
+_cached: Optional[Tuple[object, AvailabilityIndex]] = None
+
+
+def _index_path() -> Path:
+    return storage._data_path().with_name("users.free")
+
+
+def _load_persisted() -> Optional[Tuple[object, AvailabilityIndex]]:
+    try:
+        with open(_index_path(), "rb") as f:
+            fmt, version, packed = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None  # missing, or written by another Python version
+    if fmt != _FORMAT:
+        return None
+    return version, AvailabilityIndex._unpack(packed)
+
+
+def _persist(version: object, index: AvailabilityIndex) -> None:
+    # Derived data: written directly (no snapshot generation) and atomically
+    packed = index._pack()
+    if version is None or packed is None:
+        return
+    path = _index_path()
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            marshal.dump((_FORMAT, version, packed), f)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+def current_index() -> AvailabilityIndex:
+    """AvailabilityIndex for the current users file.
+
+    Persisted next to the users file (users.free) and keyed on its data
+    version, so a fresh process loads the trees instead of parsing every
+    profile; any change to the users file rebuilds it.
+    """
+    global _cached
+    version = storage.data_version()
+    if _cached is not None and version is not None and _cached[0] == version:
+        return _cached[1]
+    persisted = _load_persisted()
+    if persisted is not None and version is not None and persisted[0] == version:
+        index = persisted[1]
+    else:
+        index = AvailabilityIndex(storage.load_all())
+        _persist(version, index)
+    _cached = (version, index)
+    return index
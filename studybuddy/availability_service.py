@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-from typing import List
+import hashlib
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import date as Date, timedelta
+from typing import Iterator, List
 from typing import Dict, Tuple
 import re
 
-from .models import UserProfile, AvailabilitySlot
+from .models import UserProfile, AvailabilitySlot, AvailabilityOverride
 from . import storage
 from .profile_service import ValidationError
+from .profiling import timed
+from .metrics import track
 
 
 DAY_ORDER = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
@@ -24,6 +30,7 @@ def _norm_day(day: str) -> str:
 _TIME_RE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([AaPp][Mm])?\s*$")
 
 
+@timed("availability._parse_time")
 def _parse_time(t: str) -> int:
     """Parse a time string into minutes from midnight.
 
@@ -63,6 +70,128 @@ def _time_str(minutes: int) -> str:
     return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
 
+def _parse_date(text: str) -> Date:
+    try:
+        return Date.fromisoformat(text.strip())
+    except ValueError:
+        raise ValidationError("Date must be YYYY-MM-DD")
+
+
+def _date_range(start: str, end: str) -> Tuple[Date, Date]:
+    first, last = _parse_date(start), _parse_date(end)
+    if last < first:
+        raise ValidationError("End date must not be before start date")
+    if (last - first).days >= MAX_RANGE_DAYS:
+        raise ValidationError(f"Date range must be at most {MAX_RANGE_DAYS} days")
+    return first, last
+
+
+Intervals = Tuple[Tuple[int, int], ...]
+
+MAX_RANGE_DAYS = 366
+
+# (availability digest incl. overrides, ISO date) -> effective intervals that
+# day. Dates are expanded only when asked for; the key is a content hash,
+# so any change to slots or overrides (however it was written) misses and
+# stale entries age out.
+_DAY_CACHE: "OrderedDict[Tuple[str, str], Intervals]" = OrderedDict()
+_DAY_CACHE_SIZE = 8192
+
+
+# Raw slot (and override) rows -> content digest. Keyed on the rows
+# themselves, so an unchanged profile costs one tuple build and a dict
+# lookup per call.
+_DIGESTS: "OrderedDict[tuple, str]" = OrderedDict()
+_DIGEST_CACHE_SIZE = 65536
+
+
+def availability_digest(slots, overrides=()) -> str:
+    """Hash of a weekly slot list (and date overrides), normalized to minutes.
+
+    Two users with the same availability share a digest, and any change to
+    it changes the digest, so it can key cached results across processes.
+    The weekly overlap cache passes slots only; per-date intervals include
+    the overrides.
+    """
+    raw = (tuple((s.day, s.start, s.end) for s in slots), tuple((o.date, o.kind, o.start, o.end) for o in overrides))
+    digest = _DIGESTS.get(raw)
+    if digest is None:
+        norm = [(d.upper(), _parse_time(a), _parse_time(b)) for d, a, b in raw[0]]
+        if raw[1]:
+            norm.append([(dt, kind, _parse_time(a), _parse_time(b)) for dt, kind, a, b in raw[1]])
+        digest = _DIGESTS[raw] = hashlib.blake2b(repr(norm).encode("utf-8"), digest_size=8).hexdigest()
+        if len(_DIGESTS) > _DIGEST_CACHE_SIZE:
+            _DIGESTS.popitem(last=False)
+    return digest
+
+
+def _union(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for s, e in sorted(intervals):
+        if out and s <= out[-1][1]:
+            out[-1] = (out[-1][0], max(out[-1][1], e))
+        else:
+            out.append((s, e))
+    return out
+
+
+def _subtract(intervals: List[Tuple[int, int]], block: Tuple[int, int]) -> List[Tuple[int, int]]:
+    bs, be = block
+    out = []
+    for s, e in intervals:
+        if e <= bs or s >= be:
+            out.append((s, e))
+            continue
+        if s < bs:
+            out.append((s, bs))
+        if e > be:
+            out.append((be, e))
+    return out
+
+
+def intersect(a: Intervals, b: Intervals) -> List[Tuple[int, int]]:
+    """Overlapping parts of two sorted, non-overlapping interval lists."""
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        s, e = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if e > s:
+            out.append((s, e))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def day_intervals(profile: UserProfile, day: Date) -> Intervals:
+    """Free minutes on a calendar date: the weekly slots for that weekday,
+    plus "add" overrides, minus "block" overrides (blocks win)."""
+    iso = day.isoformat()
+    key = (availability_digest(profile.availability, profile.overrides), iso)
+    hit = _DAY_CACHE.get(key)
+    if hit is not None:
+        _DAY_CACHE.move_to_end(key)
+        return hit
+    weekday = DAY_ORDER[day.weekday()]
+    free = [(_parse_time(s.start), _parse_time(s.end)) for s in profile.availability if s.day == weekday]
+    todays = [o for o in profile.overrides if o.date == iso]
+    free = _union(free + [(_parse_time(o.start), _parse_time(o.end)) for o in todays if o.kind == "add"])
+    for o in todays:
+        if o.kind == "block":
+            free = _subtract(free, (_parse_time(o.start), _parse_time(o.end)))
+    result = tuple(free)
+    _DAY_CACHE[key] = result
+    if len(_DAY_CACHE) > _DAY_CACHE_SIZE:
+        _DAY_CACHE.popitem(last=False)
+    return result
+
+
+def iter_days(first: Date, last: Date) -> Iterator[Date]:
+    for n in range((last - first).days + 1):
+        yield first + timedelta(days=n)
+
+
 class AvailabilityService:
     """Manage weekly availability slots for user profiles."""
 
@@ -72,6 +201,7 @@ class AvailabilityService:
             raise ValidationError("Profile not found for email")
         return p
 
+    @track("availability", "add_slot")
     def add_slot(self, email: str, day: str, start: str, end: str) -> List[AvailabilitySlot]:
         day_norm = _norm_day(day)
         start_min = _parse_time(start)
@@ -79,32 +209,77 @@ class AvailabilityService:
         if end_min <= start_min:
             raise ValidationError("End time must be after start time")
         profile = self._get_profile(email)
-        # Insert then merge overlapping for that day
-        profile.availability.append(AvailabilitySlot(day=day_norm, start=_time_str(start_min), end=_time_str(end_min)))
-        profile.availability = self._merge(profile.availability)
+        # Insert into the sorted list, merging only with touching neighbors
+        slots = self._normalized(profile.availability)
+        self._insert_merged(slots, day_norm, start_min, end_min)
+        profile.availability = slots
         storage.upsert(profile)
-        return list(profile.availability)
+        return list(slots)
 
     def list_slots(self, email: str) -> List[AvailabilitySlot]:
         profile = self._get_profile(email)
-        return self._sorted(profile.availability)
+        return list(self._normalized(profile.availability))
 
+    @track("availability", "remove_slot")
     def remove_slot(self, email: str, index: int) -> List[AvailabilitySlot]:
         profile = self._get_profile(email)
-        slots = self._sorted(profile.availability)
+        slots = self._normalized(profile.availability)
         if index < 1 or index > len(slots):
             raise ValidationError("Index out of range")
-        # Remove by identity match
-        target = slots[index - 1]
-        profile.availability = [s for s in profile.availability if not (s.day == target.day and s.start == target.start and s.end == target.end)]
+        del slots[index - 1]
+        profile.availability = slots
         storage.upsert(profile)
-        return self._sorted(profile.availability)
+        return list(slots)
+
+    @track("availability", "add_override")
+    def add_override(self, email: str, date: str, start: str, end: str, block: bool = False) -> List[AvailabilityOverride]:
+        """Add free time (or, with ``block``, remove it) on one calendar date."""
+        day = _parse_date(date)
+        start_min = _parse_time(start)
+        end_min = _parse_time(end)
+        if end_min <= start_min:
+            raise ValidationError("End time must be after start time")
+        profile = self._get_profile(email)
+        override = AvailabilityOverride(date=day.isoformat(), start=_time_str(start_min), end=_time_str(end_min),
+                                        kind="block" if block else "add")
+        insort(profile.overrides, override, key=lambda o: (o.date, o.start))
+        storage.upsert(profile)
+        return list(profile.overrides)
+
+    def list_overrides(self, email: str) -> List[AvailabilityOverride]:
+        return sorted(self._get_profile(email).overrides, key=lambda o: (o.date, o.start))
+
+    @track("availability", "remove_override")
+    def remove_override(self, email: str, index: int) -> List[AvailabilityOverride]:
+        profile = self._get_profile(email)
+        overrides = sorted(profile.overrides, key=lambda o: (o.date, o.start))
+        if index < 1 or index > len(overrides):
+            raise ValidationError("Index out of range")
+        del overrides[index - 1]
+        profile.overrides = overrides
+        storage.upsert(profile)
+        return list(overrides)
+
+    def dated_availability(self, email: str, start_date: str, end_date: str) -> Dict[str, List[Tuple[str, str]]]:
+        """Effective availability per calendar date in [start_date, end_date] (12h strings).
+
+        Only the requested dates are expanded; every date is listed, empty
+        ones as [].
+        """
+        first, last = _date_range(start_date, end_date)
+        profile = self._get_profile(email)
+        return {
+            d.isoformat(): [(self._to_12h(_time_str(s)), self._to_12h(_time_str(e))) for s, e in day_intervals(profile, d)]
+            for d in iter_days(first, last)
+        }
 
     def weekly_overview(self, email: str) -> Dict[str, List[Tuple[str, str]]]:
         """Return each day mapped to list of (start,end) 12h strings. Empty days -> []."""
-        slots = self.list_slots(email)
+        return self._overview(self._get_profile(email).availability)
+
+    def _overview(self, slots: List[AvailabilitySlot]) -> Dict[str, List[Tuple[str, str]]]:
         by_day: Dict[str, List[Tuple[str, str]]] = {d: [] for d in DAY_ORDER}
-        for s in slots:
+        for s in self._normalized(slots):
             by_day[s.day].append((self._to_12h(s.start), self._to_12h(s.end)))
         return by_day
 
@@ -120,9 +295,45 @@ class AvailabilityService:
         suffix = "AM" if am else "PM"
         return f"{display_hour}:{minute:02d} {suffix}"
 
+    @staticmethod
+    def _slot_key(s: AvailabilitySlot) -> Tuple[int, str]:
+        # Stored times are zero-padded HH:MM so string order == time order
+        return (_DAY_MAP.get(s.day, 99), s.start)
+
     def _sorted(self, slots: List[AvailabilitySlot]) -> List[AvailabilitySlot]:
-        return sorted(slots, key=lambda s: (_DAY_MAP.get(s.day, 99), s.start))
+        return sorted(slots, key=self._slot_key)
+
+    def _normalized(self, slots: List[AvailabilitySlot]) -> List[AvailabilitySlot]:
+        """Return slots sorted by (day, start) with no overlaps per day.
+
+        Lists written by add_slot already satisfy this, so the common case is a
+        single linear check; older or hand-edited data falls back to _merge.
+        """
+        key = self._slot_key
+        for a, b in zip(slots, slots[1:]):
+            if key(a) >= key(b) or (a.day == b.day and a.end >= b.start):
+                return self._merge(slots)
+        return list(slots)
+
+    def _insert_merged(self, slots: List[AvailabilitySlot], day: str, start: int, end: int) -> None:
+        """Insert [start, end) on day into a normalized list in place.
+
+        Binary search finds the insertion point; only the predecessor and the
+        run of successors that overlap or touch the new window are merged.
+        """
+        i = bisect_left(slots, (_DAY_MAP[day], _time_str(start)), key=self._slot_key)
+        lo = i
+        if i > 0 and slots[i - 1].day == day and _parse_time(slots[i - 1].end) >= start:
+            lo = i - 1
+            start = _parse_time(slots[lo].start)
+            end = max(end, _parse_time(slots[lo].end))
+        hi = i
+        while hi < len(slots) and slots[hi].day == day and _parse_time(slots[hi].start) <= end:
+            end = max(end, _parse_time(slots[hi].end))
+            hi += 1
+        slots[lo:hi] = [AvailabilitySlot(day=day, start=_time_str(start), end=_time_str(end))]
 
+    @timed("availability._merge")
     def _merge(self, slots: List[AvailabilitySlot]) -> List[AvailabilitySlot]:
         # Merge overlapping or contiguous slots per day
         grouped = {}
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import itertools
+import json
 import sys
-from typing import Callable
+from typing import Callable, Dict, Iterable
 
-from .profile_service import ProfileService, ValidationError
-from .availability_service import AvailabilityService
-from .search_service import SearchService
-from .session_service import SessionService
-from .availability_service import DAY_ORDER as _DAY_ORDER
+# Service modules are imported inside each handler so a command only pays
+# for the part of the package it uses (see benchmarks/startup_bench.py).
+
+from .errors import ValidationError
+from . import profiling
+from . import metrics
 
 
 def _handle_errors(func: Callable[[], int]) -> int:
@@ -20,6 +23,7 @@ def _handle_errors(func: Callable[[], int]) -> int:
 
 
 def cmd_create_user(args) -> int:
+    from .profile_service import ProfileService
     svc = ProfileService()
     profile = svc.create_profile(name=args.name, email=args.email)
     print(f"Created profile for {profile.name} ({profile.email})")
@@ -27,6 +31,7 @@ def cmd_create_user(args) -> int:
 
 
 def cmd_add_course(args) -> int:
+    from .profile_service import ProfileService
     svc = ProfileService()
     profile = svc.add_course(email=args.email, course_code=args.course)
     print(f"Courses for {profile.email}: {', '.join(profile.courses) or 'None'}")
@@ -34,7 +39,6 @@ def cmd_add_course(args) -> int:
 
 
 def cmd_show_profile(args) -> int:
-    svc = ProfileService()
     from . import storage
     profile = storage.get_by_email(args.email)
     if not profile:
@@ -44,7 +48,20 @@ def cmd_show_profile(args) -> int:
     return 0
 
 
+def cmd_find_user(args) -> int:
+    from .profile_service import ProfileService
+    matches = ProfileService().find_users(args.query, limit=args.limit)
+    if not matches:
+        print("No matching users")
+        return 0
+    for m in matches:
+        note = f" (~{m['distance']} typo)" if m["match"] == "fuzzy" else ""
+        print(f"{m['name']} <{m['email']}>{note}")
+    return 0
+
+
 def cmd_add_availability(args) -> int:
+    from .availability_service import AvailabilityService
     svc = AvailabilityService()
     slots = svc.add_slot(email=args.email, day=args.day, start=args.start, end=args.end)
     _print_slots(slots)
@@ -52,6 +69,7 @@ def cmd_add_availability(args) -> int:
 
 
 def cmd_list_availability(args) -> int:
+    from .availability_service import AvailabilityService
     svc = AvailabilityService()
     slots = svc.list_slots(email=args.email)
     _print_slots(slots)
@@ -59,12 +77,41 @@ def cmd_list_availability(args) -> int:
 
 
 def cmd_remove_availability(args) -> int:
+    from .availability_service import AvailabilityService
     svc = AvailabilityService()
     slots = svc.remove_slot(email=args.email, index=args.index)
     _print_slots(slots)
     return 0
 
 
+def _add_format_arg(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--format", choices=["text", "json", "ndjson"], default="text",
+                        help="text (default), a JSON array, or one JSON record per line streamed as produced")
+
+
+def _stream_records(records: Iterable[Dict], fmt: str) -> int:
+    """Write records as NDJSON or a JSON array, flushing each as it is produced.
+
+    The first record is pulled before anything is written so a validation
+    error never leaves a half-open JSON array on stdout.
+    """
+    it = iter(records)
+    first = next(it, None)
+    out = sys.stdout
+    if fmt == "ndjson":
+        for rec in itertools.chain([first], it) if first is not None else ():
+            out.write(json.dumps(rec) + "\n")
+            out.flush()
+        return 0
+    out.write("[")
+    if first is not None:
+        for i, rec in enumerate(itertools.chain([first], it)):
+            out.write(("\n" if i == 0 else ",\n") + json.dumps(rec))
+            out.flush()
+    out.write("\n]\n")
+    return 0
+
+
 def _print_slots(slots):  # minimal formatting
     if not slots:
         print("No availability set")
@@ -73,8 +120,24 @@ def _print_slots(slots):  # minimal formatting
         print(f"{i}. {s.day} {s.start}-{s.end}")
 
 
+def _print_overrides(overrides):
+    if not overrides:
+        print("No date overrides set")
+        return
+    for i, o in enumerate(overrides, start=1):
+        print(f"{i}. {o.date} {o.kind} {o.start}-{o.end}")
+
+
+def _when(s) -> str:
+    # One-off sessions show their date after the weekday
+    return f"{s.day} {s.date}" if s.date else s.day
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="StudyBuddy CLI - Sprint 1 + Availability")
+    p.add_argument("--profile", action="store_true", help="Print per-command timing summary to stderr (or set STUDYBUDDY_PROFILE=1)")
+    p.add_argument("--profile-out", metavar="FILE", help="Also write a cProfile/pstats dump to FILE")
+    p.add_argument("--trace-out", metavar="FILE", help="Also write a Chrome trace JSON to FILE")
     sub = p.add_subparsers(dest="command", required=True)
 
     c1 = sub.add_parser("create-user", help="Create a new user profile")
@@ -91,6 +154,11 @@ def build_parser() -> argparse.ArgumentParser:
     c3.add_argument("--email", required=True)
     c3.set_defaults(func=cmd_show_profile)
 
+    c4 = sub.add_parser("find-user", help="Find users by name or email prefix (tolerates small typos)")
+    c4.add_argument("query", help="Name, email or the start of either")
+    c4.add_argument("--limit", type=int, default=10, help="Maximum results (default 10)")
+    c4.set_defaults(func=cmd_find_user)
+
     # Availability commands (Story 2)
     a1 = sub.add_parser("add-availability", help="Add availability slot: day start end (start/end accept 09:00 or 9:00am)")
     a1.add_argument("--email", required=True)
@@ -112,6 +180,29 @@ def build_parser() -> argparse.ArgumentParser:
     a4.add_argument("--email", required=True)
     a4.set_defaults(func=cmd_week_availability)
 
+    a5 = sub.add_parser("add-override", help="Add (or with --block, remove) free time on one date")
+    a5.add_argument("--email", required=True)
+    a5.add_argument("--date", required=True, help="YYYY-MM-DD")
+    a5.add_argument("--start", required=True, help="Start time (24h or 12h)")
+    a5.add_argument("--end", required=True, help="End time (24h or 12h)")
+    a5.add_argument("--block", action="store_true", help="Mark the window unavailable instead of free")
+    a5.set_defaults(func=cmd_add_override)
+
+    a6 = sub.add_parser("list-overrides", help="List date-specific availability overrides")
+    a6.add_argument("--email", required=True)
+    a6.set_defaults(func=cmd_list_overrides)
+
+    a7 = sub.add_parser("remove-override", help="Remove a date override by index (see list-overrides)")
+    a7.add_argument("--email", required=True)
+    a7.add_argument("--index", type=int, required=True)
+    a7.set_defaults(func=cmd_remove_override)
+
+    a8 = sub.add_parser("day-availability", help="Show effective availability per date (weekly slots plus overrides)")
+    a8.add_argument("--email", required=True)
+    a8.add_argument("--from", dest="start_date", required=True, help="First date, YYYY-MM-DD")
+    a8.add_argument("--to", dest="end_date", required=True, help="Last date, YYYY-MM-DD (at most 366 days)")
+    a8.set_defaults(func=cmd_day_availability)
+
     # Search classmates by course (Story 3)
     s1 = sub.add_parser("search-classmates", help="List classmates in a course (excluding yourself)")
     s1.add_argument("--email", required=True, help="Your (requester) email")
@@ -121,45 +212,129 @@ def build_parser() -> argparse.ArgumentParser:
     s2 = sub.add_parser("search-classmates-availability", help="List classmates with weekly availability")
     s2.add_argument("--email", required=True)
     s2.add_argument("--course", required=True)
+    _add_format_arg(s2)
     s2.set_defaults(func=cmd_search_classmates_availability)
 
     s3 = sub.add_parser("search-overlap", help="Show overlap between you and classmates (sorted by total overlap)")
     s3.add_argument("--email", required=True)
     s3.add_argument("--course", required=True)
+    s3.add_argument("--from", dest="start_date", help="Compute per date from YYYY-MM-DD (with --to), including overrides")
+    s3.add_argument("--to", dest="end_date", help="Last date, YYYY-MM-DD")
+    _add_format_arg(s3)
     s3.set_defaults(func=cmd_search_overlap)
 
+    s4 = sub.add_parser("who-is-free", help="List students free for a time window (optionally in one course)")
+    s4.add_argument("--day", required=True, help="Mon Tue Wed Thu Fri Sat Sun")
+    s4.add_argument("--start", required=True, help="Start time (24h or 12h)")
+    s4.add_argument("--end", required=True, help="End time (24h or 12h)")
+    s4.add_argument("--course", required=False, help="Only students enrolled in this course")
+    s4.add_argument("--email", required=False, help="Your email (excluded from results)")
+    s4.add_argument("--partial", action="store_true", help="Include students free for only part of the window")
+    s4.set_defaults(func=cmd_who_is_free)
+
+    s5 = sub.add_parser("course-compatibility-matrix", help="Write the all-pairs overlap-minutes matrix for a course (CSV or NPY)")
+    s5.add_argument("--course", required=True)
+    s5.add_argument("--out", required=True, help="Output file (.csv or .npy)")
+    s5.add_argument("--format", choices=["csv", "npy"], help="Defaults to the --out suffix")
+    s5.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    s5.set_defaults(func=cmd_course_compatibility_matrix)
+
+    s6 = sub.add_parser("form-groups", help="Split a course into study groups maximizing shared free time")
+    s6.add_argument("--course", required=True)
+    s6.add_argument("--min-size", type=int, default=3)
+    s6.add_argument("--max-size", type=int, default=5)
+    s6.add_argument("--time-budget", type=float, default=2.0, help="Seconds of local search after the greedy pass")
+    s6.add_argument("--propose", action="store_true", help="Propose a session for each group (first member invites the rest)")
+    s6.add_argument("--duration", type=int, default=60, help="Proposed session length in minutes")
+    s6.set_defaults(func=cmd_form_groups)
+
+    s7 = sub.add_parser("recommend-buddies", help="Rank study partners by shared courses and shared free time")
+    s7.add_argument("--email", required=True)
+    s7.add_argument("--top", type=int, default=10, help="Number of results")
+    s7.add_argument("--course-weight", type=int, default=60, help="Score points per shared course (1 point = 1 shared minute)")
+    s7.set_defaults(func=cmd_recommend_buddies)
+
     # Session proposal & confirmation (Story 4)
     ss1 = sub.add_parser("propose-session", help="Propose study session")
     ss1.add_argument("--from", dest="from_email", required=True, help="Requester email")
     ss1.add_argument("--to", dest="to_email", required=True, help="Invitee email")
     ss1.add_argument("--course", required=True)
-    ss1.add_argument("--day", required=True)
+    ss1.add_argument("--day", help="Mon..Sun for a weekly session (optional with --date)")
+    ss1.add_argument("--date", help="YYYY-MM-DD for a one-off session; checked against that date's overrides")
     ss1.add_argument("--start", required=True, help="Start time (24h or 12h)")
     ss1.add_argument("--end", required=True, help="End time (24h or 12h)")
     ss1.add_argument("--message", required=False)
+    ss1.add_argument("--ttl-hours", type=float, required=False, help="Expire the request if not answered in time (default: $STUDYBUDDY_REQUEST_TTL seconds, else never)")
     ss1.set_defaults(func=cmd_propose_session)
 
     ss2 = sub.add_parser("list-requests", help="List incoming/outgoing pending session requests")
     ss2.add_argument("--email", required=True)
+    _add_format_arg(ss2)
     ss2.set_defaults(func=cmd_list_requests)
 
     ss3 = sub.add_parser("list-sessions", help="List confirmed (accepted) sessions for a user")
     ss3.add_argument("--email", required=True)
+    _add_format_arg(ss3)
     ss3.set_defaults(func=cmd_list_sessions)
 
+    ss5 = sub.add_parser("watch-requests", help="Print session proposals/responses involving you as they happen")
+    ss5.add_argument("--email", required=True)
+    ss5.add_argument("--cursor", type=int, help="Resume after this change number (default: only new changes)")
+    ss5.add_argument("--interval", type=float, default=1.0, help="Polling interval in seconds")
+    ss5.add_argument("--timeout", type=float, help="Stop after this many seconds (default: run until interrupted)")
+    ss5.add_argument("--once", action="store_true", help="Print pending changes since --cursor and exit")
+    ss5.set_defaults(func=cmd_watch_requests)
+
+    ss6 = sub.add_parser("sweep-expired", help="Mark pending requests past their TTL as expired")
+    ss6.set_defaults(func=cmd_sweep_expired)
+
+    ss7 = sub.add_parser("export-ical", help="Write one .ics feed of accepted sessions per user (only changed feeds)")
+    ss7.add_argument("--out", required=True, help="Feed directory (holds <email>.ics and feeds.json)")
+    ss7.add_argument("--full", action="store_true", help="Re-render every feed instead of only users with changed sessions")
+    ss7.set_defaults(func=cmd_export_ical)
+
     ss4 = sub.add_parser("respond-session", help="Accept or decline a pending session (invitee only)")
     ss4.add_argument("--email", required=True, help="Invitee email")
     ss4.add_argument("--id", type=int, required=True, help="Session ID")
     ss4.add_argument("--action", required=True, choices=["accept", "decline"])
     ss4.set_defaults(func=cmd_respond_session)
+
+    r1 = sub.add_parser("reshard", help="Repartition the users and sessions files into N shards")
+    r1.add_argument("--shards", type=int, required=True, help="New shard count (1 = single files)")
+    r1.set_defaults(func=cmd_reshard)
+
+    rp1 = sub.add_parser("replicate", help="Apply the primary's mutation log to this replica (STUDYBUDDY_REPLICA_OF)")
+    rp1.add_argument("--follow", action="store_true", help="Keep tailing the log instead of exiting when caught up")
+    rp1.add_argument("--interval", type=float, default=1.0, help="Seconds between log polls with --follow (default 1)")
+    rp1.set_defaults(func=cmd_replicate)
+
+    rp2 = sub.add_parser("replication-status", help="Show this replica's replication lag")
+    rp2.set_defaults(func=cmd_replication_status)
+
+    rp3 = sub.add_parser("compact-log", help="Replace the mutation log with a checkpoint of the data (primary)")
+    rp3.set_defaults(func=cmd_compact_log)
+
+    g1 = sub.add_parser("gc-snapshots", help="Delete superseded data generations (STUDYBUDDY_SNAPSHOTS)")
+    g1.add_argument("--grace", type=float, help="Keep generations retired less than this many seconds ago "
+                                                 "(default STUDYBUDDY_SNAPSHOT_GRACE or 300)")
+    g1.set_defaults(func=cmd_gc_snapshots)
+
+    b1 = sub.add_parser("run-batch", help="Run one subcommand per line from FILE (or - for stdin) in a single process")
+    b1.add_argument("file", metavar="FILE", help="Batch file; blank lines and lines starting with # are skipped")
+    b1.add_argument("--flush-every", type=int, default=0, metavar="N",
+                    help="Write data files to disk after every N commands (default: only at the end)")
+    b1.add_argument("--atomic", action="store_true",
+                    help="Stop at the first failing line and write nothing")
+    b1.set_defaults(func=cmd_run_batch)
     return p
 
 
 def cmd_week_availability(args) -> int:
+    from .availability_service import AvailabilityService, DAY_ORDER
     svc = AvailabilityService()
     overview = svc.weekly_overview(email=args.email)
     print("Weekly Availability (EST):")
-    for day in _DAY_ORDER:
+    for day in DAY_ORDER:
         entries = overview.get(day, [])
         if not entries:
             print(f"{day}: None")
@@ -168,7 +343,41 @@ def cmd_week_availability(args) -> int:
     return 0
 
 
+def cmd_add_override(args) -> int:
+    from .availability_service import AvailabilityService
+    svc = AvailabilityService()
+    overrides = svc.add_override(email=args.email, date=args.date, start=args.start, end=args.end, block=args.block)
+    _print_overrides(overrides)
+    return 0
+
+
+def cmd_list_overrides(args) -> int:
+    from .availability_service import AvailabilityService
+    svc = AvailabilityService()
+    _print_overrides(svc.list_overrides(email=args.email))
+    return 0
+
+
+def cmd_remove_override(args) -> int:
+    from .availability_service import AvailabilityService
+    svc = AvailabilityService()
+    overrides = svc.remove_override(email=args.email, index=args.index)
+    _print_overrides(overrides)
+    return 0
+
+
+def cmd_day_availability(args) -> int:
+    from .availability_service import AvailabilityService
+    svc = AvailabilityService()
+    days = svc.dated_availability(args.email, args.start_date, args.end_date)
+    print("Availability by date (EST):")
+    for iso, entries in days.items():
+        print(f"{iso}: {', '.join(f'{s}-{e}' for s, e in entries) if entries else 'None'}")
+    return 0
+
+
 def cmd_search_classmates(args) -> int:
+    from .search_service import SearchService
     svc = SearchService()
     classmates = svc.classmates_in_course(args.email, args.course)
     if not classmates:
@@ -181,7 +390,10 @@ def cmd_search_classmates(args) -> int:
 
 
 def cmd_search_classmates_availability(args) -> int:
+    from .search_service import SearchService
     svc = SearchService()
+    if args.format != "text":
+        return _stream_records(svc.iter_classmates_with_availability(args.email, args.course), args.format)
     entries = svc.classmates_with_availability(args.email, args.course)
     if not entries:
         print("No classmates found for that course.")
@@ -198,8 +410,12 @@ def cmd_search_classmates_availability(args) -> int:
 
 
 def cmd_search_overlap(args) -> int:
+    from .search_service import SearchService
     svc = SearchService()
-    overlaps = svc.overlap_with_classmates(args.email, args.course)
+    if args.format != "text":
+        # Streamed in roster order as computed; sort downstream if needed
+        return _stream_records(svc.iter_overlaps(args.email, args.course, args.start_date, args.end_date), args.format)
+    overlaps = svc.overlap_with_classmates(args.email, args.course, args.start_date, args.end_date)
     if not overlaps:
         print("No classmates found for that course.")
         return 0
@@ -218,7 +434,61 @@ def cmd_search_overlap(args) -> int:
     return 0
 
 
+def cmd_who_is_free(args) -> int:
+    from .search_service import SearchService
+    svc = SearchService()
+    entries = svc.who_is_free(args.day, args.start, args.end, course_code=args.course,
+                              requester_email=args.email, partial=args.partial)
+    if not entries:
+        print("Nobody is free in that window.")
+        return 0
+    scope = f" in {args.course}" if args.course else ""
+    print(f"Free{scope} on {args.day} {args.start}-{args.end}:")
+    for e in entries:
+        print(f"- {e['name']} <{e['email']}> free {e['free_start']}-{e['free_end']}")
+    return 0
+
+
+def cmd_course_compatibility_matrix(args) -> int:
+    from .compatibility_service import CompatibilityService
+    svc = CompatibilityService()
+    emails = svc.course_matrix(args.course, args.out, fmt=args.format, workers=args.workers)
+    print(f"Wrote {len(emails)}x{len(emails)} overlap matrix for {args.course} to {args.out}")
+    return 0
+
+
+def cmd_form_groups(args) -> int:
+    from .group_service import GroupService
+    svc = GroupService()
+    groups = svc.form_groups(args.course, min_size=args.min_size, max_size=args.max_size, time_budget=args.time_budget)
+    print(f"Proposed groups for {args.course}:")
+    for i, g in enumerate(groups, start=1):
+        window = f"{g['window'][0]} {g['window'][1]}-{g['window'][2]}" if g["window"] else "none"
+        print(f"{i}. {', '.join(g['members'])} | common {g['common_minutes']} min | best window {window}")
+    if args.propose:
+        for i, r in enumerate(svc.propose_group_sessions(args.course, groups, duration=args.duration), start=1):
+            ids = ', '.join(str(x) for x in r["session_ids"]) or 'none'
+            print(f"Group {i}: proposed session IDs {ids}")
+            for err in r["errors"]:
+                print(f"    skipped {err}")
+    return 0
+
+
+def cmd_recommend_buddies(args) -> int:
+    from .search_service import SearchService
+    svc = SearchService()
+    entries = svc.recommend_buddies(args.email, k=args.top, course_weight=args.course_weight)
+    if not entries:
+        print("No recommendations (no classmates in your courses).")
+        return 0
+    print("Recommended study buddies:")
+    for i, e in enumerate(entries, start=1):
+        print(f"{i}. {e['name']} <{e['email']}> score {e['score']} | courses: {', '.join(e['shared_courses'])} | overlap {e['overlap_minutes']} min")
+    return 0
+
+
 def cmd_propose_session(args) -> int:
+    from .session_service import SessionService
     svc = SessionService()
     session = svc.propose(
         requester=args.from_email,
@@ -228,30 +498,42 @@ def cmd_propose_session(args) -> int:
         start=args.start,
         end=args.end,
         message=args.message,
+        ttl=None if args.ttl_hours is None else args.ttl_hours * 3600,
+        date=args.date,
     )
-    print(f"Proposed session ID {session.id} {session.course} {session.day} {session.start}-{session.end} to {session.invitee}")
+    print(f"Proposed session ID {session.id} {session.course} {_when(session)} {session.start}-{session.end} to {session.invitee}")
     return 0
 
 
 def cmd_list_requests(args) -> int:
+    from .session_service import SessionService
     svc = SessionService()
+    if args.format != "text":
+        records = itertools.chain(
+            ({"direction": "incoming", **s.to_dict()} for s in svc.iter_incoming_requests(args.email)),
+            ({"direction": "outgoing", **s.to_dict()} for s in svc.iter_outgoing_requests(args.email)),
+        )
+        return _stream_records(records, args.format)
     incoming = svc.incoming_requests(args.email)
     outgoing = svc.outgoing_requests(args.email)
     print("Incoming pending requests:")
     if not incoming:
         print("  None")
     for s in incoming:
-        print(f"  ID {s.id} from {s.requester} {s.course} {s.day} {s.start}-{s.end} msg={s.message or ''}")
+        print(f"  ID {s.id} from {s.requester} {s.course} {_when(s)} {s.start}-{s.end} msg={s.message or ''}")
     print("Outgoing pending requests:")
     if not outgoing:
         print("  None")
     for s in outgoing:
-        print(f"  ID {s.id} to {s.invitee} {s.course} {s.day} {s.start}-{s.end} msg={s.message or ''}")
+        print(f"  ID {s.id} to {s.invitee} {s.course} {_when(s)} {s.start}-{s.end} msg={s.message or ''}")
     return 0
 
 
 def cmd_list_sessions(args) -> int:
+    from .session_service import SessionService
     svc = SessionService()
+    if args.format != "text":
+        return _stream_records((s.to_dict() for s in svc.iter_confirmed_sessions(args.email)), args.format)
     sessions = svc.confirmed_sessions(args.email)
     if not sessions:
         print("No confirmed sessions.")
@@ -259,21 +541,200 @@ def cmd_list_sessions(args) -> int:
     print("Confirmed sessions:")
     for s in sessions:
         role = "(You requested)" if s.requester.lower() == args.email.lower() else "(You invited)"
-        print(f"  ID {s.id} {s.course} {s.day} {s.start}-{s.end} with {s.invitee if s.requester.lower()==args.email.lower() else s.requester} {role}")
+        print(f"  ID {s.id} {s.course} {_when(s)} {s.start}-{s.end} with {s.invitee if s.requester.lower()==args.email.lower() else s.requester} {role}")
+    return 0
+
+
+def cmd_watch_requests(args) -> int:
+    import time
+    from .session_service import SessionService
+    from . import session_storage
+    svc = SessionService()
+    me = args.email.lower()
+    cursor = args.cursor if args.cursor is not None else session_storage.current_seq()
+    deadline = None if args.timeout is None else time.monotonic() + args.timeout
+    while True:
+        version = session_storage.data_version()
+        cursor, changes = svc.changes_since(cursor, args.email)
+        for s in changes:
+            if s.invitee.lower() == me:
+                who = f"from {s.requester}"
+            else:
+                who = f"to {s.invitee}"
+            print(f"[{s.seq}] ID {s.id} {s.status} {who} {s.course} {_when(s)} {s.start}-{s.end} msg={s.message or ''}", flush=True)
+        if args.once:
+            break
+        wait = 3600.0 if deadline is None else deadline - time.monotonic()
+        if wait <= 0 or not session_storage.wait_for_change(version, wait, args.interval):
+            if deadline is not None:
+                break
+    print(f"cursor {cursor}")
+    return 0
+
+
+def cmd_export_ical(args) -> int:
+    from .ical_service import ICalService
+    result = ICalService().export(args.out, full=args.full)
+    for email in result["written"]:
+        print(f"  wrote {email}.ics")
+    print(f"Updated {len(result['written'])} feed(s), {result['unchanged']} unchanged (seq {result['seq']})")
+    return 0
+
+
+def cmd_sweep_expired(args) -> int:
+    from .session_service import SessionService
+    svc = SessionService()
+    expired = svc.sweep_expired()
+    print(f"Expired {len(expired)} pending request(s)")
+    for s in expired:
+        print(f"  ID {s.id} {s.requester} -> {s.invitee} {s.course} {_when(s)} {s.start}-{s.end}")
     return 0
 
 
 def cmd_respond_session(args) -> int:
+    from .session_service import SessionService
     svc = SessionService()
     session = svc.respond(session_id=args.id, responder_email=args.email, action=args.action)
     print(f"Session {session.id} now {session.status}")
     return 0
 
 
+def cmd_reshard(args) -> int:
+    from . import session_storage, storage
+    if args.shards < 1:
+        raise ValidationError("--shards must be at least 1")
+    storage.reshard(args.shards)
+    session_storage.reshard(args.shards)
+    print(f"Data split into {args.shards} shard(s); set STUDYBUDDY_SHARDS={args.shards} for later commands")
+    return 0
+
+
+def _print_lag(lag) -> None:
+    print(f"applied={lag['applied']} pending={lag['pending']} lag={lag['seconds']:.1f}s", flush=True)
+
+
+def cmd_replicate(args) -> int:
+    import time
+    from . import replication
+    if not replication.is_replica():
+        raise ValidationError("Set STUDYBUDDY_REPLICA_OF to the primary's log directory")
+    while True:
+        applied = replication.apply_pending()
+        if applied or not args.follow:
+            print(f"Applied {applied} mutation(s)", flush=True)
+            _print_lag(replication.lag())
+        if not args.follow:
+            return 0
+        time.sleep(args.interval)
+
+
+def cmd_replication_status(args) -> int:
+    from . import replication
+    if not replication.is_replica():
+        raise ValidationError("Set STUDYBUDDY_REPLICA_OF to the primary's log directory")
+    _print_lag(replication.lag())
+    return 0
+
+
+def cmd_compact_log(args) -> int:
+    from . import replication
+    size = replication.compact()
+    print(f"Mutation log compacted to {size} bytes; replicas will reload from the checkpoint")
+    return 0
+
+
+def cmd_gc_snapshots(args) -> int:
+    from . import snapshots
+    if not snapshots.enabled():
+        raise ValidationError("Snapshots are off; set STUDYBUDDY_SNAPSHOTS=1")
+    removed = snapshots.collect_garbage(args.grace)
+    print(f"Removed {removed} old generation file(s); current generation {snapshots.current()['generation']}")
+    return 0
+
+
+def _run_batch_line(parser: argparse.ArgumentParser, argv) -> int:
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:  # argparse reports usage errors by exiting
+        return e.code if isinstance(e.code, int) else 2
+    if args.func is cmd_run_batch:
+        print("Error: run-batch cannot be nested", file=sys.stderr)
+        return 2
+    return _handle_errors(lambda: args.func(args))
+
+
+def cmd_run_batch(args) -> int:
+    """Run each line of a batch file against one in-memory copy of the data.
+
+    Writes are buffered in file_cache and flushed at the end (or every
+    --flush-every commands). A failing line's writes are rolled back, and
+    its exit status is reported on stderr as ``line N: exit C``. With
+    --atomic the first failure discards the whole batch.
+    """
+    import shlex
+    from . import file_cache, session_storage, storage
+    if args.flush_every < 0:
+        raise ValidationError("--flush-every must be zero or positive")
+    if args.atomic and args.flush_every:
+        raise ValidationError("--atomic cannot be combined with --flush-every")
+    try:
+        f = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")
+    except OSError as e:
+        raise ValidationError(f"Cannot read batch file: {e}")
+    parser = build_parser()
+    failures = run = 0
+    # Seqs are stamped when a line runs but reach disk on flush; holding the
+    # write locks keeps other writers from committing in between
+    with f, storage.write_lock(), session_storage.write_lock(), file_cache.buffered():
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                argv = shlex.split(line)
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                code = 2
+            else:
+                before = file_cache.pending_state()
+                try:
+                    code = _run_batch_line(parser, argv)
+                except BaseException:
+                    file_cache.restore(before)
+                    if not args.atomic:
+                        file_cache.flush()
+                    raise
+                if code != 0:
+                    file_cache.restore(before)
+            sys.stdout.flush()
+            print(f"line {lineno}: exit {code}", file=sys.stderr)
+            run += 1
+            if code != 0:
+                failures += 1
+                if args.atomic:
+                    print(f"Aborted at line {lineno}; no changes written", file=sys.stderr)
+                    return 1
+            if args.flush_every and run % args.flush_every == 0:
+                file_cache.flush()
+        file_cache.flush()
+    print(f"Ran {run} command(s), {failures} failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
 def main(argv=None) -> int:
     parser = build_parser()
     args = parser.parse_args(argv)
-    return _handle_errors(lambda: args.func(args))
+    if args.profile:
+        profiling.enable()
+    try:
+        with profiling.session(args.command, pstats_path=args.profile_out, trace_path=args.trace_out):
+            return _handle_errors(lambda: args.func(args))
+    finally:
+        # Metrics are best effort: never turn a command's result into a failure
+        try:
+            metrics.write_snapshot()
+        except Exception as e:  # noqa: BLE001
+            print(f"metrics snapshot failed: {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from . import course_catalog
+from .models import AvailabilitySlot, UserProfile
+from .profile_service import ValidationError
+from .availability_service import _DAY_MAP, _parse_time
+from .metrics import track
+
+# Week-relative intervals: minutes since Monday 00:00, sorted, non-overlapping.
+WeekIntervals = Tuple[Tuple[int, int], ...]
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def week_intervals(slots: Iterable[AvailabilitySlot]) -> WeekIntervals:
+    out = []
+    for s in slots:
+        base = _DAY_MAP[s.day] * MINUTES_PER_DAY
+        out.append((base + _parse_time(s.start), base + _parse_time(s.end)))
+    out.sort()
+    return tuple(out)
+
+
+def overlap_minutes(a: WeekIntervals, b: WeekIntervals) -> int:
+    """Total shared minutes between two sorted interval lists (two-pointer sweep)."""
+    i = j = total = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if end > start:
+            total += end - start
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return total
+
+
+# Set once per worker process by the pool initializer so each task only
+# ships its row range, not the whole roster.
+_ROSTER: Sequence[WeekIntervals] = ()
+
+
+def _init_worker(roster: Sequence[WeekIntervals]) -> None:
+    global _ROSTER
+    _ROSTER = roster
+
+
+def _rows(bounds: Tuple[int, int]) -> List[array]:
+    lo, hi = bounds
+    roster = _ROSTER
+    return [array("i", (overlap_minutes(roster[i], other) for other in roster)) for i in range(lo, hi)]
+
+
+def _npy_header(n: int) -> bytes:
+    header = "{'descr': '<i4', 'fortran_order': False, 'shape': (%d, %d), }" % (n, n)
+    # Magic + version + header length must pad to a multiple of 64 bytes
+    pad = 64 - (10 + len(header) + 1) % 64
+    header += " " * pad + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class CompatibilityService:
+    """All-pairs overlap matrices for a course roster."""
+
+    def roster(self, course_code: str) -> Tuple[List[str], List[WeekIntervals]]:
+        index = course_catalog.current_index()
+        members = sorted(
+            (UserProfile.from_dict(index.raw_users[p]) for p in index.member_positions(course_catalog.course_id(course_code))),
+            key=lambda u: u.email.lower(),
+        )
+        return [u.email for u in members], [week_intervals(u.availability) for u in members]
+
+    def iter_rows(self, roster: Sequence[WeekIntervals], workers: Optional[int] = None,
+                  block_rows: Optional[int] = None) -> Iterator[array]:
+        """Yield matrix rows in order, computing row blocks in a process pool.
+
+        Each row is computed in full (both triangles) so rows can be streamed
+        without keeping earlier rows in memory. The diagonal is each user's
+        own total free minutes.
+        """
+        n = len(roster)
+        workers = workers or os.cpu_count() or 1
+        block_rows = block_rows or max(1, min(256, n // (workers * 4) or 1))
+        blocks = [(lo, min(n, lo + block_rows)) for lo in range(0, n, block_rows)]
+        if workers <= 1 or n < 2 * block_rows:
+            _init_worker(roster)
+            for b in blocks:
+                yield from _rows(b)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tuple(roster),)) as pool:
+            for rows in pool.map(_rows, blocks):
+                yield from rows
+
+    @track("compatibility", "course_matrix")
+    def course_matrix(self, course_code: str, out_path: str, fmt: Optional[str] = None,
+                      workers: Optional[int] = None) -> List[str]:
+        """Write the N x N overlap-minutes matrix for a course; return the row emails.
+
+        ``fmt`` is ``csv`` (header row and first column hold emails) or ``npy``
+        (int32 matrix, emails written one per line to ``<out>.emails.txt``).
+        Defaults to the output file's suffix.
+        """
+        path = Path(out_path)
+        fmt = (fmt or path.suffix.lstrip(".") or "csv").lower()
+        if fmt not in {"csv", "npy"}:
+            raise ValidationError("Format must be csv or npy")
+        emails, roster = self.roster(course_code)
+        if not emails:
+            raise ValidationError("No students enrolled in that course")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = self.iter_rows(roster, workers=workers)
+        if fmt == "csv":
+            with path.open("w", encoding="utf-8", newline="") as f:
+                f.write("email," + ",".join(emails) + "\n")
+                for email, row in zip(emails, rows):
+                    f.write(email + "," + ",".join(map(str, row)) + "\n")
+        else:
+            with path.open("wb") as f:
+                f.write(_npy_header(len(emails)))
+                for row in rows:
+                    if sys.byteorder != "little":
+                        row.byteswap()
+                    f.write(row.tobytes())
+            Path(str(path) + ".emails.txt").write_text("\n".join(emails) + "\n", encoding="utf-8")
+        return emails
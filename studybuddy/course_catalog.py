@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .errors import ValidationError
+from . import storage
+
+# Single source of truth for course codes.
+#
+# Codes are normalized once (memoized) to the display form "CPSC 3720" and
+# interned to small integer ids for the lifetime of the process. Enrollments
+# are handled as frozensets of ids, and CourseIndex maps each id to the
+# positions of its members in the users file, so membership checks are O(1)
+# and a roster lookup only materializes the profiles it returns.
+
+COURSE_PATTERN = re.compile(r"^[A-Z]{3,4}\s?\d{4}$")  # e.g., CPSC3720 or CPSC 3720
+
+_ids: Dict[str, int] = {}
+_codes: List[str] = []
+
+
+@lru_cache(maxsize=4096)
+def normalize_course(raw: str) -> str:
+    """Normalize a user-entered course code to "LETTERS DIGITS" or raise ValidationError."""
+    candidate = raw.strip().upper().replace(" ", "")
+    if not COURSE_PATTERN.match(candidate):
+        raise ValidationError("Course code must look like CPSC 3720")
+    letters = ''.join(ch for ch in candidate if ch.isalpha())
+    digits = ''.join(ch for ch in candidate if ch.isdigit())
+    return f"{letters} {digits}"
+
+
+def intern(code: str) -> int:
+    """Return the id of an already-normalized course code, assigning one if new."""
+    cid = _ids.get(code)
+    if cid is None:
+        cid = len(_codes)
+        _ids[code] = cid
+        _codes.append(code)
+    return cid
+
+
+def course_id(raw: str) -> int:
+    return intern(normalize_course(raw))
+
+
+def code_for(cid: int) -> str:
+    return _codes[cid]
+
+
+@lru_cache(maxsize=65536)
+def _enrollment_ids(courses: Tuple[str, ...]) -> FrozenSet[int]:
+    return frozenset(intern(c) for c in courses)
+
+
+def enrollment_ids(courses: Sequence[str]) -> FrozenSet[int]:
+    """Interned ids for a profile's stored course list."""
+    return _enrollment_ids(tuple(courses))
+
+
+def is_enrolled(courses: Sequence[str], cid: int) -> bool:
+    return cid in enrollment_ids(courses)
+
+
+class CourseIndex:
+    """Inverted index from course id to member positions in the users file."""
+
+    def __init__(self, raw_users: Sequence) -> None:
+        self.raw_users = raw_users
+        self.positions: Dict[int, List[int]] = {}
+        self.by_email: Dict[str, int] = {}
+        for pos, raw in enumerate(raw_users):
+            self.by_email[raw["email"].lower()] = pos
+            for cid in enrollment_ids(raw.get("courses", ())):
+                self.positions.setdefault(cid, []).append(pos)
+
+    def member_positions(self, cid: int) -> List[int]:
+        return self.positions.get(cid, [])
+
+    def members(self, cid: int) -> List[str]:
+        return [self.raw_users[p]["email"] for p in self.member_positions(cid)]
+
+    def enrollments(self, email: str) -> FrozenSet[int]:
+        pos = self.by_email.get(email.lower())
+        if pos is None:
+            return frozenset()
+        return enrollment_ids(self.raw_users[pos].get("courses", ()))
+
+
+_cached: Optional[Tuple[object, CourseIndex]] = None
+
+
+def current_index() -> CourseIndex:
+    """CourseIndex for the current users file, rebuilt when the file changes."""
+    global _cached
+    version = storage.data_version()
+    if _cached is not None and version is not None and _cached[0] == version:
+        return _cached[1]
+    index = CourseIndex(storage.load_raw())
+    _cached = (version, index)
+    return index
@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+
+class ProfileError(Exception):
+    """Base exception for profile issues."""
+
+
+class ValidationError(ProfileError):
+    pass
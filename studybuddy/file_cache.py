@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics, profiling, serialization, snapshots
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are unlocked
+    fcntl = None
+
+# Per-process cache of parsed JSON data files.
+#
+# Entries are keyed on the resolved path and validated against the file's
+# (mtime_ns, size, inode) signature, so a rewrite by another process (which
+# always lands as a new inode via atomic rename) invalidates the entry on the
+# next read. Cached documents are frozen (dicts -> mappingproxy, lists ->
+# tuples) so callers cannot mutate shared state by accident; the storage
+# modules build fresh model objects from them on every load.
+#
+# While buffering (see ``buffered``), writes and deletes are held in memory
+# instead of hitting disk: reads and signatures see the pending document (or
+# a missing file), and ``flush`` writes each dirty file once and removes the
+# deleted ones in the same commit. With STUDYBUDDY_SNAPSHOTS on, paths
+# are logical names resolved through the snapshots manifest.
+
+Signature = Tuple[int, int, int]
+
+_CACHE: Dict[str, Tuple[Signature, Any]] = {}
+stats = {"hits": 0, "misses": 0}
+
+# key -> (path, pseudo-signature, document, frozen document) for unflushed writes
+_PENDING: Dict[str, Tuple[Path, Signature, Any, Any]] = {}
+# key -> (path, lines) for unflushed appends (see append_lines)
+_PENDING_LINES: Dict[str, Tuple[Path, List[str]]] = {}
+# key -> path for unflushed deletes
+_PENDING_DELETES: Dict[str, Path] = {}
+_buffering = False
+_write_count = 0
+# lock file -> (open handle, depth) for the reentrant ``locked``
+_LOCKS: Dict[str, Tuple[Any, int]] = {}
+
+
+def _key(path: Path) -> str:
+    return os.path.abspath(path)
+
+
+def signature(path: Path) -> Optional[Signature]:
+    """Return the (mtime_ns, size, inode) signature of a file, or None if missing.
+
+    A file with a buffered write gets a pseudo-signature that changes on
+    every write, so version-keyed caches still see each change.
+    """
+    key = _key(path)
+    pending = _PENDING.get(key)
+    if pending is not None:
+        return pending[1]
+    if key in _PENDING_DELETES:
+        return None
+    return _stat(snapshots.resolve(path))
+
+
+def _stat(physical: Path) -> Optional[Signature]:
+    try:
+        st = os.stat(physical)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def read_json(path: Path) -> Optional[Any]:
+    """Return the frozen parsed contents of ``path`` (None if it does not exist)."""
+    key = _key(path)
+    pending = _PENDING.get(key)
+    if pending is not None:
+        stats["hits"] += 1
+        metrics.CACHE_LOOKUPS.inc(result="hit")
+        return pending[3]
+    if key in _PENDING_DELETES:
+        return None
+    # Resolve once so the signature and the parsed bytes come from the same generation
+    physical = snapshots.resolve(path)
+    sig = _stat(physical)
+    if sig is None:
+        _CACHE.pop(key, None)
+        return None
+    hit = _CACHE.get(key)
+    if hit is not None and hit[0] == sig:
+        stats["hits"] += 1
+        metrics.CACHE_LOOKUPS.inc(result="hit")
+        return hit[1]
+    stats["misses"] += 1
+    metrics.CACHE_LOOKUPS.inc(result="miss")
+    with metrics.LOAD_SECONDS.time(file=path.name):
+        doc = _parse(physical)
+    return _store(path, sig, doc)
+
+
+def _parse(path: Path) -> Any:
+    with path.open("rb") as f:
+        return freeze(serialization.loads(f.read()))
+
+
+def _store(path: Path, sig: Signature, doc: Any) -> Any:
+    profiling.add("storage.bytes_read", sig[1])
+    metrics.STORAGE_FILE_BYTES.set(sig[1], file=path.name)
+    _CACHE[_key(path)] = (sig, doc)
+    return doc
+
+
+def read_json_many(paths: List[Path]) -> List[Optional[Any]]:
+    """``read_json`` for several files (e.g. every shard), in order.
+
+    Deliberately sequential: decoding and ``freeze`` are pure Python under
+    the GIL, so parsing shards on threads measured no faster.
+    """
+    return [read_json(path) for path in paths]
+
+
+def write_json(path: Path, data: Any) -> None:
+    """Atomically write ``data`` to ``path`` and prime the cache with it."""
+    global _write_count
+    if _buffering:
+        _write_count += 1
+        _PENDING_DELETES.pop(_key(path), None)
+        _PENDING[_key(path)] = (path, (-1, -1, _write_count), data, freeze(data))
+        return
+    _write_files([(path, data)])
+
+
+def write_json_many(docs: List[Tuple[Path, Any]], deletes: List[Path] = ()) -> None:
+    """Write several files (and remove others) as one unit.
+
+    With snapshots on, all of them land in a single generation, so a pinned
+    reader sees either none or all of the changes (e.g. every shard of a
+    ``save_all``). While buffering the writes are queued as usual and are
+    committed together by ``flush``.
+    """
+    if _buffering:
+        for path, data in docs:
+            write_json(path, data)
+        for path in deletes:
+            delete(path)
+        return
+    _write_files(docs, deletes)
+
+
+def _write_files(docs: List[Tuple[Path, Any]], deletes: List[Path] = ()) -> None:
+    """Write documents to disk; with snapshots on they land as one generation."""
+    payloads = [(path, serialization.dumps(data)) for path, data in docs]
+    if snapshots.enabled():
+        snapshots.commit(payloads, deletes=deletes)
+    else:
+        for path, payload in payloads:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with tmp_path.open("wb") as f:
+                f.write(payload)
+            tmp_path.replace(path)
+        for path in deletes:
+            if path.exists():
+                path.unlink()
+    for path in deletes:
+        _PENDING.pop(_key(path), None)
+        invalidate(path)
+    for (path, data), (_, payload) in zip(docs, payloads):
+        profiling.add("storage.bytes_written", len(payload))
+        metrics.STORAGE_FILE_BYTES.set(len(payload), file=path.name)
+        sig = signature(path)
+        if sig is not None:
+            _CACHE[_key(path)] = (sig, freeze(data))
+
+
+def delete(path: Path) -> None:
+    """Remove a data file (retiring its generation when snapshots are on).
+
+    While buffering the removal is queued and happens on ``flush``.
+    """
+    if _buffering:
+        _PENDING.pop(_key(path), None)
+        _PENDING_DELETES[_key(path)] = path
+        return
+    _write_files([], [path])
+
+
+def invalidate(path: Optional[Path] = None) -> None:
+    """Drop one cached file, or everything when no path is given."""
+    if path is None:
+        _CACHE.clear()
+    else:
+        _CACHE.pop(_key(path), None)
+
+
+def append_lines(path: Path, lines: List[str]) -> None:
+    """Append newline-terminated ``lines`` to a log file in one locked write.
+
+    Buffered like ``write_json``; on flush appends go out before documents,
+    so a log never trails the data it describes.
+    """
+    if _buffering:
+        _PENDING_LINES.setdefault(_key(path), (path, []))[1].extend(lines)
+        return
+    _append_file(path, lines)
+
+
+def _append_file(path: Path, lines: List[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = "".join(line + "\n" for line in lines).encode("utf-8")
+    with path.open("ab") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(payload)
+        f.flush()
+    profiling.add("storage.bytes_written", len(payload))
+
+
+@contextmanager
+def locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on ``<path>.lock`` for the block (reentrant).
+
+    Serializes read-modify-write cycles on ``path`` across processes; nested
+    use in the same process just deepens the hold.
+    """
+    key = os.path.abspath(str(path)) + ".lock"
+    if key in _LOCKS:
+        handle, depth = _LOCKS[key]
+        _LOCKS[key] = (handle, depth + 1)
+        try:
+            yield
+        finally:
+            handle, depth = _LOCKS[key]
+            _LOCKS[key] = (handle, depth - 1)
+        return
+    Path(key).parent.mkdir(parents=True, exist_ok=True)
+    with open(key, "a") as handle:
+        if fcntl is not None:
+            with metrics.LOCK_WAIT_SECONDS.time(file=Path(path).name):
+                fcntl.flock(handle, fcntl.LOCK_EX)
+        _LOCKS[key] = (handle, 1)
+        try:
+            yield
+        finally:
+            del _LOCKS[key]  # closing the handle releases the lock
+
+
+def is_buffering() -> bool:
+    return _buffering
+
+
+def has_pending(path: Path) -> bool:
+    return _key(path) in _PENDING or _key(path) in _PENDING_DELETES
+
+
+def pending_state() -> tuple:
+    """Snapshot of unflushed writes, appends and deletes, for ``restore`` after a failed step."""
+    return (dict(_PENDING), {k: (p, list(lines)) for k, (p, lines) in _PENDING_LINES.items()},
+            dict(_PENDING_DELETES))
+
+
+def restore(state: tuple) -> None:
+    docs, lines, deletes = state
+    _PENDING.clear()
+    _PENDING.update(docs)
+    _PENDING_LINES.clear()
+    _PENDING_LINES.update(lines)
+    _PENDING_DELETES.clear()
+    _PENDING_DELETES.update(deletes)
+
+
+def flush() -> int:
+    """Write every buffered file to disk; returns the number of files written."""
+    written = 0
+    while _PENDING_LINES:
+        path, lines = _PENDING_LINES.pop(next(iter(_PENDING_LINES)))
+        _append_file(path, lines)
+        written += 1
+    if _PENDING or _PENDING_DELETES:
+        docs = [(path, doc) for path, _, doc, _ in _PENDING.values()]
+        deletes = list(_PENDING_DELETES.values())
+        _PENDING.clear()
+        _PENDING_DELETES.clear()
+        _write_files(docs, deletes)  # one snapshot generation
+        written += len(docs) + len(deletes)
+    return written
+
+
+def discard() -> None:
+    """Drop all buffered writes and deletes; the files on disk are left untouched."""
+    _PENDING.clear()
+    _PENDING_LINES.clear()
+    _PENDING_DELETES.clear()
+
+
+@contextmanager
+def buffered() -> Iterator[None]:
+    """Hold writes in memory for the duration of the block.
+
+    Nothing is flushed on exit; call ``flush`` (or ``discard``) inside the
+    block. Anything still pending when the block ends is discarded.
+    """
+    global _buffering
+    if _buffering:
+        raise RuntimeError("file_cache.buffered() is not reentrant")
+    _buffering = True
+    try:
+        yield
+    finally:
+        _buffering = False
+        discard()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import math
+import random
+import re
+from time import monotonic
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .profile_service import ValidationError
+from .availability_service import DAY_ORDER, _parse_time, _time_str
+from .compatibility_service import CompatibilityService, WeekIntervals, MINUTES_PER_DAY
+from .metrics import track
+
+_DAY_MASK = (1 << MINUTES_PER_DAY) - 1
+_RUN = re.compile("1+")
+
+
+def week_bitmap(intervals: WeekIntervals) -> int:
+    """Pack week-relative intervals into an int with one bit per minute of the week."""
+    mask = 0
+    for start, end in intervals:
+        mask |= ((1 << (end - start)) - 1) << start
+    return mask
+
+
+def common_mask(masks: Sequence[int]) -> int:
+    if not masks:
+        return 0
+    acc = masks[0]
+    for m in masks[1:]:
+        acc &= m
+    return acc
+
+
+def longest_window(mask: int) -> Optional[Tuple[str, int, int]]:
+    """Longest run of free minutes within a single day: (DAY, start, end)."""
+    best: Optional[Tuple[str, int, int]] = None
+    for idx, day in enumerate(DAY_ORDER):
+        day_bits = (mask >> (idx * MINUTES_PER_DAY)) & _DAY_MASK
+        if not day_bits:
+            continue
+        # Reverse so string position == minute of day
+        bits = format(day_bits, f"0{MINUTES_PER_DAY}b")[::-1]
+        for m in _RUN.finditer(bits):
+            if best is None or m.end() - m.start() > best[2] - best[1]:
+                best = (day, m.start(), m.end())
+    return best
+
+
+def _target_sizes(n: int, min_size: int, max_size: int) -> List[int]:
+    groups = max(1, math.ceil(n / max_size))
+    base, extra = divmod(n, groups)
+    if base < min_size:
+        raise ValidationError(f"Cannot split {n} students into groups of {min_size}-{max_size}")
+    return [base + 1] * extra + [base] * (groups - extra)
+
+
+class GroupService:
+    """Partition a course roster into study groups with maximal shared free time."""
+
+    def __init__(self) -> None:
+        self._compat = CompatibilityService()
+
+    @track("group", "form_groups")
+    def form_groups(self, course_code: str, min_size: int = 3, max_size: int = 5,
+                    time_budget: float = 2.0, seed: int = 0) -> List[Dict]:
+        """Return proposed groups for a course.
+
+        A greedy pass seeds each group with the least-available unassigned
+        student and repeatedly adds whoever keeps the most common minutes; a
+        swap-based local search then runs until ``time_budget`` seconds have
+        passed, keeping swaps that raise the total common time.
+
+        Each entry: {members: [email], common_minutes, window: (DAY, start, end) | None}
+        """
+        if min_size < 2 or max_size < min_size:
+            raise ValidationError("Group sizes must satisfy 2 <= min <= max")
+        emails, roster = self._compat.roster(course_code)
+        if not emails:
+            raise ValidationError("No students enrolled in that course")
+        masks = [week_bitmap(iv) for iv in roster]
+        deadline = monotonic() + max(0.0, time_budget)
+        groups = self._greedy(masks, _target_sizes(len(emails), min_size, max_size))
+        groups = self._local_search(masks, groups, deadline, random.Random(seed))
+
+        results: List[Dict] = []
+        for members in groups:
+            common = common_mask([masks[i] for i in members])
+            window = longest_window(common)
+            results.append({
+                "members": [emails[i] for i in members],
+                "common_minutes": common.bit_count(),
+                "window": None if window is None else (window[0], _time_str(window[1]), _time_str(window[2])),
+            })
+        results.sort(key=lambda g: g["common_minutes"], reverse=True)
+        return results
+
+    @staticmethod
+    def _greedy(masks: List[int], sizes: List[int]) -> List[List[int]]:
+        unassigned = sorted(range(len(masks)), key=lambda i: masks[i].bit_count())
+        remaining = set(unassigned)
+        groups: List[List[int]] = []
+        for size in sizes:
+            seed = next(i for i in unassigned if i in remaining)
+            remaining.discard(seed)
+            group = [seed]
+            acc = masks[seed]
+            while len(group) < size:
+                pick = max(remaining, key=lambda i: ((acc & masks[i]).bit_count(), -i))
+                remaining.discard(pick)
+                group.append(pick)
+                acc &= masks[pick]
+            groups.append(group)
+        return groups
+
+    @staticmethod
+    def _local_search(masks: List[int], groups: List[List[int]], deadline: float,
+                      rng: random.Random) -> List[List[int]]:
+        if len(groups) < 2:
+            return groups
+        scores = [common_mask([masks[i] for i in g]).bit_count() for g in groups]
+        while monotonic() < deadline:
+            for _ in range(256):  # check the clock in batches
+                ga, gb = rng.sample(range(len(groups)), 2)
+                ia = rng.randrange(len(groups[ga]))
+                ib = rng.randrange(len(groups[gb]))
+                a, b = groups[ga], groups[gb]
+                a[ia], b[ib] = b[ib], a[ia]
+                new_a = common_mask([masks[i] for i in a]).bit_count()
+                new_b = common_mask([masks[i] for i in b]).bit_count()
+                if new_a + new_b > scores[ga] + scores[gb]:
+                    scores[ga], scores[gb] = new_a, new_b
+                else:
+                    a[ia], b[ib] = b[ib], a[ia]  # undo
+        return groups
+
+    def propose_group_sessions(self, course_code: str, groups: List[Dict], duration: int = 60,
+                               message: str | None = "Study group") -> List[Dict]:
+        """Propose one session per group at the start of its common window.
+
+        The first member invites every other member through SessionService,
+        so the usual enrollment and availability checks apply.
+        Returns [{members, session_ids, errors}].
+        """
+        from .session_service import SessionService
+        sessions = SessionService()
+        out: List[Dict] = []
+        for g in groups:
+            ids: List[int] = []
+            errors: List[str] = []
+            window = g["window"]
+            if window is None or _parse_time(window[2]) - _parse_time(window[1]) < duration:
+                errors.append("No common window long enough")
+            else:
+                day, start, _ = window
+                end = _time_str(_parse_time(start) + duration)
+                host, *guests = g["members"]
+                for guest in guests:
+                    try:
+                        ids.append(sessions.propose(host, guest, course_code, day, start, end, message).id)
+                    except ValidationError as e:
+                        errors.append(f"{guest}: {e}")
+            out.append({"members": g["members"], "session_ids": ids, "errors": errors})
+        return out
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import date as Date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Set
+
+from . import session_storage
+from .availability_service import _DAY_MAP
+from .metrics import track
+from .session_models import StudySession
+from .session_table import current_table
+
+# Per-user iCalendar feeds of accepted sessions.
+#
+# The export directory holds one <email>.ics per user plus feeds.json,
+# which records the session change-feed seq the feeds reflect and each
+# feed's ETag (a hash of the events' session fields, so DTSTAMP and the
+# anchor date of legacy sessions do not count as changes). Every
+# propose/respond/expiry stamps the session with a new seq, so an export
+# only re-renders the requester and invitee of sessions changed since the
+# recorded seq; a feed whose ETag is unchanged (e.g. after a new pending
+# request) is not rewritten. Times are floating local times, like the rest
+# of the app.
+
+STATE_FILE = "feeds.json"
+_WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    # RFC 5545: lines longer than 75 octets continue on lines starting with a space
+    out, size = [], 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > 75:
+            out.append("\r\n ")
+            size = 1
+        out.append(ch)
+        size += n
+    return "".join(out)
+
+
+def _first_date(session: StudySession, today: Date) -> Date:
+    if session.date:
+        return Date.fromisoformat(session.date)
+    # Weekly sessions start on the first matching weekday on or after the
+    # local date they were proposed (the export date for legacy sessions)
+    created = datetime.fromtimestamp(session.created_at).date() if session.created_at is not None else today
+    return created + timedelta(days=(_DAY_MAP[session.day] - created.weekday()) % 7)
+
+
+def _other(session: StudySession, email: str) -> str:
+    return session.invitee if session.requester.lower() == email.lower() else session.requester
+
+
+def _event(session: StudySession, email: str, now: datetime) -> List[str]:
+    day = _first_date(session, now.astimezone().date()).strftime("%Y%m%d")
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:session-{session.id}@studybuddy",
+        f"DTSTAMP:{now.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{day}T{session.start.replace(':', '')}00",
+        f"DTEND:{day}T{session.end.replace(':', '')}00",
+        f"SUMMARY:{_escape(f'{session.course} study session with {_other(session, email)}')}",
+    ]
+    if not session.date:
+        lines.append(f"RRULE:FREQ=WEEKLY;BYDAY={_WEEKDAYS[_DAY_MAP[session.day]]}")
+    if session.message:
+        lines.append(f"DESCRIPTION:{_escape(session.message)}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def render(email: str, sessions: Iterable[StudySession], now: datetime | None = None) -> str:
+    """VCALENDAR text for ``email``'s sessions, ordered by id; DTSTAMP is ``now`` (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//StudyBuddy//Sessions//EN", "CALSCALE:GREGORIAN"]
+    for s in sorted(sessions, key=lambda s: s.id):
+        lines.extend(_event(s, email, now))
+    lines.append("END:VCALENDAR")
+    return "".join(_fold(line) + "\r\n" for line in lines)
+
+
+def etag(email: str, sessions: Iterable[StudySession]) -> str:
+    """Hash of the fields that make up ``email``'s feed."""
+    fields = sorted(
+        (s.id, s.course, _other(s, email), s.day, s.date, s.start, s.end, s.message, s.created_at)
+        for s in sessions
+    )
+    return '"' + hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def feed_path(out_dir: Path, email: str) -> Path:
+    return Path(out_dir) / f"{email.lower()}.ics"
+
+
+def _load_state(out_dir: Path) -> Dict:
+    try:
+        with open(Path(out_dir) / STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def feed_etag(out_dir: Path, email: str) -> str | None:
+    """ETag of the last exported feed for ``email`` (for If-None-Match checks)."""
+    return _load_state(out_dir).get("feeds", {}).get(email.lower())
+
+
+class ICalService:
+    """Export accepted sessions as one iCalendar feed per user."""
+
+    @track("ical", "export")
+    def export(self, out_dir: str | Path, full: bool = False) -> Dict:
+        """Bring the feeds in ``out_dir`` up to date with the sessions file.
+
+        Returns {seq, checked, written: [email], unchanged}. ``full`` (or a
+        missing or newer-than-data state file) re-renders every user with
+        an accepted session or an existing feed.
+        """
+        out = Path(out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        state = _load_state(out)
+        feeds: Dict[str, str] = dict(state.get("feeds", {}))
+        seq = session_storage.current_seq()
+        since = state.get("seq")
+        affected: Set[str] = set()
+        if full or since is None or since > seq:
+            affected.update(feeds)
+            for d in session_storage.load_raw():
+                if d.get("status") == "accepted":
+                    affected.update((d["requester"].lower(), d["invitee"].lower()))
+        else:
+            for s in session_storage.changes_since(since):
+                affected.update((s.requester.lower(), s.invitee.lower()))
+        table = current_table()
+        written: List[str] = []
+        for email in sorted(affected):
+            sessions = table.materialize_rows(table.confirmed(email))
+            if not sessions and email not in feeds:
+                continue  # no feed yet and nothing to put in one
+            tag = etag(email, sessions)
+            path = feed_path(out, email)
+            if feeds.get(email) == tag and path.exists():
+                continue
+            _write_atomic(path, render(email, sessions))
+            feeds[email] = tag
+            written.append(email)
+        # Written last: an interrupted export is redone from the old seq
+        if written or since != seq:
+            _write_atomic(out / STATE_FILE, json.dumps({"seq": seq, "feeds": feeds}, indent=2, sort_keys=True))
+        return {"seq": seq, "checked": len(affected), "written": written, "unchanged": len(affected) - len(written)}
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import json
+import os
+from bisect import bisect_left
+from contextlib import ContextDecorator
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Small in-process metrics registry (counters, gauges, histograms).
+#
+# Services record operations as they happen; write_snapshot() dumps the
+# registry as Prometheus text exposition or JSON to a local file that a
+# scraper (node_exporter textfile collector, a sidecar, ...) can read.
+# Set STUDYBUDDY_METRICS_PATH to have the CLI write a snapshot after every
+# command; a .json suffix selects JSON, anything else Prometheus text.
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS: Tuple[float, ...] = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts..., +Inf count], sum
+        self.values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = ([0] * (len(self.buckets) + 1), [0.0])
+            self.values[key] = entry
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def time(self, **labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict[str, str]) -> None:
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(perf_counter() - self._t0, **self._labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, help, **kwargs)
+            self._metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.values.clear()  # type: ignore[attr-defined]
+
+    def collect(self) -> List[object]:
+        return list(self._metrics.values())
+
+    def dump_state(self) -> Dict[str, list]:
+        return {
+            m.name: [[list(map(list, key)), value] for key, value in m.values.items()]  # type: ignore[attr-defined]
+            for m in self._metrics.values()
+        }
+
+    def merge_state(self, state: Dict[str, list]) -> None:
+        """Fold a previous process's dump_state() into the live values.
+
+        Counters and histograms add up; gauges keep the newer (live) value.
+        """
+        for name, series in state.items():
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            for raw_key, value in series:
+                key = tuple(tuple(pair) for pair in raw_key)
+                live = metric.values.get(key)  # type: ignore[attr-defined]
+                if isinstance(metric, Histogram):
+                    if live is None:
+                        metric.values[key] = (list(value[0]), list(value[1]))
+                    else:
+                        for i, count in enumerate(value[0]):
+                            live[0][i] += count
+                        live[1][0] += value[1][0]
+                elif isinstance(metric, Counter):
+                    metric.values[key] = (live or 0) + value
+                elif live is None:
+                    metric.values[key] = value
+
+
+REGISTRY = Registry()
+
+# Service operations
+OPERATIONS = REGISTRY.counter("studybuddy_operations_total", "Service operations by name and outcome")
+OPERATION_SECONDS = REGISTRY.histogram("studybuddy_operation_seconds", "Service operation latency")
+SEARCH_SECONDS = REGISTRY.histogram("studybuddy_search_seconds", "Search latency by course size bucket")
+SEARCH_COURSE_SIZE = REGISTRY.histogram("studybuddy_search_course_size", "Classmates per searched course", buckets=SIZE_BUCKETS)
+# Storage
+LOAD_SECONDS = REGISTRY.histogram("studybuddy_storage_load_seconds", "Time to read and parse a data file")
+STORAGE_FILE_BYTES = REGISTRY.gauge("studybuddy_storage_file_bytes", "Size of each data file at last read or write")
+CACHE_LOOKUPS = REGISTRY.counter("studybuddy_storage_cache_lookups_total", "Read cache lookups by result")
+LOCK_WAIT_SECONDS = REGISTRY.histogram("studybuddy_lock_wait_seconds", "Time spent waiting for a file lock")
+OVERLAP_CACHE_LOOKUPS = REGISTRY.counter("studybuddy_overlap_cache_lookups_total", "Pairwise overlap cache lookups by result")
+# Sessions
+SESSION_RESPONSES = REGISTRY.counter("studybuddy_session_responses_total", "Session responses by action")
+SESSIONS_EXPIRED = REGISTRY.counter("studybuddy_sessions_expired_total", "Pending requests expired by TTL")
+
+
+def size_bucket(n: int) -> str:
+    """Coarse label for a course size so latency can be broken down by it."""
+    for bound in SIZE_BUCKETS:
+        if n <= bound:
+            return f"le{int(bound)}"
+    return "gt" + str(int(SIZE_BUCKETS[-1]))
+
+
+class track(ContextDecorator):
+    """Count and time a service operation; usable as decorator or ``with``.
+
+    Outcome is ``ok`` unless the block raises, in which case it is ``error``.
+    """
+
+    def __init__(self, service: str, op: str) -> None:
+        self.service = service
+        self.op = op
+
+    def _recreate_cm(self) -> "track":
+        # Fresh instance per decorated call so timings never interleave
+        return track(self.service, self.op)
+
+    def __enter__(self) -> "track":
+        self._t0 = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        outcome = "ok" if exc_type is None else "error"
+        OPERATIONS.inc(service=self.service, op=self.op, outcome=outcome)
+        OPERATION_SECONDS.observe(perf_counter() - self._t0, service=self.service, op=self.op)
+
+
+def cache_hit_ratio() -> Optional[float]:
+    hits = CACHE_LOOKUPS.values.get(_label_key({"result": "hit"}), 0)
+    misses = CACHE_LOOKUPS.values.get(_label_key({"result": "miss"}), 0)
+    total = hits + misses
+    return hits / total if total else None
+
+
+def _fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY.collect():
+        kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        if isinstance(metric, Histogram):
+            for key, (counts, total) in sorted(metric.values.items()):
+                running = 0
+                for bound, count in zip(list(metric.buckets) + [float("inf")], counts):
+                    running += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{metric.name}_bucket{_fmt_labels(key, (('le', le),))} {running}")
+                lines.append(f"{metric.name}_sum{_fmt_labels(key)} {total[0]}")
+                lines.append(f"{metric.name}_count{_fmt_labels(key)} {running}")
+        else:
+            for key, value in sorted(metric.values.items()):  # type: ignore[attr-defined]
+                lines.append(f"{metric.name}{_fmt_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, object]:
+    """Return the registry as a JSON-serializable dict."""
+    out: Dict[str, object] = {}
+    for metric in REGISTRY.collect():
+        series = []
+        for key, value in sorted(metric.values.items()):  # type: ignore[attr-defined]
+            labels = dict(key)
+            if isinstance(metric, Histogram):
+                counts, total = value
+                series.append({
+                    "labels": labels,
+                    "buckets": dict(zip([str(b) for b in metric.buckets] + ["+Inf"], counts)),
+                    "count": sum(counts),
+                    "sum": total[0],
+                })
+            else:
+                series.append({"labels": labels, "value": value})
+        out[metric.name] = {"type": type(metric).__name__.lower(), "help": metric.help, "series": series}
+    out["studybuddy_storage_cache_hit_ratio"] = cache_hit_ratio()
+    return out
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    tmp.replace(path)
+
+
+def write_snapshot(path: Optional[str] = None) -> Optional[Path]:
+    """Write the registry to ``path`` (default: $STUDYBUDDY_METRICS_PATH).
+
+    Each CLI invocation is its own process, so values are accumulated in a
+    ``<path>.state`` sidecar and the exported counters stay monotonic across
+    runs. The sidecar is read, merged and rewritten under the same file lock
+    the storage layer uses, so concurrent commands do not drop each other's
+    counts. The live registry is cleared afterwards to avoid double counting.
+    """
+    from . import file_cache  # file_cache imports this module
+    target = path or os.environ.get("STUDYBUDDY_METRICS_PATH")
+    if not target:
+        return None
+    out = Path(target)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    state_path = out.with_name(out.name + ".state")
+    with file_cache.locked(state_path):
+        if state_path.exists():
+            REGISTRY.merge_state(json.loads(state_path.read_text(encoding="utf-8")))
+        text = json.dumps(snapshot(), indent=2) if out.suffix == ".json" else render_prometheus()
+        _write_atomic(state_path, json.dumps(REGISTRY.dump_state()))
+        _write_atomic(out, text)
+    REGISTRY.clear()
+    return out
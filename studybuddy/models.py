@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Sequence
 
 
 @dataclass
@@ -14,16 +14,41 @@ class AvailabilitySlot:
         return {"day": self.day, "start": self.start, "end": self.end}
 
     @staticmethod
-    def from_dict(data: Dict[str, Any]) -> "AvailabilitySlot":
+    def from_dict(data: Dict[str, Any] | Sequence[str]) -> "AvailabilitySlot":
+        # Data files store slots as [day, start, end] rows (see serialization)
+        if isinstance(data, (list, tuple)):
+            day, start, end = data
+            return AvailabilitySlot(day=day, start=start, end=end)
         return AvailabilitySlot(day=data["day"], start=data["start"], end=data["end"])
 
 
+@dataclass
+class AvailabilityOverride:
+    date: str   # YYYY-MM-DD
+    start: str  # HH:MM 24h
+    end: str    # HH:MM 24h
+    kind: str = "add"  # "add": extra free time that day; "block": not free
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"date": self.date, "kind": self.kind, "start": self.start, "end": self.end}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any] | Sequence[str]) -> "AvailabilityOverride":
+        # Data files store overrides as [date, kind, start, end] rows
+        if isinstance(data, (list, tuple)):
+            date, kind, start, end = data
+            return AvailabilityOverride(date=date, start=start, end=end, kind=kind)
+        return AvailabilityOverride(date=data["date"], start=data["start"], end=data["end"], kind=data.get("kind", "add"))
+
+
 @dataclass
 class UserProfile:
     name: str
     email: str
     courses: List[str] = field(default_factory=list)
     availability: List[AvailabilitySlot] = field(default_factory=list)
+    # Dated exceptions layered over the weekly pattern, sorted by date
+    overrides: List[AvailabilityOverride] = field(default_factory=list)
 
     def to_dict(self) -> dict:
         return {
@@ -31,6 +56,7 @@ class UserProfile:
             "email": self.email,
             "courses": list(self.courses),
             "availability": [slot.to_dict() for slot in self.availability],
+            "overrides": [o.to_dict() for o in self.overrides],
         }
 
     @staticmethod
@@ -40,4 +66,5 @@ class UserProfile:
             email=data["email"],
             courses=list(data.get("courses", [])),
             availability=[AvailabilitySlot.from_dict(x) for x in data.get("availability", [])],
+            overrides=[AvailabilityOverride.from_dict(x) for x in data.get("overrides", [])],
         )
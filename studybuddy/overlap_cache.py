@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import file_cache, metrics, replication, storage
+
+# Persistent, size-bounded LRU of pairwise overlap results.
+#
+# Keys are (requester digest, classmate digest), where a digest is
+# availability_service.availability_digest of the user's weekly slots (a
+# content hash, memoized per process): two users with the same availability
+# share entries, and any change to a user's slots changes the digest, so
+# stale pairs simply stop being looked up; nothing is invalidated
+# explicitly.
+#
+# The file is an append-only log of [key, overlaps] lines written directly
+# (not through file_cache, so it never enters a snapshots generation). Each
+# process parses it once and afterwards only reads lines appended since;
+# ``save`` appends just the entries computed by this instance. When the log
+# grows past twice the size bound it is rewritten with the live entries.
+# Replicas only read it.
+
+Overlap = Tuple[str, str, str, int]  # (DAY, start12h, end12h, minutes)
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# resolved path -> (inode, byte offset parsed up to, lines in the log, entries in LRU order)
+_LOADED: Dict[str, Tuple[int, int, int, "OrderedDict[str, List[Overlap]]"]] = {}
+
+
+def _cache_path() -> Path:
+    custom = os.environ.get("STUDYBUDDY_OVERLAP_CACHE_PATH")
+    if custom:
+        return Path(custom)
+    return storage._data_path().with_name("overlap_cache.ndjson")
+
+
+def _max_entries() -> int:
+    return int(os.environ.get("STUDYBUDDY_OVERLAP_CACHE_SIZE", DEFAULT_MAX_ENTRIES))
+
+
+class OverlapCache:
+    def __init__(self, path: Optional[Path] = None, max_entries: Optional[int] = None) -> None:
+        self.path = path or _cache_path()
+        self.max_entries = max_entries if max_entries is not None else _max_entries()
+        self._entries = self._load()
+        self._new: "OrderedDict[str, List[Overlap]]" = OrderedDict()
+
+    def _load(self) -> "OrderedDict[str, List[Overlap]]":
+        key = os.path.abspath(self.path)
+        ino, offset, lines, entries = _LOADED.get(key, (None, 0, 0, OrderedDict()))
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_ino != ino:  # new or compacted file: start over
+                    ino, offset, lines, entries = os.fstat(f.fileno()).st_ino, 0, 0, OrderedDict()
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        end = data.rfind(b"\n") + 1  # a trailing partial line is still being written
+        for line in data[:end].splitlines():
+            k, value = json.loads(line)
+            entries[k] = [tuple(o) for o in value]
+            entries.move_to_end(k)
+            lines += 1
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        _LOADED[key] = (ino, offset + end, lines, entries)
+        return entries
+
+    @staticmethod
+    def key(digest_a: str, digest_b: str) -> str:
+        return f"{digest_a}|{digest_b}"
+
+    def get(self, key: str) -> Optional[List[Overlap]]:
+        value = self._entries.get(key)
+        if value is None:
+            metrics.OVERLAP_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        metrics.OVERLAP_CACHE_LOOKUPS.inc(result="hit")
+        # Recency is kept in memory only, so cache hits never cause a write
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, overlaps: List[Overlap]) -> None:
+        self._entries[key] = overlaps
+        self._entries.move_to_end(key)
+        self._new[key] = overlaps
+        self._new.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._new.pop(evicted, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def save(self) -> None:
+        """Append this instance's new entries (nothing on replicas or when disabled)."""
+        new, self._new = self._new, OrderedDict()
+        if not new or self.max_entries <= 0 or replication.is_replica():
+            return
+        key = os.path.abspath(self.path)
+        with file_cache.locked(self.path):
+            # Catch up with other writers first so the saved offset stays at the end
+            entries = self._load()
+            for k, v in new.items():
+                entries[k] = v
+                entries.move_to_end(k)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._entries = entries
+            ino, offset, lines, _ = _LOADED[key]
+            if ino is None or lines + len(new) > 2 * self.max_entries:
+                self._compact(entries)
+                return
+            payload = "".join(json.dumps([k, v], separators=(",", ":")) + "\n" for k, v in new.items()).encode("utf-8")
+            with open(self.path, "ab") as f:
+                f.write(payload)
+            _LOADED[key] = (ino, offset + len(payload), lines + len(new), entries)
+
+    def _compact(self, entries: "OrderedDict[str, List[Overlap]]") -> None:
+        # Oldest first, so reloading preserves LRU order
+        payload = "".join(json.dumps([k, v], separators=(",", ":")) + "\n" for k, v in entries.items()).encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, self.path)
+        _LOADED[os.path.abspath(self.path)] = (os.stat(self.path).st_ino, len(payload), len(entries), entries)
@@ -1,27 +1,22 @@
 from __future__ import annotations
 
 import re
-from typing import List
+from typing import Dict, List
 
 from .models import UserProfile
-from . import storage
-
-
-class ProfileError(Exception):
-    """Base exception for profile issues."""
-
-
-class ValidationError(ProfileError):
-    pass
+from . import storage, user_search
+from .errors import ProfileError, ValidationError  # noqa: F401  (re-exported)
+from .metrics import track
+from .course_catalog import COURSE_PATTERN, normalize_course  # noqa: F401  (re-exported)
 
 
 EMAIL_PATTERN = re.compile(r"^[A-Za-z0-9_.+-]+@clemson\.edu$", re.IGNORECASE)
-COURSE_PATTERN = re.compile(r"^[A-Z]{3,4}\s?\d{4}$")  # e.g., CPSC3720 or CPSC 3720
 
 
 class ProfileService:
     """Service layer for user profile operations."""
 
+    @track("profile", "create_profile")
     def create_profile(self, name: str, email: str) -> UserProfile:
         name = name.strip()
         email = email.strip()
@@ -32,9 +27,20 @@ class ProfileService:
         if storage.get_by_email(email):
             raise ValidationError("A profile with that email already exists")
         profile = UserProfile(name=name, email=email, courses=[])
+        before = storage.data_version()
         storage.upsert(profile)
+        user_search.note_created(name, email, before)
         return profile
 
+    @track("profile", "find_users")
+    def find_users(self, query: str, limit: int = 10) -> List[Dict]:
+        """Users whose name or email matches ``query`` by prefix or with a typo or two.
+
+        Each entry: {name, email, match: exact|prefix|fuzzy, distance}
+        """
+        return user_search.current_index().search(query, limit=limit)
+
+    @track("profile", "add_course")
     def add_course(self, email: str, course_code: str) -> UserProfile:
         profile = storage.get_by_email(email)
         if not profile:
@@ -51,12 +57,4 @@ class ProfileService:
             raise ValidationError("Profile not found for email")
         return list(profile.courses)
 
-    @staticmethod
-    def _normalize_course(raw: str) -> str:
-        candidate = raw.strip().upper().replace(" ", "")
-        # Reinsert space between letters and digits for display: CPSC3720 -> CPSC 3720
-        if not COURSE_PATTERN.match(candidate):
-            raise ValidationError("Course code must look like CPSC 3720")
-        letters = ''.join(ch for ch in candidate if ch.isalpha())
-        digits = ''.join(ch for ch in candidate if ch.isdigit())
-        return f"{letters} {digits}"
+    _normalize_course = staticmethod(normalize_course)
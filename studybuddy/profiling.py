@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, TypeVar
+
+# Opt-in timing instrumentation for hot paths.
+#
+# Enabled by STUDYBUDDY_PROFILE=1 or the CLI's --profile flag. When disabled,
+# a @timed function costs one extra call and a global flag check; nothing is
+# recorded and no clock is read.
+
+F = TypeVar("F", bound=Callable)
+
+_enabled = os.environ.get("STUDYBUDDY_PROFILE", "") not in ("", "0")
+_tracing = False
+_origin = perf_counter()
+_timings: Dict[str, List[float]] = {}  # name -> [total_seconds, calls]
+_counters: Dict[str, int] = {}
+_events: List[dict] = []
+
+
+def enable(trace: bool = False) -> None:
+    global _enabled, _tracing
+    _enabled = True
+    _tracing = _tracing or trace
+
+
+def disable() -> None:
+    global _enabled, _tracing
+    _enabled = False
+    _tracing = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    _timings.clear()
+    _counters.clear()
+    _events.clear()
+
+
+def _record(name: str, t0: float) -> None:
+    t1 = perf_counter()
+    entry = _timings.get(name)
+    if entry is None:
+        _timings[name] = [t1 - t0, 1]
+    else:
+        entry[0] += t1 - t0
+        entry[1] += 1
+    if _tracing:
+        _events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (t0 - _origin) * 1e6,
+            "dur": (t1 - t0) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        })
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator recording wall time and call count under ``name``."""
+    def deco(fn: F) -> F:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, t0)
+        return wrapper  # type: ignore[return-value]
+    return deco
+
+
+def add(counter: str, amount: int = 1) -> None:
+    """Bump a counter such as bytes read/written (no-op when disabled)."""
+    if _enabled:
+        _counters[counter] = _counters.get(counter, 0) + amount
+
+
+def timings() -> Dict[str, tuple]:
+    return {k: (v[0], int(v[1])) for k, v in _timings.items()}
+
+
+def counters() -> Dict[str, int]:
+    return dict(_counters)
+
+
+def report(label: str = "", out: Optional[TextIO] = None) -> None:
+    """Print a per-command summary of recorded timings and counters."""
+    out = out or sys.stderr
+    print(f"--- profile{f' ({label})' if label else ''} ---", file=out)
+    for name, (total, calls) in sorted(_timings.items(), key=lambda kv: -kv[1][0]):
+        print(f"{name:<32} {int(calls):>8} calls {total * 1000:>10.3f} ms", file=out)
+    for name, value in sorted(_counters.items()):
+        print(f"{name:<32} {value:>8}", file=out)
+
+
+def write_trace(path: str) -> None:
+    """Write recorded spans as Chrome trace JSON (chrome://tracing, Perfetto)."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def session(label: str, pstats_path: Optional[str] = None, trace_path: Optional[str] = None) -> Iterator[None]:
+    """Profile one CLI command: summary on exit, optional pstats/trace dumps."""
+    if not (_enabled or pstats_path or trace_path):
+        yield
+        return
+    enable(trace=bool(trace_path))
+    profiler = None
+    if pstats_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        _record(f"command.{label}", t0)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(pstats_path)
+        if trace_path:
+            write_trace(trace_path)
+        report(label)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import file_cache
+from .errors import ValidationError
+
+# Log-shipping replication.
+#
+# A primary (STUDYBUDDY_REPLICATION_LOG=<dir>) appends one JSON line per
+# logical mutation to <dir>/mutations.ndjson before the storage layer writes
+# the data, while holding that file's write lock, so the log order is the
+# commit order and a crash can only leave an entry whose write is redone by
+# replicas. A replica (STUDYBUDDY_REPLICA_OF=<dir>) applies the lines after
+# its saved byte offset to its own data files and refuses direct writes.
+# Entries are whole-record upserts or replaces, so re-applying one after a
+# crash is harmless.
+#
+# ``compact`` replaces the log with a checkpoint of the current data whose
+# first line carries a new epoch; a replica that sees an epoch other than
+# the one it recorded starts over from the checkpoint.
+
+LOG_NAME = "mutations.ndjson"
+START_OP = "log.start"
+
+_applying = False
+# (inode, size) of the source log when this process last found itself caught up
+_caught_up: Optional[Tuple[int, int]] = None
+# ((device, inode), size seen, epoch) of the last log whose first line was read
+_epoch_cache: Optional[Tuple[Tuple[int, int], int, int]] = None
+
+
+def log_dir() -> Optional[Path]:
+    custom = os.environ.get("STUDYBUDDY_REPLICATION_LOG")
+    return Path(custom) if custom else None
+
+
+def source_dir() -> Optional[Path]:
+    custom = os.environ.get("STUDYBUDDY_REPLICA_OF")
+    return Path(custom) if custom else None
+
+
+def is_replica() -> bool:
+    return source_dir() is not None
+
+
+def check_writable() -> None:
+    if is_replica() and not _applying:
+        raise ValidationError("This node is a read-only replica; send writes to the primary")
+
+
+def record(op: str, **payload) -> None:
+    """Append a mutation to the primary's log (no-op when logging is off)."""
+    directory = log_dir()
+    if directory is None or _applying:
+        return
+    entry = {"ts": time.time(), "op": op, **payload}
+    file_cache.append_lines(directory / LOG_NAME, [json.dumps(entry, separators=(",", ":"))])
+
+
+def _epoch_of(f, st: os.stat_result) -> int:
+    """Epoch from the first line of the open log ``f`` (0 if never compacted).
+
+    ``st`` is ``os.fstat`` of the same handle, so the epoch and whatever the
+    caller reads next come from one file even if ``compact`` replaces it.
+    """
+    global _epoch_cache
+    ident = (st.st_dev, st.st_ino)
+    # Compaction lands as a new inode; between compactions the log only grows
+    if _epoch_cache is not None and _epoch_cache[0] == ident and st.st_size >= _epoch_cache[1]:
+        _epoch_cache = (ident, st.st_size, _epoch_cache[2])
+        return _epoch_cache[2]
+    f.seek(0)
+    first = f.readline()
+    if not first.endswith(b"\n"):
+        return 0
+    entry = json.loads(first)
+    epoch = entry["epoch"] if entry.get("op") == START_OP else 0
+    _epoch_cache = (ident, st.st_size, epoch)
+    return epoch
+
+
+def _log_epoch(path: Path) -> int:
+    try:
+        with path.open("rb") as f:
+            return _epoch_of(f, os.fstat(f.fileno()))
+    except FileNotFoundError:
+        return 0
+
+
+def compact() -> int:
+    """Replace the primary's log with a checkpoint of the current data.
+
+    Holds the users and sessions write locks, so no mutation is logged in
+    between. Returns the size of the new log in bytes.
+    """
+    from . import session_storage, storage
+    directory = log_dir()
+    if directory is None:
+        raise ValidationError("STUDYBUDDY_REPLICATION_LOG is not set")
+    path = directory / LOG_NAME
+    with storage.write_lock(), session_storage.write_lock():
+        now = time.time()
+        entries = [
+            {"ts": now, "op": START_OP, "epoch": _log_epoch(path) + 1},
+            {"ts": now, "op": "users.replace", "users": [u.to_dict() for u in storage.load_all()]},
+            {"ts": now, "op": "sessions.replace", "sessions": [s.to_dict() for s in session_storage.load_all()]},
+        ]
+        payload = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries).encode("utf-8")
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    return len(payload)
+
+
+def _state_path() -> Path:
+    from . import storage
+    return storage._data_path().with_name("replica_state.json")
+
+
+def _load_state() -> Dict:
+    state = file_cache.read_json(_state_path())
+    state = dict(state) if state is not None else {"offset": 0, "applied": 0, "last_ts": None}
+    state.setdefault("epoch", 0)
+    return state
+
+
+def _source_log() -> Path:
+    directory = source_dir()
+    if directory is None:
+        raise ValidationError("STUDYBUDDY_REPLICA_OF is not set")
+    return directory / LOG_NAME
+
+
+def _start_offset(state: Dict, epoch: int) -> int:
+    """Offset to read from: the saved one, or 0 after a compaction."""
+    return state["offset"] if epoch == state["epoch"] else 0
+
+
+def _read_pending(state: Dict, max_entries: Optional[int] = None) -> Tuple[int, List[Dict], int]:
+    """Complete log lines after the saved offset; returns (epoch, entries, offset past them)."""
+    try:
+        with _source_log().open("rb") as f:
+            epoch = _epoch_of(f, os.fstat(f.fileno()))
+            offset = _start_offset(state, epoch)
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return state["epoch"], [], state["offset"]
+    # A trailing line without a newline is still being written
+    end = data.rfind(b"\n") + 1
+    entries = []
+    for line in data[:end].splitlines(keepends=True):
+        if max_entries is not None and len(entries) >= max_entries:
+            break
+        entries.append(json.loads(line))
+        offset += len(line)
+    return epoch, entries, offset
+
+
+def _apply(entry: Dict) -> None:
+    from . import session_storage, storage
+    from .models import UserProfile
+    from .session_models import StudySession
+    op = entry["op"]
+    if op == START_OP:
+        pass
+    elif op == "user.upsert":
+        storage.upsert(UserProfile.from_dict(entry["user"]))
+    elif op == "users.replace":
+        storage.save_all([UserProfile.from_dict(d) for d in entry["users"]])
+    elif op == "session.upsert":
+        session_storage.upsert(StudySession.from_dict(entry["session"]), stamp=False)
+    elif op == "sessions.replace":
+        session_storage.save_all([StudySession.from_dict(d) for d in entry["sessions"]])
+    else:
+        raise ValidationError(f"Unknown replication op: {op}")
+
+
+def apply_pending(max_entries: Optional[int] = None) -> int:
+    """Apply unapplied log entries to the local store; returns how many were applied.
+
+    The batch is buffered so each data file is rewritten once, together
+    with the replica's saved offset.
+    """
+    global _applying
+    state = _load_state()
+    epoch, entries, offset = _read_pending(state, max_entries)
+    if not entries:
+        return 0
+    # Inside run-batch the caller's buffer already holds (and flushes) the writes
+    own_buffer = not file_cache.is_buffering()
+    with file_cache.buffered() if own_buffer else nullcontext():
+        _applying = True
+        try:
+            for entry in entries:
+                _apply(entry)
+        finally:
+            _applying = False
+        state.update(offset=offset, epoch=epoch, applied=state["applied"] + len(entries), last_ts=entries[-1]["ts"])
+        file_cache.write_json(_state_path(), state)
+        if own_buffer:
+            file_cache.flush()
+    return len(entries)
+
+
+def _pending_tail(head_only: bool) -> Tuple[int, bytes]:
+    """Bytes of complete unapplied lines (just the first line if ``head_only``).
+
+    The epoch, inode, size and tail all come from one open handle. The size
+    is compared with the applied offset first, so a caught-up replica reads
+    nothing but the file's inode and size.
+    """
+    global _caught_up
+    try:
+        f = _source_log().open("rb")
+    except FileNotFoundError:
+        return 0, b""
+    with f:
+        st = os.fstat(f.fileno())
+        sig = (st.st_ino, st.st_size)
+        if sig == _caught_up:
+            return 0, b""
+        offset = _start_offset(_load_state(), _epoch_of(f, st))
+        if offset >= st.st_size:
+            _caught_up = sig
+            return 0, b""
+        f.seek(offset)
+        data = f.readline() if head_only else f.read()
+    end = data.rfind(b"\n") + 1  # a trailing line without a newline is still being written
+    return data[:end].count(b"\n"), data[:end]
+
+
+def _oldest_pending_age(now: float) -> float:
+    count, head = _pending_tail(head_only=True)
+    return max(0.0, now - json.loads(head)["ts"]) if count else 0.0
+
+
+def lag(now: Optional[float] = None) -> Dict:
+    """Replication lag: unapplied entries and the age of the oldest one in seconds."""
+    now = time.time() if now is None else now
+    count, tail = _pending_tail(head_only=False)
+    return {
+        "applied": _load_state()["applied"],
+        "pending": count,
+        "seconds": max(0.0, now - json.loads(tail[:tail.index(b"\n")])["ts"]) if count else 0.0,
+    }
+
+
+def ensure_fresh(max_staleness: Optional[float]) -> None:
+    """On a replica, catch up if the oldest unapplied write is older than the bound.
+
+    Costs one open and fstat of the log when nothing is pending, so nested service
+    calls can check freely.
+    """
+    if max_staleness is None or not is_replica():
+        return
+    if _oldest_pending_age(time.time()) > max_staleness:
+        apply_pending()
+        if _oldest_pending_age(time.time()) > max_staleness:
+            raise ValidationError("Replica is too far behind the primary")
@@ -1,86 +1,251 @@
 from __future__ import annotations
 
-from typing import List, Dict, Tuple
+import heapq
+import os
+from time import perf_counter
+from typing import Iterator, List, Dict, Tuple
 
 from . import storage
 from .models import UserProfile
 from .profile_service import ValidationError
-from .availability_service import AvailabilityService
+from .availability_service import AvailabilityService, _date_range, _time_str, availability_digest, day_intervals, intersect, iter_days
+from .profiling import timed
+from . import metrics
+from .metrics import track
+from .overlap_cache import OverlapCache
+from . import course_catalog, replication, snapshots
+from .course_catalog import normalize_course
+
+
+def _default_max_staleness() -> float | None:
+    raw = os.environ.get("STUDYBUDDY_MAX_STALENESS")
+    return float(raw) if raw else None
 
 
 class SearchService:
     """Search and retrieval operations for classmates and their availability."""
 
-    def __init__(self) -> None:
+    def __init__(self, max_staleness: float | None = None) -> None:
         self._availability = AvailabilityService()
+        # On a replica, queries first catch up if the oldest unapplied write
+        # is older than this many seconds (None: serve whatever is applied)
+        self._max_staleness = _default_max_staleness() if max_staleness is None else max_staleness
 
+    @track("search", "classmates_in_course")
+    @snapshots.isolated
     def classmates_in_course(self, requester_email: str, course_code: str) -> List[UserProfile]:
+        replication.ensure_fresh(self._max_staleness)
         requestor = storage.get_by_email(requester_email)
         if not requestor:
             raise ValidationError("Requester profile not found")
-        norm_course = self._normalize_course(course_code)
-        users = storage.load_all()
-        results = []
-        for u in users:
-            if u.email.lower() == requester_email.lower():
-                continue
-            if norm_course in u.courses:
-                results.append(u)
-        return results
+        cid = course_catalog.course_id(course_code)
+        index = course_catalog.current_index()
+        me = requester_email.lower()
+        # Only the course's members are materialized as UserProfile objects
+        return [
+            UserProfile.from_dict(index.raw_users[pos])
+            for pos in index.member_positions(cid)
+            if index.raw_users[pos]["email"].lower() != me
+        ]
 
+    @track("search", "classmates_with_availability")
     def classmates_with_availability(self, requester_email: str, course_code: str) -> List[Dict]:
+        return list(self.iter_classmates_with_availability(requester_email, course_code))
+
+    @snapshots.isolated
+    def iter_classmates_with_availability(self, requester_email: str, course_code: str) -> Iterator[Dict]:
+        """Generator form of classmates_with_availability (one entry per classmate)."""
+        t0 = perf_counter()
         classmates = self.classmates_in_course(requester_email, course_code)
-        enriched: List[Dict] = []
         for c in classmates:
-            overview = self._availability.weekly_overview(c.email)
-            enriched.append({
+            yield {
                 "name": c.name,
                 "email": c.email,
                 "courses": list(c.courses),
-                "availability": overview,
-            })
-        return enriched
+                "availability": self._availability._overview(c.availability),
+            }
+        self._observe_search("with_availability", len(classmates), t0)
 
-    def overlap_with_classmates(self, requester_email: str, course_code: str) -> List[Dict]:
+    @track("search", "overlap_with_classmates")
+    def overlap_with_classmates(self, requester_email: str, course_code: str,
+                                start_date: str | None = None, end_date: str | None = None) -> List[Dict]:
         """Return overlap windows between requester and each classmate for the course.
 
         Each entry: {
           name, email, overlaps: {DAY: [(start12h, end12h, minutes)]}, total_minutes
         }
         Only days with at least one overlap are included in overlaps dict.
+        With start_date/end_date (YYYY-MM-DD), overlaps are computed per
+        calendar date, including dated overrides, and keyed by ISO date.
         """
+        results = list(self.iter_overlaps(requester_email, course_code, start_date, end_date))
+        # Sort by total overlap descending
+        results.sort(key=lambda x: x["total_minutes"], reverse=True)
+        return results
+
+    @snapshots.isolated
+    def iter_overlaps(self, requester_email: str, course_code: str,
+                      start_date: str | None = None, end_date: str | None = None) -> Iterator[Dict]:
+        """Yield overlap_with_classmates entries as they are computed (unsorted)."""
+        replication.ensure_fresh(self._max_staleness)
+        if (start_date is None) != (end_date is None):
+            raise ValidationError("Both start and end dates are required")
+        dates = _date_range(start_date, end_date) if start_date is not None else None
         requester = storage.get_by_email(requester_email)
         if not requester:
             raise ValidationError("Requester profile not found")
+        t0 = perf_counter()
+        if dates is not None:
+            classmates = self.classmates_in_course(requester_email, course_code)
+            for mate in classmates:
+                yield self._dated_overlaps(requester, mate, *dates)
+            self._observe_search("overlap", len(classmates), t0)
+            return
         requester_slots = requester.availability  # already merged when stored
         classmates = self.classmates_in_course(requester_email, course_code)
-        results: List[Dict] = []
-        for mate in classmates:
-            mate_slots = mate.availability
-            overlaps = self._compute_overlaps(requester_slots, mate_slots)
-            if overlaps:
-                total = sum(dur for _, _, _, dur in overlaps)
+        cache = OverlapCache()
+        mine = availability_digest(requester_slots)
+        try:
+            for mate in classmates:
+                key = cache.key(mine, availability_digest(mate.availability))
+                overlaps = cache.get(key)
+                if overlaps is None:
+                    overlaps = self._compute_overlaps(requester_slots, mate.availability)
+                    cache.put(key, overlaps)
                 # group by day for formatting
                 day_map: Dict[str, List[Tuple[str, str, int]]] = {}
                 for day, s12, e12, dur in overlaps:
                     day_map.setdefault(day, []).append((s12, e12, dur))
-                results.append({
+                yield {
                     "name": mate.name,
                     "email": mate.email,
-                    "total_minutes": total,
+                    "total_minutes": sum(dur for _, _, _, dur in overlaps),
                     "overlaps": day_map,
-                })
-            else:
-                results.append({
-                    "name": mate.name,
-                    "email": mate.email,
-                    "total_minutes": 0,
-                    "overlaps": {},
-                })
-        # Sort by total overlap descending
-        results.sort(key=lambda x: x["total_minutes"], reverse=True)
+                }
+        finally:
+            # Keep whatever was computed even if the consumer stops early
+            cache.save()
+        self._observe_search("overlap", len(classmates), t0)
+
+    @staticmethod
+    def _observe_search(op: str, course_size: int, t0: float) -> None:
+        metrics.SEARCH_COURSE_SIZE.observe(course_size, op=op)
+        metrics.SEARCH_SECONDS.observe(perf_counter() - t0, op=op, course_size=metrics.size_bucket(course_size))
+
+    @track("search", "recommend_buddies")
+    @snapshots.isolated
+    def recommend_buddies(self, requester_email: str, k: int = 10, course_weight: int = 60) -> List[Dict]:
+        """Rank other users by shared courses plus shared weekly free time.
+
+        score = shared_courses * course_weight + overlap_minutes, so by
+        default one shared course is worth an hour of common availability.
+        Candidates come from the requester's course rosters (CourseIndex), so
+        users with no course in common are never scored, and a k-sized heap
+        keeps only the best results.
+
+        Each entry: {name, email, shared_courses: [code], overlap_minutes, score}
+        """
+        from .compatibility_service import week_intervals, overlap_minutes
+        if k < 1:
+            raise ValidationError("k must be at least 1")
+        replication.ensure_fresh(self._max_staleness)
+        index = course_catalog.current_index()
+        me = requester_email.lower()
+        if me not in index.by_email:
+            raise ValidationError("Requester profile not found")
+        requester = UserProfile.from_dict(index.raw_users[index.by_email[me]])
+        my_courses = course_catalog.enrollment_ids(requester.courses)
+        my_week = week_intervals(requester.availability)
+
+        candidates = set()
+        for cid in my_courses:
+            candidates.update(index.member_positions(cid))
+        candidates.discard(index.by_email[me])
+
+        def scored():
+            for pos in sorted(candidates):
+                mate = UserProfile.from_dict(index.raw_users[pos])
+                shared = my_courses & course_catalog.enrollment_ids(mate.courses)
+                minutes = overlap_minutes(my_week, week_intervals(mate.availability))
+                yield (len(shared) * course_weight + minutes, minutes, mate.email, mate.name, shared)
+
+        # Best score first, then most overlap, then email: ties never depend on
+        # heap order, and the result comes back sorted
+        top = heapq.nsmallest(k, scored(), key=lambda t: (-t[0], -t[1], t[2].lower()))
+        results: List[Dict] = []
+        for score, minutes, email, name, shared in top:
+            results.append({
+                "name": name,
+                "email": email,
+                "shared_courses": sorted(course_catalog.code_for(c) for c in shared),
+                "overlap_minutes": minutes,
+                "score": score,
+            })
         return results
 
+    @track("search", "who_is_free")
+    @snapshots.isolated
+    def who_is_free(self, day: str, start: str, end: str, course_code: str | None = None,
+                    requester_email: str | None = None, partial: bool = False) -> List[Dict]:
+        """Return users free on ``day`` between ``start`` and ``end``.
+
+        By default only users whose availability covers the whole window are
+        returned; ``partial=True`` also includes anyone free for part of it.
+        Backed by a per-day interval tree over every user's availability, so
+        no profile is re-parsed per query. Optionally restricted to members
+        of ``course_code`` and excluding ``requester_email``.
+
+        Each entry: {name, email, free_start (12h), free_end (12h)}; a user
+        with several matching slots appears once, with the earliest of them.
+        """
+        from .availability_service import _norm_day, _parse_time, _time_str, AvailabilityService as AS
+        from .availability_index import current_index
+        day_norm = _norm_day(day)
+        start_min = _parse_time(start)
+        end_min = _parse_time(end)
+        if end_min <= start_min:
+            raise ValidationError("End time must be after start time")
+        replication.ensure_fresh(self._max_staleness)
+        index = current_index()
+        members = None
+        if course_code:
+            cid = course_catalog.course_id(course_code)
+            members = {email.lower() for email in course_catalog.current_index().members(cid)}
+        skip = requester_email.lower() if requester_email else None
+        hits = index.free_during(day_norm, start_min, end_min) if partial else index.free_for(day_norm, start_min, end_min)
+        first: Dict[str, Tuple[int, int]] = {}
+        for s, e, email in hits:
+            if email == skip or (members is not None and email not in members):
+                continue
+            if email not in first or s < first[email][0]:
+                first[email] = (s, e)
+        results = [
+            {
+                "name": index.names[email],
+                "email": email,
+                "free_start": AS._to_12h(_time_str(s)),
+                "free_end": AS._to_12h(_time_str(e)),
+            }
+            for email, (s, e) in first.items()
+        ]
+        results.sort(key=lambda r: (r["name"].lower(), r["email"]))
+        return results
+
+    @staticmethod
+    def _dated_overlaps(requester: UserProfile, mate: UserProfile, first, last) -> Dict:
+        # Per-date intervals are memoized by (availability digest, date) in
+        # availability_service, so only the dates asked for are expanded;
+        # the weekly OverlapCache does not apply here.
+        conv = AvailabilityService._to_12h
+        by_date: Dict[str, List[Tuple[str, str, int]]] = {}
+        total = 0
+        for d in iter_days(first, last):
+            for s, e in intersect(day_intervals(requester, d), day_intervals(mate, d)):
+                by_date.setdefault(d.isoformat(), []).append((conv(_time_str(s)), conv(_time_str(e)), e - s))
+                total += e - s
+        return {"name": mate.name, "email": mate.email, "total_minutes": total, "overlaps": by_date}
+
+    @timed("search._compute_overlaps")
     def _compute_overlaps(self, slots_a, slots_b) -> List[Tuple[str, str, str, int]]:
         """Compute overlaps between two availability slot lists.
 
@@ -107,11 +272,4 @@ class SearchService:
                         overlaps.append((day, conv(f"{start//60:02d}:{start%60:02d}"), conv(f"{end//60:02d}:{end%60:02d}"), end - start))
         return overlaps
 
-    @staticmethod
-    def _normalize_course(raw: str) -> str:
-        r = raw.strip().upper().replace(" ", "")
-        letters = ''.join(ch for ch in r if ch.isalpha())
-        digits = ''.join(ch for ch in r if ch.isdigit())
-        if not letters or not digits:
-            raise ValidationError("Invalid course code")
-        return f"{letters} {digits}"
+    _normalize_course = staticmethod(normalize_course)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import gc
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List
+
+from .errors import ValidationError
+
+# On-disk format of the data files.
+#
+# Every document carries a ``schema_version``. Files are written compactly
+# (no indentation) unless STUDYBUDDY_PRETTY_JSON is set, and availability
+# slots are stored as [day, start, end] rows instead of objects; readers
+# accept both slot forms. Older files are upgraded in memory on read by the
+# forward migrations below and rewritten in the current format on the next
+# save. orjson is used for encoding and decoding when installed.
+#
+#   1: original layout (no schema_version, slots as {"day", "start", "end"})
+#   2: schema_version key, slots as [day, start, end]; optional dated
+#      overrides as [date, kind, start, end] (absent means none)
+
+SCHEMA_VERSION = 2
+
+# Documents at least this large are decoded with the cyclic GC paused
+# (serialization_bench: 84 vs 236 ms at 20k users; no difference for small
+# documents such as counters and the expiry index).
+GC_PAUSE_MIN_BYTES = 256 * 1024
+
+
+# orjson module, None when not installed; imported on first encode/decode
+# so commands that never touch a data file do not pay for it at startup.
+_UNSET: Any = object()
+_orjson: Any = _UNSET
+
+
+def _accel() -> Any:
+    global _orjson
+    if _orjson is _UNSET:
+        try:
+            import orjson
+        except ImportError:  # stdlib json fallback
+            orjson = None
+        _orjson = orjson
+    return _orjson
+
+
+def pack_slots(slots: Iterable[Dict[str, str]]) -> List[List[str]]:
+    return [[s["day"], s["start"], s["end"]] for s in slots]
+
+
+def pack_user(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A ``UserProfile.to_dict()`` record in the current on-disk form."""
+    record["availability"] = pack_slots(record.get("availability", ()))
+    if record.get("overrides"):
+        record["overrides"] = [[o["date"], o["kind"], o["start"], o["end"]] for o in record["overrides"]]
+    else:
+        record.pop("overrides", None)  # most users have none
+    return record
+
+
+def _v1_to_v2(doc: Dict[str, Any]) -> Dict[str, Any]:
+    for user in doc.get("users", ()):
+        slots = user.get("availability", ())
+        if slots and isinstance(slots[0], dict):
+            user["availability"] = pack_slots(slots)
+    return doc
+
+
+# version -> function upgrading a document from that version to the next
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _v1_to_v2,
+}
+
+
+def migrate(doc: Any) -> Any:
+    if not isinstance(doc, dict):
+        return doc
+    version = doc.get("schema_version", 1)
+    if version > SCHEMA_VERSION:
+        raise ValidationError(
+            f"Data file uses schema {version}, newer than this version of StudyBuddy supports ({SCHEMA_VERSION})"
+        )
+    while version < SCHEMA_VERSION:
+        doc = MIGRATIONS[version](doc)
+        version += 1
+    doc["schema_version"] = SCHEMA_VERSION
+    return doc
+
+
+def _pretty() -> bool:
+    return os.environ.get("STUDYBUDDY_PRETTY_JSON", "") not in ("", "0")
+
+
+def dumps(doc: Any) -> bytes:
+    """Encode a data document, stamping the current schema version."""
+    if isinstance(doc, dict) and "schema_version" not in doc:
+        doc = {"schema_version": SCHEMA_VERSION, **doc}
+    accel = _accel()
+    if accel is not None:
+        return accel.dumps(doc, option=accel.OPT_INDENT_2 if _pretty() else 0)
+    if _pretty():
+        return json.dumps(doc, indent=2).encode("utf-8")
+    return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    """Decode a data document and upgrade it to the current schema."""
+    accel = _accel()
+    decode = accel.loads if accel is not None else json.loads
+    if len(data) < GC_PAUSE_MIN_BYTES:
+        return migrate(decode(data))
+    # Decoding allocates one container per record and slot, which otherwise
+    # triggers repeated cyclic-GC passes; parsed JSON cannot contain cycles.
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        doc = decode(data)
+    finally:
+        if was_enabled:
+            gc.enable()
+    return migrate(doc)
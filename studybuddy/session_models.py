@@ -3,7 +3,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Literal, Dict, Any
 
-Status = Literal["pending", "accepted", "declined"]
+Status = Literal["pending", "accepted", "declined", "expired"]
 
 
 @dataclass
@@ -17,6 +17,10 @@ class StudySession:
     end: str    # HH:MM 24h
     status: Status = "pending"
     message: str | None = None
+    seq: int = 0  # change-feed sequence number of the last mutation
+    created_at: float | None = None  # epoch seconds
+    expires_at: float | None = None  # pending requests past this become "expired"
+    date: str | None = None  # YYYY-MM-DD for a one-off session; None repeats weekly on ``day``
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -29,6 +33,10 @@ class StudySession:
             "end": self.end,
             "status": self.status,
             "message": self.message,
+            "seq": self.seq,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "date": self.date,
         }
 
     @staticmethod
@@ -43,4 +51,8 @@ class StudySession:
             end=d["end"],
             status=d.get("status", "pending"),
             message=d.get("message"),
+            seq=d.get("seq", 0),
+            created_at=d.get("created_at"),
+            expires_at=d.get("expires_at"),
+            date=d.get("date"),
         )
@@ -1,21 +1,42 @@
 from __future__ import annotations
 
-from typing import List, Dict
+import os
+import time
+from typing import Iterator, List, Dict, Tuple
 
 from . import storage
 from .session_models import StudySession
-from . import session_storage
+from . import replication, session_storage
 from .profile_service import ValidationError
-from .availability_service import _parse_time, AvailabilityService, DAY_ORDER, _norm_day
+from .availability_service import _parse_time, _parse_date, AvailabilityService, DAY_ORDER, _norm_day, day_intervals
+from .profiling import timed
+from . import metrics
+from .metrics import track
+from .course_catalog import intern, is_enrolled, normalize_course
+from .session_table import current_table
+
+
+def _default_ttl() -> float | None:
+    # Seconds a pending request stays open; unset means requests never expire
+    raw = os.environ.get("STUDYBUDDY_REQUEST_TTL")
+    return float(raw) if raw else None
+
+
+def _default_columnar() -> bool:
+    return os.environ.get("STUDYBUDDY_COLUMNAR_SESSIONS", "") not in ("", "0")
 
 
 class SessionService:
     """Service handling proposal and confirmation of study sessions."""
 
-    def __init__(self) -> None:
+    def __init__(self, columnar: bool | None = None) -> None:
         self._availability = AvailabilityService()
+        # Columnar mode answers the listing queries from session_table
+        self._columnar = _default_columnar() if columnar is None else columnar
 
-    def propose(self, requester: str, invitee: str, course: str, day: str, start: str, end: str, message: str | None = None) -> StudySession:
+    @track("session", "propose")
+    def propose(self, requester: str, invitee: str, course: str, day: str | None, start: str, end: str,
+                message: str | None = None, ttl: float | None = None, date: str | None = None) -> StudySession:
         if requester.lower() == invitee.lower():
             raise ValidationError("Cannot invite yourself")
         req_profile = storage.get_by_email(requester)
@@ -23,22 +44,34 @@ class SessionService:
         if not req_profile or not inv_profile:
             raise ValidationError("Both requester and invitee must exist")
         norm_course = self._normalize_course(course)
-        if norm_course not in req_profile.courses or norm_course not in inv_profile.courses:
+        cid = intern(norm_course)
+        if not is_enrolled(req_profile.courses, cid) or not is_enrolled(inv_profile.courses, cid):
             raise ValidationError("Both users must be enrolled in the course")
-        day_norm = _norm_day(day)
+        # A dated (one-off) session is checked against that date's overrides
+        on = _parse_date(date) if date else None
+        if on is not None:
+            day_norm = DAY_ORDER[on.weekday()]
+            if day and _norm_day(day) != day_norm:
+                raise ValidationError(f"{on.isoformat()} is a {day_norm}, not {_norm_day(day)}")
+        elif day:
+            day_norm = _norm_day(day)
+        else:
+            raise ValidationError("Day or date is required")
         start_min = _parse_time(start)
         end_min = _parse_time(end)
         if end_min <= start_min:
             raise ValidationError("End must be after start")
         # Validate window inside each user's availability
-        if not self._window_allowed(req_profile.email, day_norm, start_min, end_min):
+        if not self._window_allowed(req_profile.email, day_norm, start_min, end_min, on):
             raise ValidationError("Requester not available for entire window")
-        if not self._window_allowed(inv_profile.email, day_norm, start_min, end_min):
+        if not self._window_allowed(inv_profile.email, day_norm, start_min, end_min, on):
             raise ValidationError("Invitee not available for entire window")
-        sessions = session_storage.load_all()
-        sid = session_storage.next_id(sessions)
+        ttl = ttl if ttl is not None else _default_ttl()
+        if ttl is not None and ttl <= 0:
+            raise ValidationError("TTL must be positive")
+        now = time.time()
         session = StudySession(
-            id=sid,
+            id=0,  # assigned by upsert under the write lock
             requester=req_profile.email,
             invitee=inv_profile.email,
             course=norm_course,
@@ -47,23 +80,93 @@ class SessionService:
             end=f"{end_min//60:02d}:{end_min%60:02d}",
             status="pending",
             message=message,
+            created_at=now,
+            expires_at=None if ttl is None else now + ttl,
+            date=None if on is None else on.isoformat(),
         )
         session_storage.upsert(session)
         return session
 
+    def sweep_expired(self, now: float | None = None) -> List[StudySession]:
+        """Expire pending requests whose TTL has passed; returns the expired sessions."""
+        if replication.is_replica():
+            return []  # the primary sweeps and ships the expiries
+        now = time.time() if now is None else now
+        if self._columnar:
+            # Decide from the table's columns; only due rows' shards are read
+            table = current_table()
+            due = table.due(now)
+            if not due:
+                return []
+            expired = session_storage.expire_sessions(
+                [(table.ids[r], table.emails[table.invitee[r]]) for r in due], now)
+        else:
+            expired = session_storage.expire_due(now)
+        if expired:
+            metrics.SESSIONS_EXPIRED.inc(len(expired))
+        return expired
+
     def incoming_requests(self, email: str) -> List[StudySession]:
-        return [s for s in session_storage.load_all() if s.invitee.lower() == email.lower() and s.status == "pending"]
+        return list(self.iter_incoming_requests(email))
 
     def outgoing_requests(self, email: str) -> List[StudySession]:
-        return [s for s in session_storage.load_all() if s.requester.lower() == email.lower() and s.status == "pending"]
+        return list(self.iter_outgoing_requests(email))
 
     def confirmed_sessions(self, email: str) -> List[StudySession]:
-        return [s for s in session_storage.load_all() if s.status == "accepted" and (s.requester.lower() == email.lower() or s.invitee.lower() == email.lower())]
+        return list(self.iter_confirmed_sessions(email))
+
+    # Generator forms: StudySession objects are built only for matching rows
+    # and handed out one at a time, so callers can stream them.
+
+    def iter_incoming_requests(self, email: str) -> Iterator[StudySession]:
+        self.sweep_expired()
+        if self._columnar:
+            table = current_table()
+            return map(table.materialize, table.incoming(email))
+        me = email.lower()
+        return self._iter_rows(lambda d: d["invitee"].lower() == me and d.get("status", "pending") == "pending")
 
+    def iter_outgoing_requests(self, email: str) -> Iterator[StudySession]:
+        self.sweep_expired()
+        if self._columnar:
+            table = current_table()
+            return map(table.materialize, table.outgoing(email))
+        me = email.lower()
+        return self._iter_rows(lambda d: d["requester"].lower() == me and d.get("status", "pending") == "pending")
+
+    def iter_confirmed_sessions(self, email: str) -> Iterator[StudySession]:
+        if self._columnar:
+            table = current_table()
+            return map(table.materialize, table.confirmed(email))
+        me = email.lower()
+        return self._iter_rows(lambda d: d.get("status") == "accepted" and (d["requester"].lower() == me or d["invitee"].lower() == me))
+
+    @staticmethod
+    def _iter_rows(match) -> Iterator[StudySession]:
+        for d in session_storage.load_raw():
+            if match(d):
+                yield StudySession.from_dict(d)
+
+    def changes_since(self, cursor: int, email: str) -> Tuple[int, List[StudySession]]:
+        """Sessions involving ``email`` that changed after ``cursor``.
+
+        Returns (new_cursor, changes); pass new_cursor back on the next poll
+        to receive only later proposals and responses.
+        """
+        changes = session_storage.changes_since(cursor)
+        new_cursor = max([cursor] + [s.seq for s in changes])
+        me = email.lower()
+        mine = [s for s in changes if s.requester.lower() == me or s.invitee.lower() == me]
+        return new_cursor, mine
+
+    @track("session", "respond")
     def respond(self, session_id: int, responder_email: str, action: str) -> StudySession:
         session = session_storage.get(session_id)
         if not session:
             raise ValidationError("Session not found")
+        if session.status == "pending" and session.expires_at is not None and session.expires_at <= time.time():
+            self.sweep_expired()
+            raise ValidationError("Session request expired")
         if session.status != "pending":
             raise ValidationError("Session already finalized")
         if responder_email.lower() != session.invitee.lower():
@@ -73,13 +176,17 @@ class SessionService:
             raise ValidationError("Action must be accept or decline")
         session.status = "accepted" if act == "accept" else "declined"
         session_storage.upsert(session)
+        metrics.SESSION_RESPONSES.inc(action=act)
         return session
 
-    def _window_allowed(self, email: str, day: str, start: int, end: int) -> bool:
+    @timed("session._window_allowed")
+    def _window_allowed(self, email: str, day: str, start: int, end: int, on=None) -> bool:
         # A window is allowed if completely contained in any one availability slot
         profile = storage.get_by_email(email)
         if not profile:
             return False
+        if on is not None:
+            return any(start >= s and end <= e for s, e in day_intervals(profile, on))
         for slot in profile.availability:
             if slot.day != day:
                 continue
@@ -89,11 +196,4 @@ class SessionService:
                 return True
         return False
 
-    @staticmethod
-    def _normalize_course(raw: str) -> str:
-        r = raw.strip().upper().replace(" ", "")
-        letters = ''.join(ch for ch in r if ch.isalpha())
-        digits = ''.join(ch for ch in r if ch.isdigit())
-        if not letters or not digits:
-            raise ValidationError("Invalid course code")
-        return f"{letters} {digits}"
+    _normalize_course = staticmethod(normalize_course)
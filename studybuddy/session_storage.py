@@ -1,11 +1,16 @@
 from __future__ import annotations
 
-import json
+import heapq
 import os
+import time
+from bisect import bisect_right
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 
 from .session_models import StudySession
+from . import file_cache, replication, sharding
+from .profiling import timed
 
 DEFAULT_SESSIONS_PATH = Path("data") / "sessions.json"
 
@@ -15,48 +20,398 @@ def _sessions_path() -> Path:
     return Path(custom) if custom else DEFAULT_SESSIONS_PATH
 
 
-def _ensure_parent(path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
+def _shard_paths(n: Optional[int] = None) -> List[Path]:
+    return sharding.shard_paths(_sessions_path(), n or sharding.shard_count())
 
 
+def _shard_index(session: StudySession, n: int) -> int:
+    # Sessions live with their invitee, where the pending-request queries land
+    return sharding.shard_of(session.invitee, n)
+
+
+def _next_in_shard(after: int, shard: int, n: int) -> int:
+    """Smallest value > after that is congruent to ``shard`` mod n.
+
+    Ids are allocated this way when sharded so an id names its shard.
+    """
+    v = after + 1
+    return v + (shard - v) % n
+
+
+def data_version() -> Optional[tuple]:
+    """Opaque token that changes whenever the sessions file (or any shard) is rewritten."""
+    paths = _shard_paths()
+    if len(paths) == 1:
+        sig = file_cache.signature(paths[0])
+        return None if sig is None else (str(paths[0].resolve()),) + sig
+    return sharding.combined_version(paths, [file_cache.signature(p) for p in paths])
+
+
+def _sessions_in(doc) -> Sequence[Mapping]:
+    return () if doc is None else doc.get("sessions", ())
+
+
+# Shard records merged in id order, rebuilt only when some shard changes
+_merged: Optional[Tuple[object, Sequence[Mapping]]] = None
+
+
+def load_raw() -> Sequence[Mapping]:
+    """Frozen session records straight from the read cache (no model objects)."""
+    global _merged
+    paths = _shard_paths()
+    if len(paths) == 1:
+        return _sessions_in(file_cache.read_json(paths[0]))
+    version = data_version()
+    if _merged is not None and version is not None and _merged[0] == version:
+        return _merged[1]
+    raw = tuple(sorted((d for doc in file_cache.read_json_many(paths) for d in _sessions_in(doc)),
+                       key=lambda d: d["id"]))
+    _merged = (version, raw)
+    return raw
+
+
+@timed("sessions.load")
 def load_all() -> List[StudySession]:
-    path = _sessions_path()
-    if not path.exists():
+    return [StudySession.from_dict(d) for d in load_raw()]
+
+
+def current_seq() -> int:
+    """Highest change-feed sequence number written so far (0 for a new store)."""
+    seq = 0
+    for doc in file_cache.read_json_many(_shard_paths()):
+        if doc is not None:
+            seq = max(seq, doc.get("seq", max((d.get("seq", 0) for d in _sessions_in(doc)), default=0)))
+    return seq
+
+
+def _seq_path() -> Path:
+    return _sessions_path().with_suffix(".seq")
+
+
+def write_lock():
+    """Exclusive lock held while sequence numbers are allocated and written.
+
+    Every session write allocates from one counter (``sessions.seq``) and
+    commits under this lock, so seqs reach disk in increasing order across
+    all shards and a ``changes_since`` cursor never skips a change.
+    Reentrant; run-batch holds it for the whole batch because its writes
+    are stamped long before they are flushed.
+    """
+    return file_cache.locked(_seq_path())
+
+
+def _ids_path() -> Path:
+    return _sessions_path().with_suffix(".ids")
+
+
+@contextmanager
+def _one_commit():
+    """Queue the writes made inside and flush them together on success.
+
+    The counters and the expiry index are file_cache documents like the
+    shards, so they land in the same snapshot generation as the data and
+    a rolled-back run-batch restores them with it (its buffer is used
+    as-is). Callers hold ``write_lock()`` around the block.
+    """
+    own = not file_cache.is_buffering()
+    with file_cache.buffered() if own else nullcontext():
+        yield
+        if own:
+            file_cache.flush()
+
+
+def _reserve_seqs(count: int, at_least: int = 0) -> int:
+    """Advance the shared counter by ``count`` (to at least ``at_least``); returns its new value.
+
+    Caller holds ``write_lock()``. The counter is committed with (and, on
+    disk, ahead of) the data, so a crash in between leaves a gap, never a
+    reused seq.
+    """
+    last = file_cache.read_json(_seq_path())
+    if last is None:
+        last = current_seq()  # data written before the counter existed
+    value = max(last + count, at_least)
+    if value != last:
+        file_cache.write_json(_seq_path(), value)
+    return value
+
+
+def _allocate_id(invitee: str) -> int:
+    """Next session id from the ``sessions.ids`` counter; caller holds ``write_lock()``.
+
+    When sharded the id is congruent to the invitee's shard mod n, so
+    ``get`` reads a single shard.
+    """
+    last = file_cache.read_json(_ids_path())
+    if last is None:
+        last = max((d["id"] for d in load_raw()), default=0)  # data written before the counter existed
+    n = sharding.shard_count()
+    sid = last + 1 if n == 1 else _next_in_shard(last, sharding.shard_of(invitee, n), n)
+    file_cache.write_json(_ids_path(), sid)
+    return sid
+
+
+def _stamp(changed: Iterable[StudySession]) -> int:
+    changed = list(changed)
+    seq = _reserve_seqs(len(changed))
+    for offset, s in enumerate(changed):
+        s.seq = seq - len(changed) + 1 + offset
+    return seq
+
+
+@timed("sessions.save")
+def _write_shards(shards: Iterable[Tuple[Path, Iterable[Mapping]]], seq: int, deletes: List[Path] = ()) -> None:
+    # One file_cache commit, so the shards form a single snapshot generation.
+    # Records may be frozen cache entries; session records are flat, so a
+    # shallow dict() copy is enough to serialize them.
+    file_cache.write_json_many(
+        [(path, {"seq": seq, "sessions": [dict(r) for r in records]}) for path, records in shards], deletes
+    )
+
+
+def _replaced(path: Path, updates: Mapping[int, StudySession], append: bool = False) -> List[Mapping]:
+    """The shard's records with ``updates`` swapped in by id; other records are reused as-is."""
+    pending = dict(updates)
+    records: List[Mapping] = [
+        pending.pop(d["id"]).to_dict() if d["id"] in pending else d
+        for d in _sessions_in(file_cache.read_json(path))
+    ]
+    if append:
+        records.extend(s.to_dict() for s in pending.values())
+    return records
+
+
+def save_all(sessions: List[StudySession], changed: Iterable[StudySession] = ()) -> None:
+    """Write all sessions, stamping each of ``changed`` with the next sequence number.
+
+    When sharded, only the shards holding a changed session are rewritten
+    (every shard if ``changed`` is empty).
+    """
+    replication.check_writable()
+    paths = _shard_paths()
+    n = len(paths)
+    changed = list(changed)
+    with write_lock(), _one_commit():
+        seq = max([_stamp(changed)] + [s.seq for s in sessions])
+        shards: List[List[Mapping]] = [[] for _ in paths]
+        for s in sessions:
+            shards[_shard_index(s, n)].append(s.to_dict())
+        dirty = {_shard_index(s, n) for s in changed} if changed else range(n)
+        # Logged before the data is written (see replication)
+        if changed:
+            for s in changed:
+                replication.record("session.upsert", session=s.to_dict())
+        else:
+            replication.record("sessions.replace", sessions=[s.to_dict() for s in sessions])
+        _write_shards([(paths[i], shards[i]) for i in sorted(dirty)], seq)
+        if changed:
+            _note_expiries(changed)
+        else:
+            _save_expiry_index(_expiry_entries(s.to_dict() for s in sessions))
+
+
+_seq_index: Optional[Tuple[object, Sequence[Mapping], List[int], List[int]]] = None
+
+
+def changes_since(cursor: int) -> List[StudySession]:
+    """Sessions mutated after ``cursor`` (a seq value), oldest change first.
+
+    A (seq, position) index is built once per file version, so a poll only
+    materializes the changed records.
+    """
+    global _seq_index
+    version = data_version()
+    if _seq_index is None or _seq_index[0] != version or version is None:
+        raw = load_raw()
+        order = sorted(range(len(raw)), key=lambda i: raw[i].get("seq", 0))
+        _seq_index = (version, raw, [raw[i].get("seq", 0) for i in order], order)
+    _, raw, seqs, order = _seq_index
+    start = bisect_right(seqs, cursor)
+    return [StudySession.from_dict(raw[i]) for i in order[start:]]
+
+
+# Expiry index: a min-heap of [expires_at, id, invitee] over pending
+# sessions with a TTL, persisted next to the data (sessions.expiry.json) and
+# maintained by every write, so a process can tell whether anything is due
+# from this small file instead of scanning the sessions. Entries are only
+# added on write; ones whose session was answered in the meantime are
+# dropped when they come due.
+
+
+def _expiry_path() -> Path:
+    return _sessions_path().with_suffix(".expiry.json")
+
+
+def _expiry_entries(records: Iterable[Mapping]) -> List[list]:
+    heap = [[d["expires_at"], d["id"], d["invitee"]] for d in records
+            if d.get("status", "pending") == "pending" and d.get("expires_at") is not None]
+    heapq.heapify(heap)
+    return heap
+
+
+def _save_expiry_index(heap: List[list]) -> None:
+    """Persist the heap; caller holds ``write_lock()``."""
+    file_cache.write_json(_expiry_path(), heap)
+
+
+def _expiry_index() -> Sequence[Sequence]:
+    """The persisted heap (frozen, via file_cache); built once from the data if missing."""
+    heap = file_cache.read_json(_expiry_path())
+    if heap is not None or data_version() is None:
+        return heap or ()
+    with write_lock():  # data from before the index existed
+        if file_cache.read_json(_expiry_path()) is None:
+            _save_expiry_index(_expiry_entries(load_raw()))
+    return _expiry_index()
+
+
+def _expiry_heap() -> List[list]:
+    """A mutable copy of the heap for a writer holding ``write_lock()``."""
+    return [list(e) for e in _expiry_index()]
+
+
+def _note_expiries(sessions: Iterable[StudySession]) -> None:
+    """Add newly written pending sessions with a TTL; caller holds ``write_lock()``."""
+    new = _expiry_entries(s.to_dict() for s in sessions)
+    if new:
+        heap = _expiry_heap()
+        for entry in new:
+            heapq.heappush(heap, entry)
+        _save_expiry_index(heap)
+
+
+def next_expiry() -> Optional[float]:
+    heap = _expiry_index()
+    return heap[0][0] if heap else None
+
+
+def expire_due(now: float) -> List[StudySession]:
+    """Mark pending sessions with expires_at <= now as expired; return them.
+
+    When nothing is due this only stats (and at most re-reads) the expiry
+    index. Otherwise only the shards holding due sessions are read, and
+    only the due records are replaced in them.
+    """
+    nearest = next_expiry()
+    if nearest is None or nearest > now:
+        return []
+    with write_lock(), _one_commit():
+        heap = _expiry_heap()
+        by_shard: Dict[Path, Set[int]] = {}
+        paths = _shard_paths()
+        while heap and heap[0][0] <= now:
+            _, sid, invitee = heapq.heappop(heap)
+            by_shard.setdefault(paths[sharding.shard_of(invitee, len(paths))], set()).add(sid)
+        changed = expire_ids(by_shard, now)
+        _save_expiry_index(heap)
+    return changed
+
+
+def expire_sessions(targets: Iterable[Tuple[int, str]], now: float) -> List[StudySession]:
+    """Expire the given (id, invitee) sessions if still pending and due.
+
+    For callers that already know what is due (the columnar table): only
+    the owning shards are read, and they are dropped from the read cache
+    again afterwards so the parsed documents do not stay resident.
+    """
+    paths = _shard_paths()
+    by_shard: Dict[Path, Set[int]] = {}
+    for sid, invitee in targets:
+        by_shard.setdefault(paths[sharding.shard_of(invitee, len(paths))], set()).add(sid)
+    if not by_shard:
         return []
-    with path.open("r", encoding="utf-8") as f:
-        raw = json.load(f)
-    return [StudySession.from_dict(d) for d in raw.get("sessions", [])]
+    done = {sid for ids in by_shard.values() for sid in ids}
+    with write_lock(), _one_commit():
+        changed = expire_ids(by_shard, now)
+        heap = [e for e in _expiry_heap() if not (e[0] <= now and e[1] in done)]
+        heapq.heapify(heap)
+        _save_expiry_index(heap)
+    for path in by_shard:
+        file_cache.invalidate(path)
+    return changed
 
 
-def save_all(sessions: List[StudySession]) -> None:
-    path = _sessions_path()
-    _ensure_parent(path)
-    data = {"sessions": [s.to_dict() for s in sessions]}
-    tmp = path.with_suffix(".tmp")
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    tmp.replace(path)
+def expire_ids(by_shard: Mapping[Path, Iterable[int]], now: float) -> List[StudySession]:
+    """Expire the given sessions if they are still pending and due; caller holds ``write_lock()``."""
+    changed: List[StudySession] = []
+    updates: List[Tuple[Path, Dict[int, StudySession]]] = []
+    for path, ids in by_shard.items():
+        wanted, due = set(ids), {}
+        for d in _sessions_in(file_cache.read_json(path)):
+            if (d["id"] in wanted and d.get("status", "pending") == "pending"
+                    and d.get("expires_at") is not None and d["expires_at"] <= now):
+                s = StudySession.from_dict(d)
+                s.status = "expired"
+                due[s.id] = s
+        if due:
+            updates.append((path, due))
+            changed.extend(due.values())
+    if changed:
+        seq = _stamp(changed)
+        for s in changed:
+            replication.record("session.upsert", session=s.to_dict())
+        _write_shards([(path, _replaced(path, due)) for path, due in updates], seq)
+    return changed
 
 
-def next_id(sessions: List[StudySession]) -> int:
-    return (max((s.id for s in sessions), default=0) + 1)
+def wait_for_change(since: Optional[tuple], timeout: float, interval: float = 0.5) -> bool:
+    """Block until the sessions file signature differs from ``since``.
+
+    Polls os.stat() every ``interval`` seconds (the stdlib has no portable
+    file-change notification). Returns False if ``timeout`` elapses first.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if data_version() != since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
 
 
 def get(session_id: int) -> Optional[StudySession]:
-    for s in load_all():
-        if s.id == session_id:
-            return s
+    paths = _shard_paths()
+    if len(paths) > 1:
+        # Ids allocated by _allocate_id() encode their shard
+        for d in _sessions_in(file_cache.read_json(paths[session_id % len(paths)])):
+            if d["id"] == session_id:
+                return StudySession.from_dict(d)
+    for d in load_raw():
+        if d["id"] == session_id:
+            return StudySession.from_dict(d)
     return None
 
 
-def upsert(session: StudySession) -> None:
-    sessions = load_all()
-    replaced = False
-    for i, s in enumerate(sessions):
-        if s.id == session.id:
-            sessions[i] = session
-            replaced = True
-            break
-    if not replaced:
-        sessions.append(session)
-    save_all(sessions)
+def upsert(session: StudySession, stamp: bool = True) -> None:
+    """Insert or replace one session, rewriting only the shard that owns it.
+
+    A session with id 0 is new and is given the next id here, under the
+    write lock, so concurrent proposals never share one. ``stamp=False``
+    keeps the session's existing seq (used when replaying a replication
+    log).
+    """
+    replication.check_writable()
+    paths = _shard_paths()
+    n = len(paths)
+    path = paths[_shard_index(session, n)]
+    with write_lock(), _one_commit():
+        if not session.id:
+            session.id = _allocate_id(session.invitee)
+        seq = _stamp([session]) if stamp else max(_reserve_seqs(0, at_least=session.seq), current_seq())
+        replication.record("session.upsert", session=session.to_dict())
+        _write_shards([(path, _replaced(path, {session.id: session}, append=True))], seq)
+        _note_expiries([session])
+
+
+def reshard(new_count: int) -> None:
+    """Rewrite all sessions into ``new_count`` shards and remove the old files."""
+    with write_lock():
+        sessions = load_all()
+        seq = current_seq()
+        old_paths = _shard_paths()
+        new_paths = _shard_paths(new_count)
+        shards: List[List[Mapping]] = [[] for _ in new_paths]
+        for s in sessions:
+            shards[_shard_index(s, new_count)].append(s.to_dict())
+        _write_shards(zip(new_paths, shards), seq, deletes=sorted(set(old_paths) - set(new_paths)))
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import math
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from .session_models import StudySession
+from .availability_service import DAY_ORDER, _DAY_MAP, _parse_time, _time_str
+from . import course_catalog, file_cache, serialization, session_storage, sharding, snapshots
+
+# Columnar, read-only view of the sessions file.
+#
+# One typed array per field instead of one StudySession per row: emails are
+# interned to user ids, courses to catalog ids, days and statuses to small
+# codes, times to minutes. A per-user row index makes the per-email queries
+# O(k), and StudySession objects are only built for rows that are returned.
+
+STATUSES = ("pending", "accepted", "declined", "expired")
+_STATUS_CODE = {s: i for i, s in enumerate(STATUSES)}
+PENDING, ACCEPTED = _STATUS_CODE["pending"], _STATUS_CODE["accepted"]
+_NONE = math.nan  # missing timestamps
+
+
+class SessionTable:
+    def __init__(self, records: Iterable[Mapping]) -> None:
+        self.emails: List[str] = []
+        self._email_ids: Dict[str, int] = {}
+        self._uids_by_lower: Dict[str, set] = {}  # spellings differing only in case
+        self.ids = array("q")
+        self.requester = array("l")
+        self.invitee = array("l")
+        self.course = array("l")
+        self.day = array("b")
+        self.start = array("h")
+        self.end = array("h")
+        self.status = array("b")
+        self.seq = array("q")
+        self.created_at = array("d")
+        self.expires_at = array("d")
+        self._expiry_order: Optional[Tuple[List[float], List[int]]] = None  # built on first due()
+        self.messages: Dict[int, str] = {}  # sparse: row -> message
+        self.dates: Dict[int, str] = {}  # sparse: row -> YYYY-MM-DD
+        # lower-cased email -> rows where that user is requester or invitee
+        self._rows_by_user: Dict[str, array] = {}
+        for row, d in enumerate(records):
+            self._append(row, d)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _intern_email(self, email: str) -> int:
+        uid = self._email_ids.get(email)
+        if uid is None:
+            uid = len(self.emails)
+            self._email_ids[email] = uid
+            self.emails.append(email)
+            self._uids_by_lower.setdefault(email.lower(), set()).add(uid)
+        return uid
+
+    def _append(self, row: int, d: Mapping) -> None:
+        self.ids.append(d["id"])
+        self.requester.append(self._intern_email(d["requester"]))
+        self.invitee.append(self._intern_email(d["invitee"]))
+        self.course.append(course_catalog.intern(d["course"]))
+        self.day.append(_DAY_MAP[d["day"]])
+        self.start.append(_parse_time(d["start"]))
+        self.end.append(_parse_time(d["end"]))
+        self.status.append(_STATUS_CODE[d.get("status", "pending")])
+        self.seq.append(d.get("seq", 0))
+        created, expires = d.get("created_at"), d.get("expires_at")
+        self.created_at.append(_NONE if created is None else created)
+        self.expires_at.append(_NONE if expires is None else expires)
+        if d.get("message") is not None:
+            self.messages[row] = d["message"]
+        if d.get("date") is not None:
+            self.dates[row] = d["date"]
+        for email in {d["requester"].lower(), d["invitee"].lower()}:
+            self._rows_by_user.setdefault(email, array("l")).append(row)
+
+    def rows_for(self, email: str) -> Sequence[int]:
+        return self._rows_by_user.get(email.lower(), array("l"))
+
+    def _uids(self, email: str) -> set:
+        return self._uids_by_lower.get(email.lower(), set())
+
+    def incoming(self, email: str) -> List[int]:
+        uids = self._uids(email)
+        return [r for r in self.rows_for(email) if self.status[r] == PENDING and self.invitee[r] in uids]
+
+    def outgoing(self, email: str) -> List[int]:
+        uids = self._uids(email)
+        return [r for r in self.rows_for(email) if self.status[r] == PENDING and self.requester[r] in uids]
+
+    def confirmed(self, email: str) -> List[int]:
+        return [r for r in self.rows_for(email) if self.status[r] == ACCEPTED]
+
+    def due(self, now: float) -> List[int]:
+        """Pending rows whose expires_at <= now, from the status/expires_at columns."""
+        if self._expiry_order is None:
+            rows = sorted((self.expires_at[r], r) for r in range(len(self.ids))
+                          if self.status[r] == PENDING and not math.isnan(self.expires_at[r]))
+            self._expiry_order = ([t for t, _ in rows], [r for _, r in rows])
+        times, rows = self._expiry_order
+        return rows[:bisect_right(times, now)]
+
+    def materialize(self, row: int) -> StudySession:
+        created, expires = self.created_at[row], self.expires_at[row]
+        return StudySession(
+            id=self.ids[row],
+            requester=self.emails[self.requester[row]],
+            invitee=self.emails[self.invitee[row]],
+            course=course_catalog.code_for(self.course[row]),
+            day=DAY_ORDER[self.day[row]],
+            start=_time_str(self.start[row]),
+            end=_time_str(self.end[row]),
+            status=STATUSES[self.status[row]],  # type: ignore[arg-type]
+            message=self.messages.get(row),
+            seq=self.seq[row],
+            created_at=None if math.isnan(created) else created,
+            expires_at=None if math.isnan(expires) else expires,
+            date=self.dates.get(row),
+        )
+
+    def materialize_rows(self, rows: Iterable[int]) -> List[StudySession]:
+        return [self.materialize(r) for r in rows]
+
+
+_cached: Optional[Tuple[object, SessionTable]] = None
+
+
+def current_table() -> SessionTable:
+    """SessionTable for the current sessions file, rebuilt when the file changes.
+
+    The file is parsed directly rather than through file_cache, so in
+    columnar mode only the compact columns stay resident between calls.
+    """
+    global _cached
+    version = session_storage.data_version()
+    if _cached is not None and version is not None and _cached[0] == version:
+        return _cached[1]
+    path = session_storage._sessions_path()
+    records: Sequence[Mapping] = ()
+    if sharding.shard_count() > 1 or file_cache.has_pending(path) or snapshots.enabled():
+        records = session_storage.load_raw()
+    elif version is not None:
+        with path.open("rb") as f:
+            records = serialization.loads(f.read()).get("sessions", [])
+    table = SessionTable(records)
+    _cached = (version, table)
+    return table
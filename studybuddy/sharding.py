@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import os
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+from .errors import ValidationError
+
+# Optional horizontal partitioning of the data files.
+#
+# With STUDYBUDDY_SHARDS=N (N > 1) each store is split into N files next to
+# its usual path (users.json -> users.0-of-4.json ... users.3-of-4.json).
+# Records are routed by a stable hash of an email, so single-user reads and
+# writes touch one file and independent writers can own separate shards.
+# N = 1 (the default) is the original single-file layout.
+
+
+def shard_count() -> int:
+    raw = os.environ.get("STUDYBUDDY_SHARDS", "")
+    try:
+        n = int(raw) if raw else 1
+    except ValueError:
+        raise ValidationError("STUDYBUDDY_SHARDS must be a positive integer")
+    if n < 1:
+        raise ValidationError("STUDYBUDDY_SHARDS must be a positive integer")
+    return n
+
+
+def shard_of(email: str, n: int) -> int:
+    """Shard index for an email; crc32 is stable across processes, unlike hash()."""
+    if n == 1:
+        return 0
+    return zlib.crc32(email.lower().encode("utf-8")) % n
+
+
+def shard_paths(base: Path, n: int) -> List[Path]:
+    if n == 1:
+        return [base]
+    return [base.with_name(f"{base.stem}.{i}-of-{n}{base.suffix}") for i in range(n)]
+
+
+def combined_version(paths: List[Path], signatures: List[Optional[tuple]]) -> Optional[tuple]:
+    """One version token for a set of shard files (None if none exist yet)."""
+    if all(sig is None for sig in signatures):
+        return None
+    return tuple((str(p.resolve()), sig) for p, sig in zip(paths, signatures))
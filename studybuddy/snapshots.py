@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: manifest updates are unlocked
+    fcntl = None
+
+# Generation-numbered data files behind a manifest (STUDYBUDDY_SNAPSHOTS=1).
+#
+# Each logical file (users.json, sessions.json, shards, ...) is stored as
+# users.g00000012.json and so on; manifest.json maps every logical path to
+# its current generation file. A write creates a new generation file and
+# then swaps the manifest, so readers see either the old or the new set of
+# files, never a mix. ``pinned()`` freezes the manifest for a block so all
+# reads inside it come from one generation. Superseded files stay on disk
+# for a grace period (STUDYBUDDY_SNAPSHOT_GRACE seconds, default 300) for
+# readers still pinned to them, then are deleted on a later commit.
+# Files written before snapshots were enabled are read in place until their
+# first write.
+
+Manifest = Dict[str, object]
+
+_cached: Optional[Tuple[tuple, Manifest]] = None
+_pinned: Optional[Manifest] = None
+_pin_depth = 0
+
+
+def enabled() -> bool:
+    return os.environ.get("STUDYBUDDY_SNAPSHOTS", "") not in ("", "0")
+
+
+def manifest_path() -> Path:
+    custom = os.environ.get("STUDYBUDDY_MANIFEST_PATH")
+    if custom:
+        return Path(custom)
+    from . import storage
+    return storage._data_path().with_name("manifest.json")
+
+
+def _grace() -> float:
+    raw = os.environ.get("STUDYBUDDY_SNAPSHOT_GRACE")
+    return float(raw) if raw else 300.0
+
+
+def _empty() -> Manifest:
+    return {"generation": 0, "files": {}, "retired": {}}
+
+
+def _read_manifest() -> Manifest:
+    path = manifest_path()
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _empty()
+
+
+def current() -> Manifest:
+    """The latest committed manifest (re-read only when the file changes)."""
+    global _cached
+    path = manifest_path()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return _empty()
+    sig = (str(path.resolve()), st.st_mtime_ns, st.st_size, st.st_ino)
+    if _cached is None or _cached[0] != sig:
+        _cached = (sig, _read_manifest())
+    return _cached[1]
+
+
+def resolve(path: Path) -> Path:
+    """Physical file currently holding logical ``path`` (itself if unmanaged)."""
+    if _pinned is None and not enabled():
+        return path
+    manifest = _pinned if _pinned is not None else current()
+    physical = manifest["files"].get(os.path.abspath(path))
+    return Path(physical) if physical else path
+
+
+@contextmanager
+def _locked() -> Iterator[None]:
+    path = manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path) + ".lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _generation_name(path: Path, generation: int) -> Path:
+    return path.with_name(f"{path.stem}.g{generation:08d}{path.suffix}")
+
+
+def _retire(manifest: Manifest, key: str, now: float) -> None:
+    old = manifest["files"].pop(key, None)
+    if old:
+        manifest["retired"][old] = now
+
+
+def _collect(manifest: Manifest, now: float, grace: float) -> None:
+    for old, retired_at in list(manifest["retired"].items()):
+        if now - retired_at >= grace:
+            try:
+                os.unlink(old)
+            except FileNotFoundError:
+                pass
+            del manifest["retired"][old]
+
+
+def _swap(manifest: Manifest) -> None:
+    path = manifest_path()
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def commit(writes: List[Tuple[Path, bytes]], deletes: List[Path] = ()) -> int:
+    """Write ``writes`` as one new generation and publish it; returns the generation.
+
+    Inside a pinned block the pinned view is updated too, so a command sees
+    its own writes.
+    """
+    now = time.time()
+    with _locked():
+        manifest = _read_manifest()
+        generation = manifest["generation"] + 1
+        for path, payload in writes:
+            physical = _generation_name(path, generation)
+            physical.parent.mkdir(parents=True, exist_ok=True)
+            with physical.open("wb") as f:
+                f.write(payload)
+            key = os.path.abspath(path)
+            _retire(manifest, key, now)
+            manifest["files"][key] = os.path.abspath(physical)
+        for path in deletes:
+            _retire(manifest, os.path.abspath(path), now)
+            # A pre-snapshot plain file would otherwise show through again
+            if path.exists():
+                path.unlink()
+        manifest["generation"] = generation
+        _collect(manifest, now, _grace())
+        _swap(manifest)
+    if _pinned is not None:
+        for path, _ in writes:
+            _pinned["files"][os.path.abspath(path)] = manifest["files"][os.path.abspath(path)]
+        for path in deletes:
+            _pinned["files"].pop(os.path.abspath(path), None)
+    return generation
+
+
+def collect_garbage(grace: Optional[float] = None) -> int:
+    """Delete superseded generation files older than ``grace`` seconds; returns how many."""
+    with _locked():
+        manifest = _read_manifest()
+        before = len(manifest["retired"])
+        _collect(manifest, time.time(), _grace() if grace is None else grace)
+        removed = before - len(manifest["retired"])
+        if removed:
+            _swap(manifest)
+    return removed
+
+
+@contextmanager
+def pinned() -> Iterator[None]:
+    """Read every managed file from one manifest generation inside the block (reentrant)."""
+    global _pinned, _pin_depth
+    if _pin_depth == 0 and enabled():
+        m = current()
+        _pinned = {"generation": m["generation"], "files": dict(m["files"]), "retired": {}}
+    _pin_depth += 1
+    try:
+        yield
+    finally:
+        _pin_depth -= 1
+        if _pin_depth == 0:
+            _pinned = None
+
+
+def isolated(func):
+    """Run ``func`` (or iterate a generator function) inside ``pinned()``."""
+    import inspect  # only needed where services are decorated, not on the storage path
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with pinned():
+                yield from func(*args, **kwargs)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with pinned():
+            return func(*args, **kwargs)
+    return wrapper
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-import json
 import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple
 
 from .models import UserProfile
+from . import file_cache, replication, serialization, sharding
+from .profiling import timed
 
 
 DEFAULT_DATA_PATH = Path("data") / "users.json"
@@ -19,45 +20,112 @@ def _data_path() -> Path:
     return DEFAULT_DATA_PATH
 
 
-def _ensure_parent(path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
+def _shard_paths(n: Optional[int] = None) -> List[Path]:
+    return sharding.shard_paths(_data_path(), n or sharding.shard_count())
 
 
+def _shard_path_for(email: str) -> Path:
+    paths = _shard_paths()
+    return paths[sharding.shard_of(email, len(paths))]
+
+
+def data_version() -> Optional[tuple]:
+    """Opaque token that changes whenever the users file (or any shard) is rewritten."""
+    paths = _shard_paths()
+    if len(paths) == 1:
+        sig = file_cache.signature(paths[0])
+        return None if sig is None else (str(paths[0].resolve()),) + sig
+    return sharding.combined_version(paths, [file_cache.signature(p) for p in paths])
+
+
+def _users_in(doc) -> Sequence[Mapping]:
+    return () if doc is None else doc.get("users", ())
+
+
+# Concatenated shard records, rebuilt only when some shard changes
+_merged: Optional[Tuple[object, Sequence[Mapping]]] = None
+
+
+def load_raw() -> Sequence[Mapping]:
+    """Frozen user records straight from the read cache (no model objects)."""
+    global _merged
+    paths = _shard_paths()
+    if len(paths) == 1:
+        return _users_in(file_cache.read_json(paths[0]))
+    version = data_version()
+    if _merged is not None and version is not None and _merged[0] == version:
+        return _merged[1]
+    raw = tuple(d for doc in file_cache.read_json_many(paths) for d in _users_in(doc))
+    _merged = (version, raw)
+    return raw
+
+
+@timed("users.load")
 def load_all() -> List[UserProfile]:
-    path = _data_path()
-    if not path.exists():
-        return []
-    with path.open("r", encoding="utf-8") as f:
-        raw = json.load(f)
-    return [UserProfile.from_dict(d) for d in raw.get("users", [])]
+    # Parsed file contents are cached per process; each call still builds
+    # fresh UserProfile objects so callers may mutate what they get back.
+    return [UserProfile.from_dict(d) for d in load_raw()]
+
+
+def write_lock():
+    """Cross-process lock serializing user writes (and their log entries)."""
+    return file_cache.locked(_data_path())
+
+
+@timed("users.save")
+def _write_shards(shards: Iterable[Tuple[Path, list]], deletes: List[Path] = ()) -> None:
+    # One file_cache commit, so the shards form a single snapshot generation
+    file_cache.write_json_many(
+        [(path, {"users": [serialization.pack_user(r) for r in records]}) for path, records in shards], deletes
+    )
 
 
 def save_all(users: List[UserProfile]) -> None:
-    path = _data_path()
-    _ensure_parent(path)
-    data = {"users": [u.to_dict() for u in users]}
-    tmp_path = path.with_suffix(".tmp")
-    with tmp_path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    tmp_path.replace(path)
+    replication.check_writable()
+    paths = _shard_paths()
+    shards: List[list] = [[] for _ in paths]
+    for u in users:
+        shards[sharding.shard_of(u.email, len(paths))].append(u.to_dict())
+    with write_lock():
+        # Logged first: a crash after this line is repaired on the replicas
+        replication.record("users.replace", users=[u.to_dict() for u in users])
+        _write_shards(zip(paths, shards))
 
 
 def get_by_email(email: str) -> Optional[UserProfile]:
+    # Only the owning shard is read
     email_lower = email.lower()
-    for u in load_all():
-        if u.email.lower() == email_lower:
-            return u
+    for d in _users_in(file_cache.read_json(_shard_path_for(email))):
+        if d["email"].lower() == email_lower:
+            return UserProfile.from_dict(d)
     return None
 
 
 def upsert(user: UserProfile) -> None:
-    users = load_all()
-    updated = False
-    for idx, existing in enumerate(users):
-        if existing.email.lower() == user.email.lower():
-            users[idx] = user
-            updated = True
-            break
-    if not updated:
-        users.append(user)
-    save_all(users)
+    # Rewrites only the shard that owns the user
+    replication.check_writable()
+    path = _shard_path_for(user.email)
+    with write_lock():
+        users = [UserProfile.from_dict(d) for d in _users_in(file_cache.read_json(path))]
+        updated = False
+        for idx, existing in enumerate(users):
+            if existing.email.lower() == user.email.lower():
+                users[idx] = user
+                updated = True
+                break
+        if not updated:
+            users.append(user)
+        replication.record("user.upsert", user=user.to_dict())
+        _write_shards([(path, [u.to_dict() for u in users])])
+
+
+def reshard(new_count: int) -> None:
+    """Rewrite all users into ``new_count`` shards and remove the old files."""
+    with write_lock():
+        users = load_all()
+        old_paths = _shard_paths()
+        new_paths = _shard_paths(new_count)
+        shards: List[list] = [[] for _ in new_paths]
+        for u in users:
+            shards[sharding.shard_of(u.email, new_count)].append(u.to_dict())
+        _write_shards(zip(new_paths, shards), deletes=sorted(set(old_paths) - set(new_paths)))
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import marshal
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from . import storage
+from .errors import ValidationError
+
+# Name/email lookup for find-user.
+#
+# Each user contributes a few lower-cased tokens: every word of the name,
+# the full name, the email local part and the full email. A sorted list of
+# (token, uid) answers prefix queries with one bisect; a trigram -> uids
+# map proposes candidates for typo-tolerant matching, which are confirmed
+# with a bounded edit distance. Results rank exact token matches first,
+# then prefix matches, then fuzzy matches by distance. The index is saved
+# next to the users file (users.search) keyed on its data version.
+
+_EXACT, _PREFIX, _FUZZY = 0, 1, 2
+_FORMAT = 1  # bump when the persisted layout changes
+_SEP = "\x00"
+_MATCH_NAMES = {_EXACT: "exact", _PREFIX: "prefix", _FUZZY: "fuzzy"}
+
+
+def _tokens(name: str, email: str) -> Set[str]:
+    name_l = " ".join(name.lower().split())
+    email_l = email.lower()
+    tokens = set(name_l.split())
+    tokens.update((name_l, email_l, email_l.split("@", 1)[0]))
+    tokens.discard("")
+    return tokens
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def prefix_distance(query: str, token: str, limit: int) -> int:
+    """Smallest edit distance from ``query`` to ``token`` or any prefix of it.
+
+    Optimal string alignment (an adjacent swap costs 1); one DP pass over
+    the token gives the distance to every prefix in its last row. Returns
+    ``limit + 1`` as soon as no alignment can stay within ``limit``.
+    """
+    b = token[:len(query) + limit]
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(query) + 1):
+        qc = query[i - 1]
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (qc != b[j - 1]))
+            if i > 1 and j > 1 and qc == b[j - 2] and query[i - 2] == b[j - 1]:
+                v = min(v, prev2[j - 2] + 1)
+            cur[j] = v
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return min(min(prev[1:], default=limit + 1), limit + 1)
+
+
+def max_typos(query: str) -> int:
+    return 0 if len(query) < 3 else 1 if len(query) < 7 else 2
+
+
+class UserSearchIndex:
+    def __init__(self, raw_users: Sequence[Mapping] = ()) -> None:
+        self.users: List[Tuple[str, str]] = []  # uid -> (name, email)
+        self._uid_by_email: Dict[str, int] = {}
+        # Sorted tokens with the uid of each, as parallel lists
+        self._tokens: List[str] = []
+        self._token_uids = array("i")
+        self._trigram_uids: Dict[str, array] = {}
+        pairs: List[Tuple[str, int]] = []
+        for raw in raw_users:
+            self._add(raw["name"], raw["email"], pairs)
+        pairs.sort()
+        self._tokens = [t for t, _ in pairs]
+        self._token_uids = array("i", (uid for _, uid in pairs))
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def add(self, name: str, email: str) -> None:
+        """Index one more user (no-op if the email is already indexed)."""
+        self._add(name, email, None)
+
+    def _add(self, name: str, email: str, pairs: Optional[List[Tuple[str, int]]]) -> None:
+        if email.lower() in self._uid_by_email:
+            return
+        uid = len(self.users)
+        self.users.append((name, email))
+        self._uid_by_email[email.lower()] = uid
+        grams: Set[str] = set()
+        for token in _tokens(name, email):
+            if pairs is not None:  # bulk build: sorted once at the end
+                pairs.append((token, uid))
+            else:
+                i = bisect_right(self._tokens, token)
+                self._tokens.insert(i, token)
+                self._token_uids.insert(i, uid)
+            if "@" not in token:  # the shared domain would match everyone
+                grams |= _trigrams(token)
+        for g in grams:
+            uids = self._trigram_uids.get(g)
+            if uids is None:
+                uids = self._trigram_uids[g] = array("i")
+            uids.append(uid)
+
+    def extend(self, raw_users: Sequence[Mapping]) -> bool:
+        """Index the users in ``raw_users`` that are not indexed yet.
+
+        Returns False (leaving the index unchanged) if an indexed user is
+        missing from ``raw_users`` or was renamed; only a rebuild fixes that.
+        """
+        current = {d["email"].lower(): d for d in raw_users}
+        if any(current.get(email.lower(), {}).get("name") != name for name, email in self.users):
+            return False
+        for email_l, d in current.items():
+            if email_l not in self._uid_by_email:
+                self.add(d["name"], d["email"])
+        return True
+
+    def _pack(self) -> Optional[tuple]:
+        # Strings are joined so loading is a few C-level splits, not one
+        # object per token; the trigram lists share one flat array
+        texts = [name for name, _ in self.users] + [email for _, email in self.users] + self._tokens
+        if any(_SEP in t for t in texts) or any(_SEP in g for g in self._trigram_uids):
+            return None
+        return (
+            _SEP.join(name for name, _ in self.users),
+            _SEP.join(email for _, email in self.users),
+            _SEP.join(self._tokens),
+            self._token_uids.tobytes(),
+            _SEP.join(self._trigram_uids),
+            array("i", (len(v) for v in self._trigram_uids.values())).tobytes(),
+            b"".join(v.tobytes() for v in self._trigram_uids.values()),
+        )
+
+    @classmethod
+    def _unpack(cls, packed: tuple) -> "UserSearchIndex":
+        names, emails, tokens, token_uids, grams, lengths, flat = packed
+        index = cls()
+        if names or emails:
+            index.users = list(zip(names.split(_SEP), emails.split(_SEP)))
+            index._tokens = tokens.split(_SEP)
+        index._uid_by_email = {email.lower(): uid for uid, (_, email) in enumerate(index.users)}
+        index._token_uids.frombytes(token_uids)
+        sizes, uids = array("i"), array("i")
+        sizes.frombytes(lengths)
+        uids.frombytes(flat)
+        pos = 0
+        for g, n in zip(grams.split(_SEP) if grams else (), sizes):
+            index._trigram_uids[g] = uids[pos:pos + n]
+            pos += n
+        return index
+
+    def _prefix_hits(self, query: str, best: Dict[int, Tuple[int, int]]) -> None:
+        i = bisect_left(self._tokens, query)
+        while i < len(self._tokens):
+            token, uid = self._tokens[i], self._token_uids[i]
+            if not token.startswith(query):
+                break
+            rank = (_EXACT, 0) if token == query else (_PREFIX, len(token) - len(query))
+            if uid not in best or rank < best[uid]:
+                best[uid] = rank
+            i += 1
+
+    def _fuzzy_hits(self, query: str, limit: int, best: Dict[int, Tuple[int, int]]) -> None:
+        typos = max_typos(query)
+        if typos == 0:
+            return
+        grams = _trigrams(query)
+        counts: Counter = Counter()
+        for g in grams:
+            counts.update(self._trigram_uids.get(g, ()))
+        # Each edit destroys at most three of the query's trigrams, and a
+        # prefix match also misses the query's end-of-token trigram
+        need = max(1, len(grams) - 3 * typos - 1)
+        distances: Dict[str, int] = {}  # tokens repeat across users (first names)
+        found = 0
+        # Candidates arrive most-shared-trigrams first; stop once enough match
+        for uid, shared in counts.most_common(limit * 20):
+            if shared < need or found >= limit:
+                break
+            if uid in best:
+                continue
+            dist = typos + 1
+            for t in _tokens(*self.users[uid]):
+                if "@" in t:
+                    continue
+                d = distances.get(t)
+                if d is None:
+                    d = distances[t] = prefix_distance(query, t, typos)
+                dist = min(dist, d)
+            if dist <= typos:
+                best[uid] = (_FUZZY, dist)
+                found += 1
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Ranked matches for ``query``: [{name, email, match, distance}]."""
+        q = " ".join(query.lower().split())
+        if not q:
+            raise ValidationError("Search query must not be empty")
+        if limit < 1:
+            raise ValidationError("Limit must be at least 1")
+        best: Dict[int, Tuple[int, int]] = {}
+        self._prefix_hits(q, best)
+        if len(best) < limit:
+            self._fuzzy_hits(q, limit, best)
+        ranked = sorted(best.items(), key=lambda kv: (kv[1], self.users[kv[0]][0].lower(), kv[0]))[:limit]
+        return [
+            {
+                "name": self.users[uid][0],
+                "email": self.users[uid][1],
+                "match": _MATCH_NAMES[tier],
+                "distance": score if tier == _FUZZY else 0,
+            }
+            for uid, (tier, score) in ranked
+        ]
+
+
+_cached: Optional[Tuple[object, UserSearchIndex]] = None
+
+
+def _index_path() -> Path:
+    return storage._data_path().with_name("users.search")
+
+
+def _load_persisted() -> Optional[Tuple[object, UserSearchIndex]]:
+    try:
+        with open(_index_path(), "rb") as f:
+            doc = marshal.load(f)
+        fmt, version, packed = doc
+    except (OSError, EOFError, ValueError, TypeError):
+        return None  # missing, or written by another Python version
+    if fmt != _FORMAT:
+        return None
+    return version, UserSearchIndex._unpack(packed)
+
+
+def _persist(version: object, index: UserSearchIndex) -> None:
+    # Derived data: written directly (no snapshot generation) and atomically
+    packed = index._pack()
+    if version is None or packed is None:
+        return
+    path = _index_path()
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            marshal.dump((_FORMAT, version, packed), f)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+def current_index() -> UserSearchIndex:
+    """UserSearchIndex for the current users file.
+
+    The index is persisted next to the users file and keyed on its data
+    version, so a fresh process loads it instead of rebuilding. When the
+    users file has changed since, users added in the meantime are folded
+    into the persisted index; renames and deletions force a rebuild.
+    """
+    global _cached
+    version = storage.data_version()
+    if _cached is not None and version is not None and _cached[0] == version:
+        return _cached[1]
+    persisted = _load_persisted()
+    if persisted is not None and version is not None and persisted[0] == version:
+        index = persisted[1]
+    else:
+        raw = storage.load_raw()
+        if persisted is not None and persisted[1].extend(raw):
+            index = persisted[1]
+        else:
+            index = UserSearchIndex(raw)
+        _persist(version, index)
+    _cached = (version, index)
+    return index
+
+
+def note_created(name: str, email: str, previous_version: object) -> None:
+    """Fold a newly created user into the cached index instead of rebuilding it.
+
+    Only applies when the index was built for ``previous_version`` (the
+    users file just before the write); otherwise the next lookup rebuilds.
+    """
+    global _cached
+    if _cached is None or _cached[0] != previous_version or previous_version is None:
+        return
+    _cached[1].add(name, email)
+    _cached = (storage.data_version(), _cached[1])
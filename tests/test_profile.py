@@ -1,3 +1,5 @@
+import contextlib
+import io
 import os
 import tempfile
 import json
@@ -313,3 +315,1055 @@ def test_respond_to_session_permission_denied():
     with pytest.raises(ValidationError, match="Only invitee can respond"):
         svc.respond(session_id=1, responder_email="charlie@clemson.edu", action="accept")
 
+
+
+# --- Tests for the per-process read cache ---
+
+@use_temp_store
+def test_repeated_loads_hit_cache_and_return_fresh_objects():
+    """Second load is served from cache; mutating results does not leak."""
+    from studybuddy import file_cache
+    ProfileService().create_profile("Liam", "liam@clemson.edu")
+    misses = file_cache.stats["misses"]
+    first = storage.load_all()
+    first[0].courses.append("HACK 0000")
+    second = storage.load_all()
+    assert file_cache.stats["misses"] == misses
+    assert second[0].courses == []
+
+
+@use_temp_store
+def test_cache_invalidated_by_external_rewrite():
+    """A rewrite of the file by someone else is picked up on the next load."""
+    ProfileService().create_profile("Mia", "mia@clemson.edu")
+    assert len(storage.load_all()) == 1
+    path = os.environ["STUDYBUDDY_DATA_PATH"]
+    tmp = path + ".other"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"users": []}, f)
+    os.replace(tmp, path)
+    assert storage.load_all() == []
+
+
+@use_temp_store
+def test_incremental_merge_bridges_neighbors():
+    """A slot that spans a gap merges both neighbors; other days are untouched."""
+    ProfileService().create_profile("Nina", "nina@clemson.edu")
+    svc = AvailabilityService()
+    svc.add_slot("nina@clemson.edu", "Tue", "08:00", "09:00")
+    svc.add_slot("nina@clemson.edu", "Mon", "13:00", "14:00")
+    svc.add_slot("nina@clemson.edu", "Mon", "09:00", "10:00")
+    svc.add_slot("nina@clemson.edu", "Mon", "11:00", "12:00")
+    slots = svc.add_slot("nina@clemson.edu", "Mon", "09:30", "11:00")
+    assert [(s.day, s.start, s.end) for s in slots] == [
+        ("MON", "09:00", "12:00"),
+        ("MON", "13:00", "14:00"),
+        ("TUE", "08:00", "09:00"),
+    ]
+
+
+@use_temp_store
+def test_unsorted_legacy_availability_is_normalized():
+    """Hand-edited, unsorted slot lists are merged before incremental updates."""
+    from studybuddy.models import UserProfile, AvailabilitySlot
+    storage.upsert(UserProfile(name="Omar", email="omar@clemson.edu", availability=[
+        AvailabilitySlot("WED", "14:00", "15:00"),
+        AvailabilitySlot("MON", "10:00", "11:00"),
+        AvailabilitySlot("MON", "09:00", "10:30"),
+    ]))
+    svc = AvailabilityService()
+    slots = svc.remove_slot("omar@clemson.edu", index=2)
+    assert [(s.day, s.start, s.end) for s in slots] == [("MON", "09:00", "11:00")]
+
+
+# --- Tests for profiling instrumentation ---
+
+@use_temp_store
+def test_profiling_records_hot_paths_only_when_enabled():
+    """Timers stay empty while disabled and count calls once enabled."""
+    from studybuddy import profiling
+    profiling.reset()
+    ProfileService().create_profile("Pia", "pia@clemson.edu")
+    assert profiling.timings() == {}
+    profiling.enable()
+    try:
+        AvailabilityService().add_slot("pia@clemson.edu", "Mon", "9am", "10am")
+    finally:
+        profiling.disable()
+    recorded = profiling.timings()
+    assert recorded["availability._parse_time"][1] >= 2
+    assert recorded["users.save"][1] == 1
+    assert profiling.counters()["storage.bytes_written"] > 0
+    profiling.reset()
+
+
+# --- Tests for metrics export ---
+
+@use_temp_stores
+def test_metrics_snapshot_accumulates_across_writes():
+    """Operations are counted and snapshots keep counters monotonic."""
+    from studybuddy import metrics
+    metrics.REGISTRY.clear()
+    _setup_search_and_session_scenario()
+    SearchService().overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+    with tempfile.TemporaryDirectory() as d:
+        out = os.path.join(d, "metrics.json")
+        metrics.write_snapshot(out)
+        SessionService().propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+        metrics.write_snapshot(out)
+        with open(out, encoding="utf-8") as f:
+            snap = json.load(f)
+        ops = {(s["labels"]["op"], s["labels"]["outcome"]): s["value"] for s in snap["studybuddy_operations_total"]["series"]}
+        assert ops[("create_profile", "ok")] == 3
+        assert ops[("propose", "ok")] == 1
+        search = snap["studybuddy_search_seconds"]["series"]
+        assert search[0]["labels"] == {"course_size": "le1", "op": "overlap"}
+        prom = os.path.join(d, "metrics.prom")
+        metrics.write_snapshot(prom)
+        with open(prom, encoding="utf-8") as f:
+            assert "# TYPE studybuddy_operations_total counter" in f.read()
+
+
+def test_metrics_state_survives_concurrent_writers():
+    """Processes exporting at once each merge into the sidecar under its lock."""
+    import subprocess
+    import sys
+    from studybuddy import metrics
+    script = (
+        "from studybuddy import metrics\n"
+        "for _ in range(20):\n"
+        "    metrics.SESSION_RESPONSES.inc(action='accept')\n"
+        "    metrics.write_snapshot(OUT)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as d:
+        out = os.path.join(d, "metrics.json")
+        procs = [subprocess.Popen([sys.executable, "-c", f"OUT = {out!r}\n" + script], cwd=root) for _ in range(4)]
+        assert all(p.wait() == 0 for p in procs)
+        metrics.REGISTRY.clear()
+        metrics.write_snapshot(out)
+        with open(out, encoding="utf-8") as f:
+            snap = json.load(f)
+    assert snap["studybuddy_session_responses_total"]["series"][0]["value"] == 80
+    assert snap["studybuddy_lock_wait_seconds"]["series"][0]["labels"] == {"file": "metrics.json.state"}
+
+
+@use_temp_stores
+def test_metrics_failure_does_not_change_exit_status():
+    from studybuddy import cli
+    with tempfile.TemporaryDirectory() as d:
+        blocker = os.path.join(d, "not-a-dir")
+        open(blocker, "w").close()
+        os.environ["STUDYBUDDY_METRICS_PATH"] = os.path.join(blocker, "metrics.json")
+        err = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+                assert cli.main(["create-user", "--name", "Alice", "--email", "alice@clemson.edu"]) == 0
+                assert cli.main(["create-user", "--name", "Alice", "--email", "alice@clemson.edu"]) == 1
+        finally:
+            os.environ.pop("STUDYBUDDY_METRICS_PATH", None)
+    assert err.getvalue().count("metrics snapshot failed:") == 2
+    assert storage.get_by_email("alice@clemson.edu") is not None
+
+
+# --- Tests for lazy imports ---
+
+def test_package_and_cli_import_lazily():
+    """Importing the CLI loads no service modules; package exports still resolve."""
+    import subprocess
+    import sys
+    code = (
+        "import sys, studybuddy.cli\n"
+        "assert 'studybuddy.search_service' not in sys.modules\n"
+        "assert 'studybuddy.session_service' not in sys.modules\n"
+        "import studybuddy.storage\n"
+        "for heavy in ('orjson', 'concurrent.futures'):\n"
+        "    assert heavy not in sys.modules, heavy\n"
+        "from studybuddy import SearchService, ValidationError\n"
+        "assert 'studybuddy.search_service' in sys.modules\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=root, check=True)
+
+
+# --- Tests for the who-is-free reverse index ---
+
+def test_interval_tree_matches_brute_force():
+    """Stabbing and range queries agree with a linear scan."""
+    import random
+    from studybuddy.availability_index import IntervalTree
+    rng = random.Random(7)
+    intervals = []
+    for i in range(300):
+        s = rng.randrange(0, 1400)
+        intervals.append((s, s + rng.randrange(1, 240), f"u{i}"))
+    tree = IntervalTree(intervals)
+    for _ in range(200):
+        a = rng.randrange(0, 1440)
+        b = a + rng.randrange(1, 120)
+        assert sorted(tree.stab(a)) == sorted(iv for iv in intervals if iv[0] <= a < iv[1])
+        assert sorted(tree.overlapping(a, b)) == sorted(iv for iv in intervals if iv[0] < b and iv[1] > a)
+
+
+@use_temp_stores
+def test_who_is_free_full_partial_and_course_filter():
+    """Full-window, partial-window and course-restricted queries."""
+    _setup_search_and_session_scenario()
+    svc = SearchService()
+    full = svc.who_is_free("Mon", "10:00", "11:00")
+    assert [e["email"] for e in full] == ["alice@clemson.edu", "bob@clemson.edu"]
+    partial = svc.who_is_free("Mon", "9:30", "10:30", partial=True)
+    assert len(partial) == 3
+    in_course = svc.who_is_free("Mon", "9:30", "10:30", course_code="cpsc3720",
+                                requester_email="alice@clemson.edu", partial=True)
+    assert [e["email"] for e in in_course] == ["bob@clemson.edu"]
+    assert svc.who_is_free("Tue", "9:00", "10:00") == []
+
+
+@use_temp_stores
+def test_who_is_free_reuses_persisted_index_and_reports_each_user_once():
+    from studybuddy import availability_index, file_cache
+    _setup_search_and_session_scenario()
+    AvailabilityService().add_slot("bob@clemson.edu", "Mon", "8:00", "9:00")
+    svc = SearchService()
+    partial = svc.who_is_free("Mon", "8:30", "10:30", partial=True)
+    assert [(e["email"], e["free_start"]) for e in partial] == [
+        ("alice@clemson.edu", "9:00 AM"), ("bob@clemson.edu", "8:00 AM"), ("charlie@clemson.edu", "9:00 AM")]
+    assert os.path.exists(availability_index._index_path())
+    # A fresh process loads the saved trees instead of parsing users.json
+    availability_index._cached = None
+    file_cache.invalidate()
+    misses = file_cache.stats["misses"]
+    assert svc.who_is_free("Mon", "8:30", "10:30", partial=True) == partial
+    assert file_cache.stats["misses"] == misses
+    AvailabilityService().add_slot("charlie@clemson.edu", "Tue", "9:00", "10:00")
+    availability_index._cached = None
+    assert [e["email"] for e in svc.who_is_free("Tue", "9:00", "10:00")] == ["charlie@clemson.edu"]
+
+
+# --- Tests for the pairwise overlap cache ---
+
+@use_temp_stores
+def test_overlap_cache_reuses_pairs_until_availability_changes():
+    """Unchanged pairs are served from cache; add_slot changes the digest."""
+    from studybuddy import metrics
+    _setup_search_and_session_scenario()
+    svc = SearchService()
+    metrics.REGISTRY.clear()
+    svc.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+    svc.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+    lookups = {dict(k)["result"]: v for k, v in metrics.OVERLAP_CACHE_LOOKUPS.values.items()}
+    assert lookups == {"miss": 1, "hit": 1}
+
+    AvailabilityService().add_slot("bob@clemson.edu", "Mon", "8:00", "9:30")
+    overlaps = svc.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+    assert overlaps[0]["total_minutes"] == 90  # 9:00-9:30 plus 10:00-11:00
+
+
+@use_temp_stores
+def test_overlap_cache_keys_on_availability_content():
+    """A profile rewritten directly with new slots is not served stale pairs."""
+    from studybuddy import snapshots
+    from studybuddy.models import AvailabilitySlot
+    os.environ["STUDYBUDDY_SNAPSHOTS"] = "1"
+    try:
+        _setup_search_and_session_scenario()
+        svc = SearchService()
+        before = svc.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+        generation = snapshots.current()["generation"]
+        bob = storage.get_by_email("bob@clemson.edu")
+        bob.availability = [AvailabilitySlot("MON", "09:00", "09:30")]
+        storage.upsert(bob)  # e.g. a restore, not through AvailabilityService
+        after = svc.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+        assert after != before and after[0]["total_minutes"] == 30
+        # The cache is written outside the snapshot manifest
+        assert snapshots.current()["generation"] == generation + 1
+        assert not any("overlap_cache" in k for k in snapshots.current()["files"])
+    finally:
+        os.environ.pop("STUDYBUDDY_SNAPSHOTS", None)
+
+
+def test_overlap_cache_evicts_least_recently_used():
+    """The cache is bounded and survives a reload in LRU order."""
+    from studybuddy.overlap_cache import OverlapCache
+    with tempfile.TemporaryDirectory() as d:
+        from pathlib import Path
+        path = Path(d) / "cache.json"
+        cache = OverlapCache(path, max_entries=2)
+        cache.put("a", [])
+        cache.put("b", [])
+        cache.get("a")
+        cache.put("c", [("MON", "9:00 AM", "10:00 AM", 60)])
+        cache.save()
+        reloaded = OverlapCache(path, max_entries=2)
+        assert reloaded.get("b") is None
+        assert reloaded.get("c") == [("MON", "9:00 AM", "10:00 AM", 60)]
+
+
+# --- Tests for the course compatibility matrix ---
+
+def test_overlap_minutes_matches_compute_overlaps():
+    """The two-pointer sweep agrees with SearchService._compute_overlaps."""
+    import random
+    from studybuddy.models import AvailabilitySlot
+    from studybuddy.compatibility_service import week_intervals, overlap_minutes
+    rng = random.Random(3)
+
+    def random_slots():
+        svc = AvailabilityService()
+        slots = [AvailabilitySlot(rng.choice(["MON", "TUE", "WED"]), f"{h:02d}:00", f"{h + rng.randint(1, 3):02d}:30")
+                 for h in (rng.randrange(6, 20) for _ in range(6))]
+        return svc._merge(slots)
+
+    for _ in range(50):
+        a, b = random_slots(), random_slots()
+        expected = sum(d for *_, d in SearchService()._compute_overlaps(a, b))
+        assert overlap_minutes(week_intervals(a), week_intervals(b)) == expected
+
+
+@use_temp_stores
+def test_course_matrix_csv_and_parallel_rows():
+    """CSV output is symmetric and the process pool yields the same rows."""
+    from studybuddy.compatibility_service import CompatibilityService
+    _setup_search_and_session_scenario()
+    svc = CompatibilityService()
+    with tempfile.TemporaryDirectory() as d:
+        out = os.path.join(d, "m.csv")
+        emails = svc.course_matrix("CPSC 3720", out, workers=1)
+        with open(out, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    assert emails == ["alice@clemson.edu", "bob@clemson.edu"]
+    assert lines[1] == "alice@clemson.edu,120,60"
+    assert lines[2] == "bob@clemson.edu,60,120"
+
+    _, roster = svc.roster("CPSC 3720")
+    roster = roster * 8
+    serial = [list(r) for r in svc.iter_rows(roster, workers=1)]
+    parallel = [list(r) for r in svc.iter_rows(roster, workers=2, block_rows=3)]
+    assert serial == parallel
+
+
+# --- Tests for study group formation ---
+
+@use_temp_stores
+def test_form_groups_partitions_roster_and_proposes():
+    """Students with matching schedules end up together; sessions get proposed."""
+    from studybuddy.group_service import GroupService
+    ps = ProfileService()
+    avs = AvailabilityService()
+    for i in range(6):
+        email = f"s{i}@clemson.edu"
+        ps.create_profile(f"S{i}", email)
+        ps.add_course(email, "CPSC 3720")
+        # Evens free Monday morning, odds free Tuesday afternoon
+        if i % 2 == 0:
+            avs.add_slot(email, "Mon", "9:00", "11:00")
+        else:
+            avs.add_slot(email, "Tue", "13:00", "15:00")
+    svc = GroupService()
+    groups = svc.form_groups("CPSC 3720", time_budget=0.05)
+    assert sorted(len(g["members"]) for g in groups) == [3, 3]
+    assert all(g["common_minutes"] == 120 for g in groups)
+    assert {g["window"] for g in groups} == {("MON", "09:00", "11:00"), ("TUE", "13:00", "15:00")}
+
+    proposals = svc.propose_group_sessions("CPSC 3720", groups, duration=45)
+    assert [len(p["session_ids"]) for p in proposals] == [2, 2]
+    assert all(not p["errors"] for p in proposals)
+
+
+def test_form_groups_rejects_impossible_sizes():
+    from studybuddy.group_service import _target_sizes
+    assert _target_sizes(11, 3, 5) == [4, 4, 3]
+    with pytest.raises(ValidationError):
+        _target_sizes(2, 3, 5)
+
+
+# --- Tests for the course catalog ---
+
+def test_course_catalog_normalizes_and_interns_consistently():
+    """One normalizer for every service; equal codes share an id."""
+    from studybuddy import course_catalog
+    assert course_catalog.normalize_course(" cpsc3720 ") == "CPSC 3720"
+    assert course_catalog.course_id("CPSC 3720") == course_catalog.course_id("cpsc3720")
+    assert course_catalog.code_for(course_catalog.course_id("math2060")) == "MATH 2060"
+    for svc in (ProfileService, SearchService, SessionService):
+        with pytest.raises(ValidationError):
+            svc._normalize_course("3720 CPSC")
+
+
+@use_temp_stores
+def test_course_index_tracks_enrollment_changes():
+    """The inverted index is rebuilt when the users file changes."""
+    from studybuddy import course_catalog
+    _setup_search_and_session_scenario()
+    cid = course_catalog.course_id("CPSC 3720")
+    assert sorted(course_catalog.current_index().members(cid)) == ["alice@clemson.edu", "bob@clemson.edu"]
+    ProfileService().add_course("charlie@clemson.edu", "CPSC 3720")
+    assert len(course_catalog.current_index().members(cid)) == 3
+    assert cid in course_catalog.current_index().enrollments("CHARLIE@clemson.edu")
+
+
+# --- Tests for buddy recommendations ---
+
+@use_temp_stores
+def test_recommend_buddies_ranks_by_courses_and_time():
+    """Shared courses and overlap both count; strangers are never candidates."""
+    _setup_search_and_session_scenario()
+    ps = ProfileService()
+    avs = AvailabilityService()
+    ps.create_profile("Dana", "dana@clemson.edu")
+    ps.add_course("dana@clemson.edu", "CPSC 3720")
+    ps.add_course("dana@clemson.edu", "MATH 2060")
+    avs.add_slot("dana@clemson.edu", "Mon", "9:00", "9:30")
+    ps.create_profile("Eli", "eli@clemson.edu")
+    avs.add_slot("eli@clemson.edu", "Mon", "9:00", "11:00")
+    svc = SearchService()
+
+    recs = svc.recommend_buddies("alice@clemson.edu", k=10)
+    assert [(r["email"], r["score"]) for r in recs] == [("bob@clemson.edu", 120), ("dana@clemson.edu", 90)]
+
+    # A second shared course lifts Dana and pulls Charlie into the candidates
+    ps.add_course("alice@clemson.edu", "MATH 2060")
+    recs = svc.recommend_buddies("alice@clemson.edu", k=3)
+    assert [(r["email"], r["score"]) for r in recs] == [
+        ("dana@clemson.edu", 150), ("bob@clemson.edu", 120), ("charlie@clemson.edu", 120)]
+    assert recs[0]["shared_courses"] == ["CPSC 3720", "MATH 2060"]
+    assert [r["email"] for r in svc.recommend_buddies("alice@clemson.edu", k=1)] == ["dana@clemson.edu"]
+    # Bob and Charlie tie on score and overlap; the cut at k falls by email
+    assert [r["email"] for r in svc.recommend_buddies("alice@clemson.edu", k=2)] == [
+        "dana@clemson.edu", "bob@clemson.edu"]
+
+
+# --- Tests for the session change feed ---
+
+@use_temp_stores
+def test_changes_since_returns_only_deltas():
+    """Each propose/respond advances the feed; cursors skip seen changes."""
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    cursor, changes = svc.changes_since(0, "bob@clemson.edu")
+    assert (cursor, changes) == (0, [])
+    svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+    svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00")
+    cursor, changes = svc.changes_since(0, "bob@clemson.edu")
+    assert cursor == 2 and [s.id for s in changes] == [1, 2]
+    svc.respond(1, "bob@clemson.edu", "accept")
+    cursor, changes = svc.changes_since(cursor, "bob@clemson.edu")
+    assert cursor == 3
+    assert [(s.id, s.status) for s in changes] == [(1, "accepted")]
+    assert svc.changes_since(cursor, "bob@clemson.edu") == (3, [])
+    assert svc.changes_since(0, "charlie@clemson.edu")[1] == []
+
+
+@use_temp_stores
+def test_wait_for_change_times_out_without_writes():
+    from studybuddy import session_storage
+    version = session_storage.data_version()
+    assert session_storage.wait_for_change(version, timeout=0.05, interval=0.01) is False
+
+
+# --- Tests for request expiry ---
+
+@use_temp_stores
+def test_pending_requests_expire_after_ttl():
+    """Expired requests leave the pending lists and can no longer be answered."""
+    import time
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    s1 = svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30", ttl=60)
+    svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00")
+    assert svc.sweep_expired(now=time.time()) == []
+    expired = svc.sweep_expired(now=s1.expires_at + 1)
+    assert [s.id for s in expired] == [1]
+    assert [s.id for s in svc.incoming_requests("bob@clemson.edu")] == [2]
+    with pytest.raises(ValidationError, match="already finalized"):
+        svc.respond(1, "bob@clemson.edu", "accept")
+    # The expiry is visible to change-feed clients too
+    assert [(s.id, s.status) for s in svc.changes_since(2, "bob@clemson.edu")[1]] == [(1, "expired")]
+
+
+@use_temp_stores
+def test_expiry_index_avoids_scanning_sessions():
+    from studybuddy import file_cache, session_storage
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    s1 = svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30", ttl=60)
+    s2 = svc.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00", message="keep")
+    # A fresh process: nothing cached, and nothing due yet
+    file_cache.invalidate()
+    misses = file_cache.stats["misses"]
+    assert session_storage.expire_due(s1.created_at) == []
+    assert file_cache.stats["misses"] == misses + 1  # the expiry index only, no shard
+    assert session_storage.next_expiry() == s1.expires_at
+    expired = session_storage.expire_due(s1.expires_at + 1)
+    assert [(s.id, s.status) for s in expired] == [(s1.id, "expired")]
+    assert session_storage.next_expiry() is None
+    assert session_storage.get(s2.id) == s2
+
+
+@use_temp_stores
+def test_columnar_sweep_reads_only_due_shards():
+    from studybuddy import file_cache, session_storage
+    from studybuddy.session_table import current_table
+    _setup_search_and_session_scenario()
+    svc = SessionService(columnar=True)
+    s1 = svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30", ttl=60)
+    s2 = svc.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00")
+    table = current_table()
+    file_cache.invalidate()
+    # Nothing due: the columns decide, no session documents are parsed
+    assert svc.sweep_expired(s1.created_at) == []
+    assert not any(file_cache._key(p) in file_cache._CACHE for p in session_storage._shard_paths())
+    assert table.due(s1.expires_at) == [table.ids.index(s1.id)]
+    expired = svc.sweep_expired(s1.expires_at + 1)
+    assert [(s.id, s.status) for s in expired] == [(s1.id, "expired")]
+    assert not any(file_cache._key(p) in file_cache._CACHE for p in session_storage._shard_paths())
+    assert session_storage.next_expiry() is None
+    assert session_storage.get(s2.id) == s2
+
+
+@use_temp_stores
+def test_respond_rejects_request_past_ttl_before_sweep():
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30", ttl=0.01)
+    import time
+    time.sleep(0.02)
+    with pytest.raises(ValidationError, match="expired"):
+        svc.respond(1, "bob@clemson.edu", "accept")
+    assert svc.incoming_requests("bob@clemson.edu") == []
+
+
+# --- Tests for the columnar session table ---
+
+@use_temp_stores
+def test_columnar_queries_match_row_queries():
+    """Columnar mode returns exactly what the list-of-dataclasses path returns."""
+    _setup_search_and_session_scenario()
+    rows = SessionService()
+    cols = SessionService(columnar=True)
+    rows.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30", message="hi")
+    rows.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00", ttl=3600)
+    rows.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:15", "10:45")
+    rows.respond(1, "bob@clemson.edu", "accept")
+    for email in ("alice@clemson.edu", "BOB@clemson.edu", "charlie@clemson.edu"):
+        assert cols.incoming_requests(email) == rows.incoming_requests(email)
+        assert cols.outgoing_requests(email) == rows.outgoing_requests(email)
+        assert cols.confirmed_sessions(email) == rows.confirmed_sessions(email)
+    assert cols.confirmed_sessions("alice@clemson.edu")[0].message == "hi"
+
+
+# --- Tests for streaming CLI output ---
+
+@use_temp_stores
+def test_cli_streams_ndjson_and_json():
+    from studybuddy import cli
+
+    def run(*argv):
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            code = cli.main(list(argv))
+        return code, buf.getvalue()
+
+    _setup_search_and_session_scenario()
+    SessionService().propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+    code, out = run("list-requests", "--email", "bob@clemson.edu", "--format", "ndjson")
+    assert code == 0
+    assert [json.loads(l)["direction"] for l in out.splitlines()] == ["incoming"]
+    code, out = run("search-overlap", "--email", "alice@clemson.edu", "--course", "CPSC 3720", "--format", "json")
+    expected = json.loads(json.dumps(SearchService().overlap_with_classmates("alice@clemson.edu", "CPSC 3720")))
+    assert sorted(json.loads(out), key=lambda r: r["email"]) == sorted(expected, key=lambda r: r["email"])
+    assert json.loads(run("list-sessions", "--email", "bob@clemson.edu", "--format", "json")[1]) == []
+    # Errors surface before any output is written
+    code, out = run("search-overlap", "--email", "nobody@clemson.edu", "--course", "CPSC 3720", "--format", "json")
+    assert code == 1 and out == ""
+
+
+# --- Tests for the batch runner ---
+
+@use_temp_stores
+def test_run_batch_buffers_writes_and_rolls_back_failed_lines():
+    from studybuddy import cli
+    with tempfile.TemporaryDirectory() as d:
+        batch = os.path.join(d, "batch.txt")
+        with open(batch, "w", encoding="utf-8") as f:
+            f.write(
+                "# comment\n"
+                "create-user --name Alice --email alice@clemson.edu\n"
+                "add-course --email alice@clemson.edu --course 'CPSC 3720'\n"
+                "add-course --email ghost@clemson.edu --course 'CPSC 3720'\n"
+                "show-profile --email alice@clemson.edu\n"
+            )
+        err = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(err):
+            assert cli.main(["run-batch", batch, "--atomic"]) == 1
+        assert "line 4: exit 1" in err.getvalue()
+        assert storage.load_all() == []  # atomic: nothing written
+
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            assert cli.main(["run-batch", batch, "--flush-every", "1"]) == 1
+        assert storage.get_by_email("alice@clemson.edu").courses == ["CPSC 3720"]
+
+
+@use_temp_stores
+def test_run_batch_rolls_back_reshard_deletes():
+    from studybuddy import cli, file_cache
+    os.environ["STUDYBUDDY_SHARDS"] = "1"
+    try:
+        _setup_search_and_session_scenario()
+        emails = sorted(u.email for u in storage.load_all())
+        with tempfile.TemporaryDirectory() as d:
+            batch = os.path.join(d, "batch.txt")
+            with open(batch, "w", encoding="utf-8") as f:
+                f.write("reshard --shards 2\nadd-course --email ghost@clemson.edu --course 'CPSC 3720'\n")
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                assert cli.main(["run-batch", batch, "--atomic"]) == 1
+        # The old files are only removed when the new shards are flushed with them
+        assert os.path.exists(os.environ["STUDYBUDDY_DATA_PATH"])
+        assert sorted(u.email for u in storage.load_all()) == emails
+        with file_cache.buffered():
+            storage.reshard(2)
+            assert os.path.exists(os.environ["STUDYBUDDY_DATA_PATH"])
+            file_cache.flush()
+        assert not os.path.exists(os.environ["STUDYBUDDY_DATA_PATH"])
+        os.environ["STUDYBUDDY_SHARDS"] = "2"
+        assert sorted(u.email for u in storage.load_all()) == emails
+    finally:
+        os.environ.pop("STUDYBUDDY_SHARDS", None)
+
+
+@use_temp_stores
+def test_discarded_session_writes_take_their_counters_along():
+    from studybuddy import file_cache, session_storage
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    first = svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+    with file_cache.buffered():
+        dropped = svc.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00", ttl=60)
+    # The id and seq counters and the expiry index were never written
+    assert session_storage.next_expiry() is None
+    again = svc.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00")
+    assert (again.id, again.seq) == (dropped.id, first.seq + 1)
+
+
+# --- Tests for sharded storage ---
+
+@use_temp_stores
+def test_sharded_storage_routes_and_reshards():
+    from studybuddy import file_cache, session_storage, sharding
+    _setup_search_and_session_scenario()
+    svc = SessionService()
+    svc.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+    before = (sorted(u.email for u in storage.load_all()), svc.incoming_requests("bob@clemson.edu"))
+    storage.reshard(3)
+    session_storage.reshard(3)
+    os.environ["STUDYBUDDY_SHARDS"] = "3"
+    try:
+        assert not os.path.exists(os.environ["STUDYBUDDY_DATA_PATH"])
+        assert (sorted(u.email for u in storage.load_all()), svc.incoming_requests("bob@clemson.edu")) == before
+        # Single-user writes touch only the owning shard
+        paths = sharding.shard_paths(storage._data_path(), 3)
+        owner = paths[sharding.shard_of("zed@clemson.edu", 3)]
+        sigs = {p: file_cache.signature(p) for p in paths}
+        ProfileService().create_profile("Zed", "zed@clemson.edu")
+        assert [p for p in paths if file_cache.signature(p) != sigs[p]] == [owner]
+        s = svc.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:30", "11:00")
+        assert s.id % 3 == sharding.shard_of("alice@clemson.edu", 3)
+        assert session_storage.get(s.id) == s
+        assert svc.respond(s.id, "alice@clemson.edu", "accept").status == "accepted"
+        assert [x.id for x in svc.changes_since(0, "alice@clemson.edu")[1]][-1] == s.id
+        storage.reshard(1)
+        session_storage.reshard(1)
+    finally:
+        os.environ.pop("STUDYBUDDY_SHARDS", None)
+    assert len(storage.load_all()) == len(before[0]) + 1
+
+
+@use_temp_stores
+def test_concurrent_shard_writers_share_one_seq_order():
+    import subprocess
+    import sys
+    from studybuddy import session_storage, sharding
+    code = (
+        "import sys\n"
+        "from studybuddy import session_storage\n"
+        "from studybuddy.session_models import StudySession\n"
+        "w = int(sys.argv[1])\n"
+        "for i in range(10):\n"
+        "    session_storage.upsert(StudySession(0, 'a@clemson.edu', f'u{w}-{i}@clemson.edu',\n"
+        "                                        'CPSC 3720', 'MON', '09:00', '10:00'))\n"
+    )
+    env = dict(os.environ, STUDYBUDDY_SHARDS="3")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    procs = [subprocess.Popen([sys.executable, "-c", code, str(w)], cwd=root, env=env) for w in range(4)]
+    assert [p.wait() for p in procs] == [0] * 4
+    os.environ["STUDYBUDDY_SHARDS"] = "3"
+    try:
+        seqs = sorted(s.seq for s in session_storage.load_all())
+        # One counter for all shards: no gaps or repeats, so cursors see everything
+        assert seqs == list(range(1, 41))
+        assert [s.seq for s in session_storage.changes_since(30)] == list(range(31, 41))
+        # New sessions get distinct ids from one counter, each naming its shard
+        sessions = session_storage.load_all()
+        assert len({s.id for s in sessions}) == 40
+        assert all(s.id % 3 == sharding.shard_of(s.invitee, 3) for s in sessions)
+    finally:
+        os.environ.pop("STUDYBUDDY_SHARDS", None)
+
+
+# --- Tests for log-shipping replication ---
+
+_REPLICATION_KEYS = ("STUDYBUDDY_DATA_PATH", "STUDYBUDDY_SESSIONS_PATH", "STUDYBUDDY_REPLICATION_LOG",
+                     "STUDYBUDDY_REPLICA_OF", "STUDYBUDDY_SHARDS", "STUDYBUDDY_SNAPSHOTS")
+
+
+@contextlib.contextmanager
+def _primary_and_replica():
+    """Temporary primary and replica stores sharing one mutation log.
+
+    Yields ``use(role)``, which points the environment at the "primary" or
+    the "replica" store, and the log directory. The stores use the plain
+    single-file layout (no shards or snapshots), so tests can inject faults
+    at the file level.
+    """
+    from studybuddy import file_cache
+    saved = {k: os.environ.get(k) for k in _REPLICATION_KEYS}
+    with tempfile.TemporaryDirectory() as d:
+        log = os.path.join(d, "log")
+
+        def use(role):
+            os.environ.pop("STUDYBUDDY_REPLICATION_LOG", None)
+            os.environ.pop("STUDYBUDDY_REPLICA_OF", None)
+            os.environ.update({
+                "STUDYBUDDY_DATA_PATH": os.path.join(d, role, "users.json"),
+                "STUDYBUDDY_SESSIONS_PATH": os.path.join(d, role, "sessions.json"),
+                "STUDYBUDDY_SHARDS": "1",
+                "STUDYBUDDY_SNAPSHOTS": "0",
+                "STUDYBUDDY_REPLICA_OF" if role == "replica" else "STUDYBUDDY_REPLICATION_LOG": log,
+            })
+
+        try:
+            yield use, log
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            file_cache.invalidate()
+
+
+def _cli(*argv):
+    """Run the CLI in-process; returns (exit code, stdout)."""
+    from studybuddy import cli
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        code = cli.main(list(argv))
+    return code, out.getvalue()
+
+
+def test_replica_applies_primary_log_and_reports_lag():
+    from studybuddy import session_storage
+    with _primary_and_replica() as (use, log):
+        use("primary")
+        _setup_search_and_session_scenario()
+        s = SessionService().propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+        expected = SearchService().overlap_with_classmates("alice@clemson.edu", "CPSC 3720")
+
+        use("replica")
+        code, out = _cli("replication-status")
+        assert code == 0 and out.startswith("applied=0 pending=") and "pending=0" not in out
+        with pytest.raises(ValidationError, match="read-only replica"):
+            ProfileService().create_profile("Eve", "eve@clemson.edu")
+        # Bounded staleness: an old backlog is applied before the query runs
+        assert SearchService(max_staleness=0).overlap_with_classmates("alice@clemson.edu", "CPSC 3720") == expected
+        assert "pending=0" in _cli("replication-status")[1]
+        assert [x.seq for x in session_storage.load_all()] == [1]
+        assert not os.path.exists(os.path.join(os.path.dirname(os.environ["STUDYBUDDY_DATA_PATH"]),
+                                                "overlap_cache.ndjson"))  # replicas only read it
+
+        use("primary")
+        SessionService().respond(s.id, "bob@clemson.edu", "accept")
+        use("replica")
+        assert " pending=1 " in _cli("replication-status")[1]
+        code, out = _cli("replicate")
+        assert code == 0 and out.startswith("Applied 1 mutation(s)") and "pending=0" in out
+        assert [x.status for x in session_storage.load_all()] == ["accepted"]
+
+
+def test_replica_follows_compaction_and_never_misses_a_logged_write():
+    from studybuddy import session_storage
+    with _primary_and_replica() as (use, log):
+        use("primary")
+        _setup_search_and_session_scenario()
+        s = SessionService().propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+        use("replica")
+        assert _cli("replicate")[1].endswith("pending=0 lag=0.0s\n")
+        assert _cli("replicate")[1].startswith("Applied 0 mutation(s)")
+
+        use("primary")
+        SessionService().respond(s.id, "bob@clemson.edu", "accept")
+        # The log entry lands before the data write, so a crash in between is
+        # not lost: a directory in place of the temp file fails the write
+        blocker = os.path.splitext(os.environ["STUDYBUDDY_DATA_PATH"])[0] + ".tmp"
+        os.mkdir(blocker)
+        with pytest.raises(OSError):
+            ProfileService().create_profile("Eve", "eve@clemson.edu")
+        os.rmdir(blocker)
+        with open(os.path.join(log, "mutations.ndjson"), encoding="utf-8") as f:
+            assert "eve@clemson.edu" in f.readlines()[-1]
+        assert storage.get_by_email("eve@clemson.edu") is None
+        ProfileService().create_profile("Eve", "eve@clemson.edu")
+        log_size = os.path.getsize(os.path.join(log, "mutations.ndjson"))
+        code, out = _cli("compact-log")
+        assert code == 0 and out.startswith("Mutation log compacted to ")
+        assert os.path.getsize(os.path.join(log, "mutations.ndjson")) < log_size
+
+        use("replica")
+        assert " pending=3 " in _cli("replication-status")[1]  # start marker, users, sessions
+        code, out = _cli("replicate")
+        assert out.startswith("Applied 3 mutation(s)") and "pending=0" in out
+        assert [x.status for x in session_storage.load_all()] == ["accepted"]
+        assert storage.get_by_email("eve@clemson.edu") is not None
+
+
+# --- Tests for snapshot-isolated reads ---
+
+@use_temp_stores
+def test_pinned_snapshot_ignores_concurrent_writer():
+    import glob
+    import subprocess
+    import sys
+    from studybuddy import snapshots
+    os.environ["STUDYBUDDY_SNAPSHOTS"] = "1"
+    try:
+        _setup_search_and_session_scenario()
+        data_dir = os.path.dirname(os.environ["STUDYBUDDY_DATA_PATH"])
+        assert not os.path.exists(os.environ["STUDYBUDDY_DATA_PATH"])
+        before = sorted(u.email for u in storage.load_all())
+        with snapshots.pinned():
+            subprocess.run(
+                [sys.executable, "-m", "studybuddy.cli", "create-user", "--name", "Zed", "--email", "zed@clemson.edu"],
+                check=True, capture_output=True, env=dict(os.environ),
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            )
+            assert sorted(u.email for u in storage.load_all()) == before
+            assert SearchService().classmates_in_course("alice@clemson.edu", "CPSC 3720")
+        assert "zed@clemson.edu" in [u.email for u in storage.load_all()]
+        assert len(glob.glob(os.path.join(data_dir, "users.g*.json"))) > 1
+        snapshots.collect_garbage(grace=0)
+        assert len(glob.glob(os.path.join(data_dir, "users.g*.json"))) == 1
+        assert storage.get_by_email("zed@clemson.edu") is not None
+    finally:
+        os.environ.pop("STUDYBUDDY_SNAPSHOTS", None)
+
+
+@use_temp_stores
+def test_sharded_save_all_commits_one_generation():
+    from studybuddy import snapshots
+    os.environ["STUDYBUDDY_SNAPSHOTS"] = "1"
+    os.environ["STUDYBUDDY_SHARDS"] = "4"
+    try:
+        _setup_search_and_session_scenario()
+        users = storage.load_all()
+        generation = snapshots.current()["generation"]
+        storage.save_all(users)
+        manifest = snapshots.current()
+        assert manifest["generation"] == generation + 1
+        shard_files = [v for k, v in manifest["files"].items() if os.path.basename(k).startswith("users.")]
+        assert len(shard_files) == 4 and all(f".g{generation + 1:08d}." in f for f in shard_files)
+        storage.reshard(2)
+        assert snapshots.current()["generation"] == generation + 2
+        os.environ["STUDYBUDDY_SHARDS"] = "2"
+        assert sorted(u.email for u in storage.load_all()) == sorted(u.email for u in users)
+    finally:
+        os.environ.pop("STUDYBUDDY_SNAPSHOTS", None)
+        os.environ.pop("STUDYBUDDY_SHARDS", None)
+
+
+# --- Tests for the data-file serializer ---
+
+@use_temp_store
+def test_schema1_file_is_migrated_and_rewritten_compactly():
+    from studybuddy import file_cache, serialization
+    path = os.environ["STUDYBUDDY_DATA_PATH"]
+    with open(path, "w") as f:
+        json.dump({"users": [{"name": "Old", "email": "old@clemson.edu", "courses": ["CPSC 3720"],
+                              "availability": [{"day": "MON", "start": "09:00", "end": "10:00"}]}]}, f, indent=2)
+    file_cache.invalidate()
+    assert storage.get_by_email("old@clemson.edu").availability[0].end == "10:00"
+    AvailabilityService().add_slot("old@clemson.edu", "Tue", "9am", "10am")
+    with open(path, "rb") as f:
+        raw = f.read()
+    assert b"\n" not in raw
+    doc = json.loads(raw)
+    assert doc["schema_version"] == serialization.SCHEMA_VERSION
+    assert doc["users"][0]["availability"] == [["MON", "09:00", "10:00"], ["TUE", "09:00", "10:00"]]
+
+
+def test_serializer_stdlib_fallback_and_newer_schema():
+    from studybuddy import serialization
+    doc = {"users": [{"name": "A", "email": "a@clemson.edu", "availability": [["MON", "09:00", "10:00"]]}]}
+    accel = serialization._accel()
+    serialization._orjson = None
+    try:
+        blob = serialization.dumps(doc)
+        assert serialization.loads(blob) == {"schema_version": serialization.SCHEMA_VERSION, **doc}
+    finally:
+        serialization._orjson = accel
+    if accel is not None:
+        assert serialization.loads(serialization.dumps(doc)) == serialization.loads(blob)
+    with pytest.raises(ValidationError, match="newer"):
+        serialization.loads(json.dumps({"schema_version": serialization.SCHEMA_VERSION + 1}).encode())
+
+
+# --- Tests for find-user ---
+
+@use_temp_store
+def test_find_users_prefix_fuzzy_and_incremental_updates():
+    from studybuddy import user_search
+    svc = ProfileService()
+    svc.create_profile("Alice Johnson", "ajohnson@clemson.edu")
+    svc.create_profile("Alicia Keys", "akeys@clemson.edu")
+    svc.create_profile("Bob Jones", "bjones@clemson.edu")
+    assert [m["email"] for m in svc.find_users("alice")] == ["ajohnson@clemson.edu", "akeys@clemson.edu"]
+    assert svc.find_users("alice")[0]["match"] == "exact"
+    assert [m["email"] for m in svc.find_users("BJON")] == ["bjones@clemson.edu"]
+    typo = svc.find_users("jonhson")
+    assert [(m["email"], m["match"], m["distance"]) for m in typo] == [("ajohnson@clemson.edu", "fuzzy", 1)]
+    assert svc.find_users("zzzz") == []
+    # create_profile folds the new user into the cached index
+    index = user_search.current_index()
+    svc.create_profile("Carol Johnston", "cjohnston@clemson.edu")
+    assert user_search.current_index() is index
+    assert [m["email"] for m in svc.find_users("johns")] == ["ajohnson@clemson.edu", "cjohnston@clemson.edu"]
+    with pytest.raises(ValidationError):
+        svc.find_users("   ")
+
+
+@use_temp_stores
+def test_day_intervals_follow_availability_content():
+    """The per-date cache is keyed on slots and overrides, not a counter."""
+    from datetime import date
+    from studybuddy.availability_service import day_intervals
+    from studybuddy.models import AvailabilityOverride, AvailabilitySlot
+    _setup_search_and_session_scenario()
+    monday = date(2026, 10, 19)
+    bob = storage.get_by_email("bob@clemson.edu")
+    before = day_intervals(bob, monday)
+    # Rewritten directly (a restore or a replica apply): nothing is bumped
+    bob.availability = [AvailabilitySlot("MON", "13:00", "14:00")]
+    storage.upsert(bob)
+    assert day_intervals(storage.get_by_email("bob@clemson.edu"), monday) == ((780, 840),) != before
+    bob.overrides = [AvailabilityOverride("2026-10-19", "13:00", "13:30", kind="block")]
+    storage.upsert(bob)
+    assert day_intervals(storage.get_by_email("bob@clemson.edu"), monday) == ((810, 840),)
+
+
+@use_temp_store
+def test_find_users_reuses_persisted_index_across_processes():
+    from studybuddy import file_cache, user_search
+    svc = ProfileService()
+    svc.create_profile("Alice Johnson", "ajohnson@clemson.edu")
+    svc.find_users("alice")
+    assert os.path.exists(user_search._index_path())
+    # A fresh process loads the saved index instead of parsing users.json
+    user_search._cached = None
+    file_cache.invalidate()
+    misses = file_cache.stats["misses"]
+    assert [m["email"] for m in svc.find_users("jonhson")] == ["ajohnson@clemson.edu"]
+    assert file_cache.stats["misses"] == misses
+    # Users created since are folded in; a rename forces a rebuild
+    svc.create_profile("Bob Jones", "bjones@clemson.edu")
+    user_search._cached = None
+    assert [m["email"] for m in svc.find_users("bjo")] == ["bjones@clemson.edu"]
+    bob = storage.get_by_email("bjones@clemson.edu")
+    bob.name = "Robert Jones"
+    storage.upsert(bob)
+    user_search._cached = None
+    assert [m["name"] for m in svc.find_users("robert")] == ["Robert Jones"]
+    assert [m["match"] for m in svc.find_users("bob")] == ["fuzzy"]  # "rob", no longer an exact token
+
+
+@use_temp_stores
+def test_date_overrides_shape_dated_overlaps_and_one_off_sessions():
+    _setup_search_and_session_scenario()
+    avs = AvailabilityService()
+    # 2026-10-19 is a Monday, 2026-10-20 a Tuesday
+    avs.add_override("bob@clemson.edu", "2026-10-19", "10:00", "10:30", block=True)
+    avs.add_override("alice@clemson.edu", "2026-10-20", "13:00", "14:00")
+    avs.add_override("bob@clemson.edu", "2026-10-20", "13:30", "15:00")
+    assert [(o.date, o.kind) for o in avs.list_overrides("bob@clemson.edu")] == [
+        ("2026-10-19", "block"), ("2026-10-20", "add")]
+    days = avs.dated_availability("bob@clemson.edu", "2026-10-19", "2026-10-21")
+    assert days == {"2026-10-19": [("10:30 AM", "12:00 PM")], "2026-10-20": [("1:30 PM", "3:00 PM")], "2026-10-21": []}
+
+    search = SearchService()
+    (bob,) = search.overlap_with_classmates("alice@clemson.edu", "CPSC 3720", "2026-10-19", "2026-10-26")
+    assert bob["overlaps"] == {"2026-10-19": [("10:30 AM", "11:00 AM", 30)], "2026-10-20": [("1:30 PM", "2:00 PM", 30)],
+                               "2026-10-26": [("10:00 AM", "11:00 AM", 60)]}
+    assert bob["total_minutes"] == 120
+    # The weekly view ignores overrides
+    assert search.overlap_with_classmates("alice@clemson.edu", "CPSC 3720")[0]["total_minutes"] == 60
+
+    sessions = SessionService()
+    one_off = sessions.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", None, "13:30", "14:00", date="2026-10-20")
+    assert (one_off.day, one_off.date) == ("TUE", "2026-10-20")
+    with pytest.raises(ValidationError):  # blocked on that Monday only
+        sessions.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "11:00", date="2026-10-19")
+    with pytest.raises(ValidationError):  # wrong weekday for the date
+        sessions.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "13:30", "14:00", date="2026-10-20")
+    weekly = sessions.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "11:00")
+    assert weekly.date is None
+
+    avs.remove_override("bob@clemson.edu", 1)
+    assert avs.dated_availability("bob@clemson.edu", "2026-10-19", "2026-10-19") == {"2026-10-19": [("10:00 AM", "12:00 PM")]}
+    with pytest.raises(ValidationError):
+        avs.dated_availability("bob@clemson.edu", "2026-01-01", "2027-06-01")
+
+
+@use_temp_stores
+def test_export_ical_rewrites_only_changed_feeds():
+    from studybuddy.ical_service import ICalService, feed_etag, feed_path
+    _setup_search_and_session_scenario()
+    sessions = SessionService()
+    s = sessions.propose("alice@clemson.edu", "bob@clemson.edu", "CPSC 3720", "Mon", "10:00", "11:00", message="Ch 5, review")
+    sessions.respond(s.id, "bob@clemson.edu", "accept")
+    svc = ICalService()
+    with tempfile.TemporaryDirectory() as out:
+        first = svc.export(out)
+        assert first["written"] == ["alice@clemson.edu", "bob@clemson.edu"]
+        text = feed_path(out, "alice@clemson.edu").read_text()
+        assert f"UID:session-{s.id}@studybuddy" in text and "RRULE:FREQ=WEEKLY;BYDAY=MO" in text
+        assert "SUMMARY:CPSC 3720 study session with bob@clemson.edu" in text
+        assert "DESCRIPTION:Ch 5\\, review" in text
+        tag = feed_etag(out, "alice@clemson.edu")
+        # Nothing changed: nothing re-rendered
+        assert svc.export(out)["checked"] == 0
+        # A pending proposal touches both users but leaves their feeds identical
+        pending = sessions.propose("bob@clemson.edu", "alice@clemson.edu", "CPSC 3720", "Mon", "10:00", "10:30")
+        again = svc.export(out)
+        assert (again["checked"], again["written"]) == (2, [])
+        sessions.respond(pending.id, "alice@clemson.edu", "accept")
+        assert svc.export(out)["written"] == ["alice@clemson.edu", "bob@clemson.edu"]
+        assert feed_etag(out, "alice@clemson.edu") != tag
+        assert feed_path(out, "alice@clemson.edu").read_text().count("BEGIN:VEVENT") == 2
+        assert not feed_path(out, "charlie@clemson.edu").exists()
+        assert svc.export(out, full=True)["written"] == []
+
+
+def test_ical_dates_use_local_time_and_export_stamp():
+    import time
+    from datetime import datetime, timezone
+    from studybuddy.ical_service import render
+    from studybuddy.session_models import StudySession
+    now = datetime(2026, 10, 21, 12, 0, tzinfo=timezone.utc)
+    # Proposed on a local Monday evening: the weekly series starts that Monday
+    evening = time.mktime((2026, 10, 19, 23, 30, 0, 0, 0, -1))
+    s = StudySession(1, "a@clemson.edu", "b@clemson.edu", "CPSC 3720", "MON", "18:00", "19:00",
+                     status="accepted", created_at=evening)
+    text = render("a@clemson.edu", [s], now=now)
+    assert "DTSTART:20261019T180000" in text and "DTSTAMP:20261021T120000Z" in text
+    # Legacy sessions without created_at start from the export date
+    s.created_at = None
+    assert "DTSTART:20261026T180000" in render("a@clemson.edu", [s], now=now)